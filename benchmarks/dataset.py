@@ -0,0 +1,153 @@
+"""
+Synthetic NASA Meteorite Landings dataset for the benchmarks
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module generates records shaped like the rows returned by the NASA Meteorite Landings
+API (Socrata JSON, numbers as strings, system fields included), following the distributions
+of the real dataset: the most frequent recclass values, the Antarctic and hot desert finds,
+the (0, 0) and missing coordinates, the historic falls and the malformed values.
+
+The records are generated in blocks of BLOCK_SIZE rows, each block from its own seeded
+random generator, so any range of rows can be produced in constant memory and the same
+(seed, row) always gives the same record, even with 10M rows.
+
+Usage:
+    - Call records(start, stop, seed) to get the rows in [start, stop).
+    - Call pages(rows, page_size, seed) to iterate the dataset page by page.
+"""
+import random
+
+BLOCK_SIZE = 1000
+
+# Named sizes accepted by the benchmarks
+SIZES = {"45k": 45_716, "1M": 1_000_000, "10M": 10_000_000}
+
+# recclass frequencies of the real dataset (top values, the tail is grouped in the last rows)
+RECCLASS_WEIGHTS = [
+    ("L6", 8285), ("H5", 7142), ("L5", 4796), ("H6", 4528), ("H4", 4211), ("LL5", 2766),
+    ("LL6", 2043), ("L4", 1253), ("H4/5", 428), ("CM2", 416), ("H3", 386), ("L3", 368),
+    ("CO3", 335), ("Ureilite", 300), ("Iron, IIIAB", 285), ("LL4", 272), ("CV3", 217),
+    ("Howardite", 215), ("Eucrite-pmict", 209), ("Diogenite", 194), ("LL3", 162),
+    ("Mesosiderite", 150), ("EH3", 120), ("CK4", 96), ("Pallasite", 88), ("Iron, IAB-MG", 80),
+    ("R3.8", 60), ("Acapulcoite", 58), ("Lodranite", 40), ("Aubrite", 36), ("Angrite", 30),
+    ("Martian (shergottite)", 90), ("Brachinite", 28), ("Winonaite", 27), ("Iron, IVA", 72),
+    ("Iron, IIAB", 103), ("CR2", 110), ("EL6", 45), ("K3", 4),
+    ("OC", 350), ("Stone-uncl", 120), ("Iron, ungrouped", 150), ("Unknown", 20), ("Chondrite-ung", 60)
+]
+
+# Where the meteorites are found: ((min lat, max lat), (min lon, max lon), weight)
+REGION_WEIGHTS = [
+    ((-86.0, -72.0), (-180.0, 180.0), 22000), # Antarctica
+    ((20.0, 32.0), (-15.0, 10.0), 6000), # North West Africa
+    ((24.0, 30.0), (10.0, 25.0), 1500), # Libya
+    ((18.0, 21.0), (53.0, 58.0), 3000), # Oman
+    ((25.0, 49.0), (-124.0, -67.0), 1800), # United States
+    ((36.0, 71.0), (-10.0, 40.0), 900), # Europe
+    ((-32.0, -30.0), (125.0, 130.0), 700), # Nullarbor
+    ((-55.0, 12.0), (-82.0, -34.0), 500), # South America
+    ((-10.0, 81.0), (26.0, 180.0), 800), # Asia
+    (None, None, 6400), # (0, 0)
+    (None, None, 7300), # No coordinates
+]
+
+_UPDATED_AT = "2024-01-01T00:00:00.000Z"
+
+def _cumulative(weights):
+    values, totals, total = [], [], 0
+    for value, weight in weights:
+        total += weight
+        values.append(value)
+        totals.append(total)
+    return values, totals
+
+_RECCLASS = _cumulative(RECCLASS_WEIGHTS)
+_REGIONS = _cumulative([((lat, lon, i), weight) for i, (lat, lon, weight) in enumerate(REGION_WEIGHTS)])
+
+def _year(rnd: random.Random):
+    """
+    Returns the year field: mostly modern finds, some historic falls, a few missing or malformed values.
+    """
+    draw = rnd.random()
+    if draw < 0.006:
+        return None
+    if draw < 0.008:
+        return rnd.choice(["0860-01-01T00:00:00.000", "2101-01-01T00:00:00.000", "1688-01-01T00:00:00", "unknown"])
+    if draw < 0.10:
+        return f"{rnd.randint(1800, 1969)}-01-01T00:00:00.000"
+    return f"{min(2013, int(rnd.triangular(1970, 2014, 2003)))}-01-01T00:00:00.000"
+
+def _record(rnd: random.Random, row: int) -> dict:
+    """
+    Generates the record of the row.
+    """
+    recclass = rnd.choices(_RECCLASS[0], cum_weights=_RECCLASS[1])[0]
+    lat_range, lon_range, region = rnd.choices(_REGIONS[0], cum_weights=_REGIONS[1])[0]
+    record = {
+        "name": f"Synthetic {row:08d}",
+        "id": str(row + 1),
+        "nametype": "Valid" if rnd.random() > 0.002 else "Relict",
+        "recclass": recclass,
+        "fall": "Found" if rnd.random() > 0.025 else "Fell",
+        ":id": f"row-{row:08d}",
+        ":updated_at": _UPDATED_AT
+    }
+    if rnd.random() > 0.003:
+        record["mass"] = str(round(rnd.lognormvariate(3.5, 2.2), 2)) if rnd.random() > 0.001 else "0"
+    year = _year(rnd)
+    if year is not None:
+        record["year"] = year
+    if lat_range is not None:
+        lat = round(rnd.uniform(*lat_range), 5)
+        lon = round(rnd.uniform(*lon_range), 5)
+    elif region == len(REGION_WEIGHTS) - 2:
+        lat, lon = 0.0, 0.0
+    else:
+        return record
+    record["reclat"] = str(lat)
+    record["reclong"] = str(lon)
+    record["geolocation"] = {"latitude": str(lat), "longitude": str(lon)}
+    return record
+
+def records(start, stop, seed=0) -> list:
+    """
+    Returns the records of the rows in [start, stop).
+
+    Args:
+        start (int): The first row.
+        stop (int): The row after the last one.
+        seed (int): The seed of the dataset.
+
+    Returns:
+        list: The records, in row order.
+    """
+    result = []
+    for block in range(start // BLOCK_SIZE, (stop + BLOCK_SIZE - 1) // BLOCK_SIZE):
+        rnd = random.Random(f"{seed}:{block}")
+        first = block * BLOCK_SIZE
+        for row in range(first, first + BLOCK_SIZE):
+            record = _record(rnd, row) # Every row consumes the generator, so the block is the same for any range
+            if start <= row < stop:
+                result.append(record)
+    return result
+
+def pages(rows, page_size=1000, seed=0):
+    """
+    Yields the dataset page by page.
+
+    Args:
+        rows (int): The number of rows of the dataset.
+        page_size (int): The number of rows of each page.
+        seed (int): The seed of the dataset.
+
+    Returns:
+        Generator[list]: The pages.
+    """
+    for offset in range(0, rows, page_size):
+        yield records(offset, min(offset + page_size, rows), seed)
+
+def parse_size(size) -> int:
+    """
+    Converts a named size (45k, 1M, 10M) or a number of rows to the number of rows.
+    """
+    return SIZES[size] if size in SIZES else int(size)
@@ -0,0 +1,196 @@
+"""
+Stub services for the benchmarks
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the local replacements of the external services, so the benchmarks
+measure the ETL code and not the network:
+- StubNasaServer: a local HTTP server answering like the Socrata API of the NASA dataset.
+- StubGeocoder: an offline geocoder with a configurable latency.
+- ThrowawayDatabase: a PostgreSQL database created from init-scripts/init.sql and dropped at the end.
+
+Dependencies:
+- http.server: For the stub HTTP server.
+- psycopg2: For creating and dropping the throwaway database.
+
+Usage:
+    - Use the classes with `with`.
+"""
+from benchmarks import dataset
+from etl.geocoder import Geocoder
+from models.dimension_location_model import DimensionLocationModel
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from sqlalchemy.engine import make_url
+from typing import Dict, Iterable
+
+import json
+import os
+import threading
+import time
+import psycopg2
+
+class StubNasaServer:
+
+    """
+    A local HTTP server serving the synthetic dataset with the Socrata parameters used by the
+    extractors: $limit, $offset and the ':updated_at >' condition of $where.
+
+    Attributes:
+        rows (int): The number of rows of the dataset.
+        seed (int): The seed of the dataset.
+        url (str): The URL of the resource, available after the server is started.
+    """
+
+    def __init__(self, rows, seed=0):
+        """
+        Initializes the server, it is started by `with`.
+
+        Args:
+            rows (int): The number of rows of the dataset.
+            seed (int): The seed of the dataset.
+        """
+        self.rows = rows
+        self.seed = seed
+        self.url = None
+        self.__server = None
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                offset = int(query.get("$offset", ["0"])[0])
+                limit = int(query.get("$limit", ["1000"])[0])
+                page = dataset.records(offset, min(offset + limit, stub.rows), stub.seed) if offset < stub.rows else []
+                where = query.get("$where", [""])[0]
+                if where.startswith(":updated_at >"):
+                    since = where.split("'")[1]
+                    page = [r for r in page if r[":updated_at"].rstrip("Z") > since]
+                body = json.dumps(page).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.__server.server_port}/resource/gh4g-9sfh.json"
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+class StubGeocoder(Geocoder):
+
+    """
+    An offline geocoder giving a deterministic location for every point.
+
+    The points of the Antarctica and of the oceans (outside the synthetic regions) can't be
+    resolved, like with the real service.
+
+    Attributes:
+        latency (float): Seconds spent for every resolved point, to simulate a remote service.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        Initializes the StubGeocoder.
+
+        Args:
+            latency (float): Seconds spent for every resolved point.
+        """
+        self.latency = latency
+
+    def reverse(self, coordinates: tuple) -> DimensionLocationModel:
+        return self.reverse_many([coordinates])[coordinates]
+
+    def reverse_many(self, coordinates: Iterable[tuple]) -> Dict[tuple, DimensionLocationModel]:
+        result = {}
+        for lat, lon in dict.fromkeys(coordinates):
+            if self.latency:
+                time.sleep(self.latency)
+            if lat < -60.0:
+                result[(lat, lon)] = None
+                continue
+            result[(lat, lon)] = DimensionLocationModel(
+                latitude=lat,
+                longitude=lon,
+                city=f"City {int(lat)} {int(lon)}",
+                state=f"State {int(lat) // 5} {int(lon) // 5}",
+                country=f"Country {int(lat) // 20} {int(lon) // 20}"
+            )
+        return result
+
+class ThrowawayDatabase:
+
+    """
+    A PostgreSQL database created with the schema of init-scripts/init.sql and dropped by `with`.
+
+    Attributes:
+        admin_url (str): The SQLAlchemy URL of an existing database of the server, used to create the new one.
+        url (str): The SQLAlchemy URL of the throwaway database, available after `with`.
+    """
+
+    _INIT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "init-scripts", "init.sql")
+
+    def __init__(self, admin_url):
+        """
+        Initializes the ThrowawayDatabase, it is created by `with`.
+
+        Args:
+            admin_url (str): The SQLAlchemy URL of an existing database of the server.
+        """
+        self.admin_url = admin_url
+        self.url = None
+        self.__name = f"etl_benchmark_{os.getpid()}_{int(time.time() * 1000)}"
+
+    def __enter__(self):
+        self.__execute_admin(f'CREATE DATABASE "{self.__name}"')
+        url = make_url(self.admin_url).set(database=self.__name)
+        self.url = url.render_as_string(hide_password=False)
+        with open(self._INIT_SCRIPT) as file:
+            script = file.read()
+        connection = psycopg2.connect(**self.__connect_args(url))
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(script)
+            connection.commit()
+        finally:
+            connection.close()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__execute_admin(f'DROP DATABASE IF EXISTS "{self.__name}" WITH (FORCE)')
+
+    def __execute_admin(self, statement):
+        """
+        Executes a statement outside a transaction on the admin database.
+        """
+        connection = psycopg2.connect(**self.__connect_args(make_url(self.admin_url)))
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(statement)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def __connect_args(url) -> dict:
+        """
+        Converts a SQLAlchemy URL to the arguments of psycopg2.connect.
+        """
+        args = {"dbname": url.database}
+        for key, value in (("user", url.username), ("password", url.password), ("host", url.host), ("port", url.port)):
+            if value is not None:
+                args[key] = value
+        args.update(url.query) # e.g. host=/tmp for a Unix socket
+        return args
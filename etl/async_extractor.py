@@ -0,0 +1,243 @@
+"""
+AsyncExtractor Class for NASA Meteorite Landings API
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the AsyncExtractor class that retrieves all the pages of
+NASA's Meteorite Landings API with asyncio. A single pooled keep-alive client is
+shared by a configurable number of concurrent requests, and the pages are requested
+until the API returns an empty page, so the size of the dataset is not required.
+With a PageCache the requests are conditional and the unchanged pages are read from disk.
+
+Dependencies:
+- aiohttp: For the asynchronous HTTP client.
+- PageCache: Custom class keeping the raw pages and their validators on disk.
+
+Usage:
+    - Create an instance of AsyncExtractor.
+    - Iterate the pages returned by iter_pages (synchronous) or pages (asynchronous).
+"""
+from etl.metrics import metrics
+from etl.page_cache import PageCache
+import aiohttp
+import asyncio
+import json
+import logging
+import threading
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+class AsyncExtractor:
+
+    """
+    A class to handle the concurrent data extraction from NASA's Meteorite Landings API.
+
+    Every worker takes the next offset not yet requested, so the pages are requested in
+    order with at most `concurrency` requests in flight. When a page is empty or shorter
+    than `page_size` the end of the dataset is reached and no more offsets are requested.
+
+    Attributes:
+        endpoint (str): The URL of the API, it can point to a local stub server for testing.
+        page_size (int): The number of records requested for each page ($limit), also used as offset step.
+        concurrency (int): The maximum number of requests in flight.
+        timeout (float): The timeout in seconds of each request.
+        updated_since (str): If set, only the records updated after this timestamp are requested.
+        skip_offsets (set): The offsets of the full pages already retrieved (e.g. by a failed run), not requested again.
+        page_cache (PageCache): The on-disk cache of the raw pages, None to always download the pages.
+    """
+
+    _NASA_API_ENDPOINT = "https://data.nasa.gov/resource/gh4g-9sfh.json"
+    _CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, endpoint=None, page_size=1000, concurrency=5, timeout=60.0, updated_since=None, skip_offsets=None, page_cache: PageCache = None):
+        """
+        Initializes the AsyncExtractor class.
+
+        Args:
+            endpoint (str): The URL of the API, if None the NASA endpoint is used.
+            page_size (int): The number of records for each page.
+            concurrency (int): The maximum number of requests in flight.
+            timeout (float): The timeout in seconds of each request.
+            updated_since (str): If set, only the records updated after this timestamp (:updated_at) are requested.
+            skip_offsets (set): The offsets of the full pages already retrieved, not requested again.
+            page_cache (PageCache): The on-disk cache of the raw pages, None to always download the pages.
+        """
+        self.endpoint = endpoint or self._NASA_API_ENDPOINT
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.updated_since = updated_since
+        self.skip_offsets = set(skip_offsets or ())
+        self.page_cache = page_cache
+
+    async def fetch_page(self, session: aiohttp.ClientSession, offset):
+        """
+        Retrieves a single page starting from the offset.
+
+        The response is requested gzip compressed and decoded while it is streamed. With a page
+        cache the request is conditional and an HTTP 304 is served from disk; in offline mode the
+        API is not called and a page not cached is empty, so it ends the dataset.
+
+        Args:
+            session (aiohttp.ClientSession): The pooled client.
+            offset (int): The offset of the first record of the page.
+
+        Returns:
+            list: The meteorite landing records of the page, empty after the last page.
+
+        Raises:
+            Exception: If the API does not answer with HTTP 200.
+        """
+        # The system fields (:updated_at) are requested for the high-water mark of the incremental runs
+        params = {"$select": ":*, *", "$limit": str(self.page_size), "$offset": str(offset), "$order": ":id"}
+        if self.updated_since:
+            params["$where"] = f":updated_at > '{self.updated_since.rstrip('Z')}'"
+        key = None
+        headers = {"Accept-Encoding": "gzip"}
+        if self.page_cache is not None:
+            key = PageCache.key(self.endpoint, params)
+            if self.page_cache.offline:
+                metrics.increment("page_cache", result="offline")
+                return await asyncio.to_thread(self.page_cache.load, key) or []
+            headers.update(await asyncio.to_thread(self.page_cache.conditional_headers, key))
+        start = time.perf_counter()
+        try:
+            async with session.get(self.endpoint, params=params, headers=headers) as response:
+                if response.status == 304 and key is not None:
+                    page = await asyncio.to_thread(self.page_cache.load, key)
+                    if page is None:
+                        raise Exception(f"Page at offset {offset} not modified but missing from {self.page_cache.directory}")
+                    metrics.increment("page_cache", result="not_modified")
+                    return page
+                if response.status != 200:
+                    raise Exception(f"Failed to retrieve data at offset {offset}: HTTP {response.status}")
+                # The body is decompressed by aiohttp chunk by chunk
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(self._CHUNK_SIZE):
+                    body += chunk
+                validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        except Exception:
+            metrics.increment("http_errors", service="nasa")
+            raise
+        finally:
+            metrics.observe("http_request_seconds", time.perf_counter() - start, service="nasa")
+        metrics.increment("pages_fetched", source="async")
+        if key is not None:
+            metrics.increment("page_cache", result="modified")
+            await asyncio.to_thread(self.page_cache.store, key, str(response.url), bytes(body), *validators)
+        return json.loads(body)
+
+    async def pages(self, with_offsets=False):
+        """
+        Retrieves all the pages of the API.
+
+        Args:
+            with_offsets (bool): Yields (offset, page) tuples instead of the pages.
+
+        Returns:
+            AsyncIterator[list]: The pages, in completion order.
+
+        Raises:
+            Exception: The first error raised by a request, the other requests are cancelled.
+        """
+        results = asyncio.Queue(maxsize=self.concurrency)
+        state = {"next_offset": 0, "end_offset": None}
+        done = object()
+
+        async def worker(session):
+            while True:
+                offset = state["next_offset"]
+                if state["end_offset"] is not None and offset >= state["end_offset"]:
+                    return
+                state["next_offset"] = offset + self.page_size
+                if offset in self.skip_offsets:
+                    continue
+                logger.info("Recovering %d raw data from offset = %d", self.page_size, offset)
+                page = await self.fetch_page(session, offset)
+                if len(page) < self.page_size:
+                    # Last page reached, the following offsets are not requested
+                    end = offset + self.page_size
+                    state["end_offset"] = end if state["end_offset"] is None else min(state["end_offset"], end)
+                if page:
+                    await results.put((offset, page) if with_offsets else page)
+
+        async def run(session):
+            try:
+                await asyncio.gather(*(worker(session) for _ in range(self.concurrency)))
+                await results.put(done)
+            except Exception as e:
+                await results.put(e)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            task = asyncio.ensure_future(run(session))
+            try:
+                while True:
+                    item = await results.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    def iter_pages(self, max_pending_pages=4, with_offsets=False):
+        """
+        Retrieves all the pages from a synchronous context, e.g. the Pipeline.
+
+        The event loop runs in a background thread and the pages are handed over through a
+        bounded queue, so the requests are paused while the consumer is busy.
+
+        Args:
+            max_pending_pages (int): The maximum number of pages retrieved and not yet consumed.
+            with_offsets (bool): Yields (offset, page) tuples instead of the pages.
+
+        Returns:
+            Generator: The pages of raw data.
+
+        Raises:
+            Exception: The first error raised by a request.
+        """
+        page_queue = queue.Queue(maxsize=max_pending_pages)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    page_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        async def produce():
+            async for page in self.pages(with_offsets):
+                if not await asyncio.to_thread(put, page):
+                    return
+
+        def run():
+            try:
+                asyncio.run(produce())
+                put(done)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=run, name="async-extractor", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = page_queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
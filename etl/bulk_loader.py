@@ -0,0 +1,227 @@
+"""
+BulkLoader Class for implement the loader process with PostgreSQL COPY
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the BulkLoader class, a faster alternative to the Loader: the records
+are streamed to a staging table through COPY FROM STDIN and moved to the fact and dimension
+tables with set-based SQL statements, instead of one INSERT for each entity.
+
+Dependencies:
+- psycopg2: For COPY FROM STDIN (copy_expert).
+
+Usage:
+    - Create an instance of BulkLoader.
+    - Call method save_data using with
+"""
+
+from sqlalchemy import create_engine
+from models.meteorite_model import MeteoriteModel
+from etl.rollup import Rollup
+from datetime import datetime
+from typing import List
+import csv
+import io
+import os
+
+class BulkLoader:
+
+    """
+    Loads the MeteoriteModel instances with PostgreSQL COPY, it has the same interface of the Loader.
+
+    Each batch is copied to a temporary staging table and moved to the final tables with one
+    INSERT ... SELECT for each table: the distinct dimension members not already stored are
+    inserted (the natural key constraints skip the existing ones) and the surrogate keys of the
+    facts are resolved joining the staging table with the dimensions on the natural keys.
+    The facts are upserted on the NASA id, so loading again a record updates it.
+    The rollup of the facts is refreshed by commit, in the same transaction.
+
+    Attributes:
+        transformed_data (List[MeteoriteModel]): The records loaded by save_data.
+        batch_size (int): The maximum number of records sent with a single COPY.
+    """
+
+    _STAGING_COLUMNS = [
+        "nasa_id", "mass",
+        "latitude", "longitude", "city", "state", "country",
+        "date", "month", "quarter", "year",
+        "classification", "material_type", "chemical_composition", "clan", "clazz"
+    ]
+
+    _CREATE_STAGING = """
+        CREATE TEMPORARY TABLE IF NOT EXISTS staging_meteorite (
+            nasa_id integer,
+            mass real,
+            latitude double precision,
+            longitude double precision,
+            city varchar(255),
+            state varchar(255),
+            country varchar(255),
+            date timestamp,
+            month integer,
+            quarter integer,
+            year integer,
+            classification varchar(255),
+            material_type varchar(255),
+            chemical_composition varchar(255),
+            clan varchar(255),
+            clazz varchar(255)
+        )
+    """
+
+    # The dimension members not already stored, inserted before the facts referencing them
+    _MOVE_DIMENSIONS = [
+        """INSERT INTO public.location (latitude, longitude, city, state, country)
+           SELECT DISTINCT ON (latitude, longitude) latitude, longitude, city, state, country FROM staging_meteorite
+           ON CONFLICT ON CONSTRAINT location_natural_key DO NOTHING""",
+        """INSERT INTO public.date (date, month, quarter, year)
+           SELECT DISTINCT ON (date) date, month, quarter, year FROM staging_meteorite
+           ON CONFLICT ON CONSTRAINT date_natural_key DO NOTHING""",
+        """INSERT INTO public.classification (classification, material_type, chemical_composition, clan, clazz)
+           SELECT DISTINCT classification, material_type, chemical_composition, clan, clazz FROM staging_meteorite
+           ON CONFLICT ON CONSTRAINT classification_natural_key DO NOTHING"""
+    ]
+
+    # A fact whose year is changed is moved: when the table is partitioned by year the upsert
+    # finds only the facts of the same year (the key is the NASA id and the year)
+    _DELETE_MOVED_FACTS = """DELETE FROM public.meteorite m
+           USING staging_meteorite s
+           WHERE m.nasa_id = s.nasa_id AND m.year <> s.year"""
+
+    _MOVE_FACTS = """INSERT INTO public.meteorite (nasa_id, mass, id_location, id_classification, id_date, year)
+           SELECT s.nasa_id, s.mass, l.id, c.id, d.id, s.year
+           FROM staging_meteorite s
+           JOIN public.location l ON l.latitude = s.latitude AND l.longitude = s.longitude
+           JOIN public.date d ON d.date = s.date
+           JOIN public.classification c
+             ON c.classification IS NOT DISTINCT FROM s.classification
+            AND c.material_type IS NOT DISTINCT FROM s.material_type
+            AND c.chemical_composition IS NOT DISTINCT FROM s.chemical_composition
+            AND c.clan IS NOT DISTINCT FROM s.clan
+            AND c.clazz IS NOT DISTINCT FROM s.clazz
+           ON CONFLICT ON CONSTRAINT meteorite_nasa_id_key DO UPDATE SET
+             mass = EXCLUDED.mass,
+             id_location = EXCLUDED.id_location,
+             id_classification = EXCLUDED.id_classification,
+             id_date = EXCLUDED.id_date"""
+
+    _MOVE_STAGING = _MOVE_DIMENSIONS + [_DELETE_MOVED_FACTS, _MOVE_FACTS, "TRUNCATE staging_meteorite"]
+
+    def __init__(self, data: List[MeteoriteModel], batch_size=10000, database_url=None):
+
+        """
+        Initialize the BulkLoader instance.
+
+        :param data: A list of MeteoriteModel instances to be loaded into the database.
+        :param batch_size: The maximum number of records sent with a single COPY.
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        self.transformed_data = data
+        self.batch_size = batch_size
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"))
+        self.__connection = None
+
+    def __enter__(self):
+        """
+        Open a new database connection and return the BulkLoader instance.
+        This method is called when the loader using with
+        return: The current instance of the BulkLoader.
+        """
+        self.__connection = self.__engine.raw_connection()
+        with self.__connection.cursor() as cursor:
+            cursor.execute(self._CREATE_STAGING)
+        self.__connection.commit() # The staging table must survive a rollback
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        """
+        Close the database connection, the changes not committed are discarded.
+
+        This method is called when with finishs the execution
+        """
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    @staticmethod
+    def build_row(record: MeteoriteModel):
+        """
+        Convert a MeteoriteModel to a row of the staging table.
+
+        :param record: An instance of MeteoriteModel.
+        :return: The list of values in the order of _STAGING_COLUMNS.
+        """
+        location = record.dimensionLocationModel
+        date = record.dimensionDateModel
+        classification = record.dimensionClassificationModel
+        return [
+            record.nasa_id, record.mass,
+            location.location[0], location.location[1], location.city, location.state, location.country,
+            datetime.fromtimestamp(date.timestamp).isoformat(), date.month, date.quarter, date.year,
+            classification.group, classification.material, classification.chemical_composition, classification.clan, classification.clazz
+        ]
+
+    @classmethod
+    def copy_rows(cls, cursor, rows):
+        """
+        Stream the rows to the staging table with COPY FROM STDIN.
+
+        :param cursor: A psycopg2 cursor.
+        :param rows: The rows built by build_row.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY staging_meteorite ({', '.join(cls._STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+    def save_data(self):
+        """
+        Load the transformed data into the database in batches of batch_size records,
+        all the batches are committed in atomic way.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        try:
+            self.save_batch(self.transformed_data)
+            self.commit()
+        except Exception as e:
+            self.rollback()
+            raise e
+
+    def save_batch(self, data: List[MeteoriteModel]):
+        """
+        Stream a batch of MeteoriteModel to the staging table with COPY and move it to the fact
+        and dimension tables, batch_size records at a time, the transaction stays open until commit is called.
+
+        :param data: A list of MeteoriteModel instances to be loaded into the database.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        if not data:
+            return
+        with self.__connection.cursor() as cursor:
+            for i in range(0, len(data), self.batch_size):
+                self.copy_rows(cursor, (self.build_row(record) for record in data[i:i + self.batch_size]))
+                for statement in self._MOVE_STAGING:
+                    cursor.execute(statement)
+
+    def commit(self):
+        """
+        Refresh the rollup and commit all the batches sent to the database.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        with self.__connection.cursor() as cursor:
+            Rollup.refresh(cursor)
+        self.__connection.commit()
+
+    def rollback(self):
+        """
+        Discard all the batches sent to the database and not yet committed.
+        """
+        if self.__connection:
+            self.__connection.rollback()
@@ -0,0 +1,277 @@
+"""
+Checkpoint Class for the resumable ETL runs
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the Checkpoint class that keeps the progress of a run in a local
+directory: every page retrieved from the API is written to a compressed NDJSON file and a
+journal records which pages have been retrieved and committed to the database. The journal is
+only appended, a line for each new page and a line for each commit with the pages loaded since
+the previous one, so a long run does not write its whole state again after every page.
+The manifest keeps the status, the settings and the failed ranges of the run. When a run fails (e.g.
+a transient HTTP 503 or a database error) the next run with the same settings resumes it:
+the pages not yet committed are read back from the directory instead of being downloaded
+again, and only the offsets never retrieved are requested to the API.
+
+Dependencies:
+- gzip, json: For the compressed NDJSON pages and the manifest.
+
+Usage:
+    - Create an instance of Checkpoint using with.
+    - Pass skip_offsets() to the extractor and give pages(offset_pages) to the Pipeline.
+    - Call committed from the Pipeline after every commit, complete at the end of a successful run.
+"""
+from typing import Iterable, Tuple
+import gzip
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Checkpoint:
+
+    """
+    The progress of a run, stored in a directory.
+
+    The pages are identified by their offset. The Pipeline loads the pages in the order they are
+    given, so after n batches are committed the first n pages given by replay and spill are loaded.
+
+    Attributes:
+        directory (str): The directory of the manifest and of the pages.
+        settings (dict): The settings of the run (endpoint, page size, mode...), a previous run is resumed only if they match.
+        resumed (bool): True if a previous failed run is resumed.
+        failed_ranges (list): The offset ranges failed in the last run.
+    """
+
+    _MANIFEST = "manifest.json"
+    _JOURNAL = "pages.ndjson"
+
+    def __init__(self, directory, settings: dict = None):
+        """
+        Initializes the Checkpoint, the manifest is read by `with`.
+
+        Args:
+            directory (str): The directory of the checkpoint, created if needed.
+            settings (dict): The settings of the run, they must be serializable in JSON.
+        """
+        self.directory = directory
+        self.settings = json.loads(json.dumps(settings or {})) # Normalized like the stored copy
+        self.resumed = False
+        self.failed_ranges = []
+        self.__pages = {} # offset -> {"records": int, "loaded": bool}
+        self.__order = [] # offsets given to the Pipeline, in order
+        self.__committed = 0 # pages of __order already marked as loaded
+        self.__journal = None
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        """
+        Reads the manifest of the previous run, resumed if it is not completed and has the same settings.
+        The journal of a resumed run is written again with a line for each page, then it is appended.
+        return: The current instance of the Checkpoint.
+        """
+        os.makedirs(self.__pages_directory(), exist_ok=True)
+        manifest = None
+        path = os.path.join(self.directory, self._MANIFEST)
+        if os.path.exists(path):
+            with open(path) as file:
+                manifest = json.load(file)
+        if manifest is not None and manifest["status"] == "running" and manifest["settings"] == self.settings:
+            self.resumed = True
+            self.__pages = self.__read_journal()
+            loaded = sum(1 for page in self.__pages.values() if page["loaded"])
+            logger.info("Resuming the previous run: %d pages retrieved, %d loaded, failed ranges %s",
+                        len(self.__pages), loaded, manifest["failed_ranges"])
+        else:
+            self.__clear_pages()
+        self.__compact_journal()
+        self.__write("running")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+
+    def skip_offsets(self, page_size) -> set:
+        """
+        Returns the offsets of the full pages already retrieved, they must not be requested again.
+
+        Args:
+            page_size (int): The number of records of a full page.
+        """
+        with self.__lock:
+            return {offset for offset, page in self.__pages.items() if page["records"] >= page_size}
+
+    def pages(self, pages: Iterable[Tuple[int, list]]):
+        """
+        Yields the pages to load: first the pages not committed by the previous run, then the new pages.
+
+        Args:
+            pages (Iterable[Tuple[int, list]]): The (offset, page) tuples retrieved from the API.
+
+        Returns:
+            Generator[list]: The pages.
+        """
+        yield from self.replay()
+        yield from self.spill(pages)
+
+    def replay(self):
+        """
+        Yields the pages retrieved by the previous run and not yet committed, in offset order.
+
+        Returns:
+            Generator[list]: The pages.
+        """
+        with self.__lock:
+            offsets = sorted(offset for offset, page in self.__pages.items() if not page["loaded"])
+        for offset in offsets:
+            with gzip.open(self.__page_path(offset), "rt", encoding="utf-8") as file:
+                page = [json.loads(line) for line in file]
+            with self.__lock:
+                self.__order.append(offset)
+            yield page
+
+    def spill(self, pages: Iterable[Tuple[int, list]]):
+        """
+        Writes every new page to the directory before giving it to the Pipeline.
+        The pages already known (retrieved again because not full) are not given twice.
+
+        Args:
+            pages (Iterable[Tuple[int, list]]): The (offset, page) tuples retrieved from the API.
+
+        Returns:
+            Generator[list]: The pages.
+        """
+        try:
+            for offset, page in pages:
+                with self.__lock:
+                    known = offset in self.__pages
+                if known:
+                    continue
+                path = self.__page_path(offset)
+                with gzip.open(f"{path}.tmp", "wt", encoding="utf-8", compresslevel=1) as file:
+                    for item in page:
+                        file.write(json.dumps(item))
+                        file.write("\n")
+                os.replace(f"{path}.tmp", path)
+                with self.__lock:
+                    self.__pages[offset] = {"records": len(page), "loaded": False}
+                    self.__order.append(offset)
+                    self.__append({"offset": offset, "records": len(page)})
+                yield page
+        finally:
+            close = getattr(pages, "close", None)
+            if close is not None:
+                close()
+
+    def committed(self, pages):
+        """
+        Marks as loaded the first pages given to the Pipeline, called after every commit.
+
+        Args:
+            pages (int): The number of pages committed since the beginning of the run.
+        """
+        with self.__lock:
+            offsets = self.__order[self.__committed:pages]
+            if not offsets:
+                return
+            for offset in offsets:
+                self.__pages[offset]["loaded"] = True
+            self.__committed += len(offsets)
+            self.__append({"loaded": offsets})
+
+    def fail(self, failed_ranges):
+        """
+        Records the offset ranges failed, the pages retrieved are kept for the next run.
+
+        Args:
+            failed_ranges (list): The (start_offset, end_offset) ranges failed.
+        """
+        with self.__lock:
+            self.failed_ranges = [list(r) for r in failed_ranges]
+            self.__write("running")
+
+    def complete(self):
+        """
+        Marks the run as completed and removes the pages, the next run starts from scratch.
+        """
+        with self.__lock:
+            self.__clear_pages()
+            self.__compact_journal()
+            self.__write("completed")
+
+    def __write(self, status):
+        """
+        Writes the manifest atomically.
+        """
+        path = os.path.join(self.directory, self._MANIFEST)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump({
+                "status": status,
+                "settings": self.settings,
+                "failed_ranges": self.failed_ranges
+            }, file)
+        os.replace(f"{path}.tmp", path)
+
+    def __append(self, entry):
+        """
+        Appends an entry to the journal, flushed so it survives the failure of the process.
+        """
+        self.__journal.write(json.dumps(entry))
+        self.__journal.write("\n")
+        self.__journal.flush()
+
+    def __read_journal(self) -> dict:
+        """
+        Returns the pages recorded by the journal, offset -> {"records": int, "loaded": bool}.
+        A line cut by the failure of the previous run is the last one, it is ignored.
+        """
+        pages = {}
+        path = os.path.join(self.directory, self._JOURNAL)
+        if not os.path.exists(path):
+            return pages
+        with open(path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if "offset" in entry:
+                    pages[entry["offset"]] = {"records": entry["records"], "loaded": entry.get("loaded", False)}
+                else:
+                    for offset in entry["loaded"]:
+                        pages[offset]["loaded"] = True
+        return pages
+
+    def __compact_journal(self):
+        """
+        Writes atomically the journal with a line for each known page and opens it for appending.
+        """
+        if self.__journal is not None:
+            self.__journal.close()
+        path = os.path.join(self.directory, self._JOURNAL)
+        with open(f"{path}.tmp", "w") as file:
+            for offset, page in sorted(self.__pages.items()):
+                file.write(json.dumps({"offset": offset, "records": page["records"], "loaded": page["loaded"]}))
+                file.write("\n")
+        os.replace(f"{path}.tmp", path)
+        self.__journal = open(path, "a")
+
+    def __clear_pages(self):
+        """
+        Removes the pages of a previous run.
+        """
+        self.__pages = {}
+        self.__order = []
+        self.__committed = 0
+        for name in os.listdir(self.__pages_directory()):
+            os.remove(os.path.join(self.__pages_directory(), name))
+
+    def __pages_directory(self):
+        return os.path.join(self.directory, "pages")
+
+    def __page_path(self, offset):
+        return os.path.join(self.__pages_directory(), f"{offset:012d}.ndjson.gz")
@@ -0,0 +1,205 @@
+"""
+Config Class for the settings of the ETL process
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the Config class that collects the settings of a run: the concurrency,
+the page size and the backend of the extraction, the workers and the engine of the
+transformation, the geocoder, the batch size and the connections of the load, and the
+stages to run. Every setting is read, from the highest priority:
+- the command line, e.g. --extractor-concurrency 8;
+- the environment variable, the upper case name, e.g. EXTRACTOR_CONCURRENCY=8;
+- the TOML file given with --config or ETL_CONFIG, the name at the top level or split into a
+  table and a key (e.g. concurrency = 8 in [extractor], ttl = 86400 in [geocoding_cache]);
+- the default.
+
+Dependencies:
+- argparse: For the command line.
+- tomllib: For the configuration file.
+
+Usage:
+    - Call Config.load with the command line arguments, it returns the Config of the run.
+    - python main.py --help lists the settings.
+"""
+
+import argparse
+import os
+import tomllib
+
+class Config:
+
+    """
+    The settings of a run, one attribute for each option (e.g. config.loader_batch_size).
+
+    Attributes:
+        OPTIONS (dict): The options, the name -> (type, default, choices, help).
+    """
+
+    OPTIONS = {
+        # Logging, metrics and profiling
+        "log_level": (str, "INFO", None, "Logging level, DEBUG logs the reason of every rejected record"),
+        "metrics_format": (str, "json", ("json", "prometheus"), "Format of the metrics written at the end of the run"),
+        "metrics_path": (str, None, None, "File where the metrics are written, stdout if empty"),
+        "profile_dir": (str, None, None, "Directory where the profiles of the stages are written, empty to disable the profiling"),
+        "profile_memory": (bool, False, None, "Record the memory with tracemalloc while profiling, slower"),
+        # Run
+        "etl_mode": (str, "full", ("full", "incremental"), "Process every record or only the new and changed ones"),
+        "etl_stages": (str, "extract,transform,load", None, "Comma separated contiguous stages to run"),
+        "stage_dir": (str, None, None, "Directory of the Arrow files between the stages, required to run only some stages"),
+        "database_url": (str, None, None, "SQLAlchemy URL of the database"),
+        # Extraction
+        "extractor_backend": (str, "async", ("async", "threads"), "Extraction with asyncio or with a thread for each request in flight"),
+        "extractor_concurrency": (int, 5, None, "Requests in flight"),
+        "extractor_page_size": (int, 1000, None, "Records requested for each page"),
+        "nasa_api_endpoint": (str, None, None, "URL of the API, e.g. a local stub server, the NASA API if empty"),
+        "page_cache_dir": (str, "page_cache", None, "Directory of the raw page cache, empty to disable it"),
+        "page_cache_offline": (bool, False, None, "Read only the cached pages, without calling the API"),
+        # Checkpoint
+        "checkpoint_dir": (str, "checkpoint", None, "Directory keeping the pages of a run to resume it, empty to disable it"),
+        "checkpoint_commit_every": (int, 10, None, "Pages committed at once with the checkpoint"),
+        # Transformation
+        "transform_engine": (str, "record", ("record", "vectorized", "sql"), "Transformation record at a time, columnar or in the database"),
+        "transform_workers": (int, 1, None, "Processes transforming the pages"),
+        "transform_chunk_size": (int, 250, None, "Records sent to a transformation process at once"),
+        # Geocoding
+        "geocoding_cache_path": (str, "geocoding_cache.sqlite3", None, "SQLite file of the reverse geocoding cache"),
+        "geocoding_cache_ttl": (float, None, None, "Seconds after which a cached location is requested again, no expiration if empty"),
+        "geocoding_cache_max_entries": (int, None, None, "Locations kept in the cache, the oldest are evicted when the cache is opened"),
+        "geocoder_backend": (str, "nominatim", ("nominatim", "boundary"), "Online or offline reverse geocoding"),
+        "geocoder_boundary_path": (str, None, None, "Boundary file of the offline geocoder"),
+        "geocoder_boundary_layer": (str, None, None, "Layer of the boundary file"),
+        "geocoder_country_column": (str, "admin", None, "Column of the country in the boundary file"),
+        "geocoder_state_column": (str, "name", None, "Column of the state in the boundary file"),
+        "geocoder_city_column": (str, None, None, "Column of the city in the boundary file"),
+        "geocoder_rate": (float, 3.0, None, "Requests per second of the online geocoder"),
+        "geocoder_concurrency": (int, 4, None, "Requests in flight of the online geocoder"),
+        "geocoder_max_retries": (int, 5, None, "Retries of a failed geocoding request"),
+        # Load
+        "loader_mode": (str, "copy", ("copy", "orm", "parallel"), "Load with COPY, with the ORM or with COPY over many connections"),
+        "loader_batch_size": (int, 10000, None, "Records sent with a single COPY"),
+        "loader_workers": (int, 4, None, "Connections writing the facts in parallel mode"),
+        "loader_isolation_level": (str, "READ COMMITTED", ("READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE"), "Isolation level of the parallel mode connections"),
+        "schema_drop_indexes": (str, "full", ("full", "always", "never"), "Drop the secondary indexes during the load: only in full mode, always or never")
+    }
+
+    # The options counting something, at least 1
+    _POSITIVE = ("extractor_concurrency", "extractor_page_size", "checkpoint_commit_every", "transform_workers",
+                 "transform_chunk_size", "geocoder_concurrency", "loader_batch_size", "loader_workers")
+
+    _STAGES = ("extract", "transform", "load")
+
+    def __init__(self, **values):
+        """
+        Initializes the Config with the given values, the defaults for the others.
+
+        Args:
+            values: The values of the options, by name.
+
+        Raises:
+            ValueError: If an option is unknown or a value is not valid.
+        """
+        unknown = set(values) - set(self.OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+        for name, (kind, default, choices, _) in self.OPTIONS.items():
+            value = self.__convert(name, kind, values.get(name, default))
+            if choices and value not in choices:
+                raise ValueError(f"Unknown {name.upper()}: {value}")
+            if name in self._POSITIVE and (value is None or value < 1):
+                raise ValueError(f"{name.upper()} must be at least 1: {value}")
+            setattr(self, name, value)
+
+    @classmethod
+    def load(cls, argv=None, environ=None):
+        """
+        Reads the settings from the command line, the environment variables and the configuration file.
+
+        Args:
+            argv (list): The command line arguments, sys.argv[1:] if None.
+            environ (dict): The environment variables, os.environ if None.
+
+        Returns:
+            Config: The settings of the run.
+        """
+        environ = os.environ if environ is None else environ
+        args = cls.parser().parse_args(argv)
+        path = args.config or environ.get("ETL_CONFIG")
+        values = cls.read_file(path) if path else {}
+        for name in cls.OPTIONS:
+            if name.upper() in environ:
+                values[name] = environ[name.upper()]
+            if getattr(args, name) is not None:
+                values[name] = getattr(args, name)
+        if args.only:
+            values["etl_stages"] = args.only
+        return cls(**values)
+
+    @classmethod
+    def parser(cls):
+        """
+        Returns the parser of the command line, an argument for each option.
+        """
+        parser = argparse.ArgumentParser(
+            description="ETL process of the NASA Meteorite Landings",
+            epilog="Every option can be set with the upper case environment variable (e.g. LOADER_BATCH_SIZE) or in the configuration file."
+        )
+        parser.add_argument("--config", help="TOML configuration file (env ETL_CONFIG)")
+        parser.add_argument("--only", choices=cls._STAGES, help="Run a single stage, the same as --etl-stages STAGE")
+        for name, (kind, default, choices, description) in cls.OPTIONS.items():
+            option = f"--{name.replace('_', '-')}"
+            if kind is bool:
+                parser.add_argument(option, action=argparse.BooleanOptionalAction, default=None, help=f"{description} (default {default})")
+            else:
+                # The empty string is a value, e.g. an empty --checkpoint-dir disables the checkpoint
+                parser.add_argument(option, default=None, choices=choices, metavar=None if choices else name.upper(),
+                                    help=f"{description} (default {default})")
+        return parser
+
+    @classmethod
+    def read_file(cls, path):
+        """
+        Reads the options of a TOML configuration file.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            dict: The values of the options, by name.
+
+        Raises:
+            ValueError: If an option of the file is unknown.
+        """
+        with open(path, "rb") as file:
+            document = tomllib.load(file)
+        values = {}
+        for key, value in document.items():
+            entries = value.items() if isinstance(value, dict) else [(None, value)]
+            for subkey, subvalue in entries:
+                name = f"{key}_{subkey}" if subkey else key
+                name = name.replace("-", "_")
+                if name not in cls.OPTIONS:
+                    raise ValueError(f"Unknown option {name} in {path}")
+                values[name] = subvalue
+        return values
+
+    @staticmethod
+    def __convert(name, kind, value):
+        """
+        Converts a value read from the command line, the environment or the file to the type of the option.
+        """
+        if value is None or isinstance(value, kind) and not (kind is int and isinstance(value, bool)):
+            return value
+        if kind is str:
+            if isinstance(value, list) and name == "etl_stages":
+                return ",".join(value)
+            if isinstance(value, (list, dict)):
+                raise ValueError(f"Invalid {name.upper()}: {value}")
+            return str(value)
+        if kind is bool:
+            return str(value).lower() in ("1", "true", "yes")
+        if isinstance(value, str) and not value.strip():
+            return None # An empty number is not set, e.g. GEOCODING_CACHE_TTL=
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {name.upper()}: {value}") from None
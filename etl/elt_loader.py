@@ -0,0 +1,391 @@
+"""
+EltLoader Class for implement the transformation inside PostgreSQL (ELT)
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the EltLoader class: the raw NASA records are copied as JSONB to a staging
+table and the cleaning and the derivation of the dimensions (checks of the fields, mass, valid and
+recoverable coordinates, timestamp, year, month and quarter) run as set-based SQL statements,
+with the same rules of the Transformer. Only the classification of the distinct recclass values
+and the reverse geocoding of the distinct coordinates run in Python, then the records are moved
+to the fact and dimension tables with the statements of the BulkLoader.
+
+Dependencies:
+- psycopg2: For COPY FROM STDIN (copy_expert).
+
+Usage:
+    - Create an instance of EltLoader with the location cache and the geocoder.
+    - Give the raw pages to save_batch using with, e.g. as loader of a Pipeline without transformer.
+    - Call commit: the records staged are transformed, loaded and committed.
+"""
+
+from sqlalchemy import create_engine
+from etl.bulk_loader import BulkLoader
+from etl.rollup import Rollup
+from etl.transformer import REGIONS
+from etl.geocoder import Geocoder, NominatimGeocoder
+from models.meteorite_type import MeteoriteType
+from etl.metrics import metrics
+from collections import Counter
+from typing import List
+import csv
+import io
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# A number accepted by float(), infinities and NaN excluded
+_NUMBER = r"'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'"
+
+# The format accepted by DimensionDateModel ('%Y-%m-%dT%H:%M:%S.%f')
+_TIMESTAMP = r"'^[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}T[0-9]{1,2}:[0-9]{1,2}:[0-9]{1,2}\.[0-9]{1,6}$'"
+
+def _recoverable(lat, lon) -> str:
+    """
+    Returns the SQL condition of Transformer.__recoverable_location: the first region of REGIONS
+    containing the coordinates decides, (0, 0), the invalid coordinates and the remote areas are not recoverable.
+    """
+    regions = " ".join(
+        f"WHEN {lat} BETWEEN {min_lat} AND {max_lat} AND {lon} BETWEEN {min_lon} AND {max_lon} THEN {str(recoverable).upper()}"
+        for (min_lat, max_lat), (min_lon, max_lon), recoverable in REGIONS
+    )
+    return f"""CASE
+        WHEN {lat} = 0 AND {lon} = 0 THEN FALSE
+        WHEN NOT ({lat} BETWEEN -90 AND 90 AND {lon} BETWEEN -180 AND 180) THEN FALSE
+        {regions}
+        ELSE FALSE END"""
+
+def _round(value) -> str:
+    """
+    Returns the SQL expression rounding the decimal string to one decimal like round(float(value), 1).
+
+    Python rounds the double nearest to the decimal, PostgreSQL rounds the decimal itself (numeric),
+    and the two agree unless the decimal is a halfway value x.x5:
+    - not halfway: the decimal and its double are closer than a double spacing, with up to 15
+      significant digits no halfway value lies between them, so both round to the same side;
+    - halfway: the double is above, below or equal to the decimal and Python goes up, down or to
+      the even digit. The double is compared exactly with the decimal: scaled by 2^30 it is split
+      into its integer part and its fraction, and the fraction scaled by another 2^30 is an integer
+      for every halfway value (|x| >= 0.05), so the sum is the double times 2^60 as an exact numeric,
+      compared with the decimal times 2^60. Only x.25 and x.75 are exact doubles, they are rounded
+      half to even by round(x / 0.2) * 0.2;
+    - a negative value rounded to zero gives -0.0, like Python.
+    The expression is checked against round() on the server by EltLoader, see _ROUND_CHECK.
+    """
+    number = f"{value}::numeric"
+    double = f"({value}::double precision * 1073741824)" # 2^30
+    exact = f"(trunc({double})::numeric * 1073741824 + (({double} - trunc({double})) * 1073741824)::numeric)"
+    rounded = f"""(CASE WHEN {number} * 20 = trunc({number} * 20) AND {number} * 10 <> trunc({number} * 10)
+        THEN CASE sign({exact} - {number} * 1152921504606846976)
+            WHEN 1 THEN {number} + 0.05 WHEN -1 THEN {number} - 0.05 ELSE round({number} / 0.2) * 0.2 END
+        ELSE round({number}, 1) END)"""
+    return f"(CASE WHEN ltrim({value}) LIKE '-%' AND {rounded} = 0 THEN '-0' ELSE {rounded}::double precision END)::double precision"
+
+# The values checked against round(float(value), 1): the halfway values, positive and negative,
+# the exact ties (x.25, x.75), the values rounded to -0.0 and the other formats accepted by _NUMBER
+_ROUND_CHECK = [f"{sign}{units}.{tenth}5" for sign in ("", "-") for units in (0, 1, 2, 10, 45, 89, 179) for tenth in range(10)] + [
+    "0", "-0", "-0.04", "-0.049", "0.0499999", "2.675", "-2.675", "12.345", "1.449999", "89.999999", "-179.95",
+    " 1.45 ", "1.45e1", "-1.5E-1", ".15", "-.35", "+0.25", "100.65", "12345.65", "-37.3333333333333"
+]
+
+class EltLoader:
+
+    """
+    Loads the raw records transforming them in the database, it has the same interface of the Loader
+    but save_batch receives the raw pages.
+
+    The raw records are copied by save_batch and transformed by commit, so every statement works on
+    all the records staged since the previous commit. The records rejected are counted in `rejected`
+    with the same reasons of the Transformer.
+
+    Attributes:
+        location_cache (dict): The cache of the locations, keyed by the coordinates rounded to one decimal.
+        geocoder (Geocoder): The reverse geocoding backend used for the coordinates not in cache.
+        batch_size (int): The maximum number of records sent with a single COPY.
+        rejected (Counter): The number of records rejected for each reason (clean, date, classification, geocoding, location).
+        retry_ids (set): The NASA ids of the records rejected because the geocoding failed, to load again in a later run.
+        loaded (int): The number of records moved to the fact table.
+    """
+
+    _CREATE_STAGING = [
+        "CREATE TEMPORARY TABLE IF NOT EXISTS staging_raw (record jsonb NOT NULL)",
+        """CREATE TEMPORARY TABLE IF NOT EXISTS staging_clean (
+            nasa_id integer,
+            recclass text,
+            mass real,
+            date timestamp,
+            latitude double precision,
+            longitude double precision,
+            reason varchar(32)
+        )""",
+        """CREATE TEMPORARY TABLE IF NOT EXISTS staging_classification (
+            recclass text PRIMARY KEY,
+            known boolean NOT NULL,
+            classification varchar(255),
+            material_type varchar(255),
+            chemical_composition varchar(255),
+            clan varchar(255),
+            clazz varchar(255)
+        )""",
+        """CREATE TEMPORARY TABLE IF NOT EXISTS staging_location (
+            latitude double precision,
+            longitude double precision,
+            found boolean NOT NULL,
+            location_latitude double precision,
+            location_longitude double precision,
+            city varchar(255),
+            state varchar(255),
+            country varchar(255)
+        )"""
+    ]
+
+    # Cleaning and date dimension, the first failed check is the reason of the rejection
+    _CLEAN = f"""
+        INSERT INTO staging_clean (nasa_id, recclass, mass, date, latitude, longitude, reason)
+        SELECT nasa_id, recclass, mass, date, latitude, longitude,
+               CASE WHEN NOT clean THEN 'clean' WHEN date IS NULL THEN 'date' END
+        FROM (
+            SELECT CASE WHEN id ~ '^[0-9]+$' THEN id::integer END AS nasa_id,
+                   recclass,
+                   clean,
+                   CASE WHEN clean THEN mass::double precision END AS mass,
+                   CASE WHEN clean AND year ~ {_TIMESTAMP} AND pg_input_is_valid(year, 'timestamp') THEN year::timestamp END AS date,
+                   CASE WHEN clean THEN {_round("reclat")} END AS latitude,
+                   CASE WHEN clean THEN {_round("reclong")} END AS longitude
+            FROM (
+                SELECT id, recclass, mass, year, reclat, reclong,
+                       CASE WHEN coalesce(recclass, '') <> '' AND coalesce(year, '') <> ''
+                             AND mass ~ {_NUMBER} AND reclat ~ {_NUMBER} AND reclong ~ {_NUMBER}
+                            THEN mass::double precision <> 0 AND {_recoverable("reclat::double precision", "reclong::double precision")}
+                            ELSE FALSE END AS clean
+                FROM (
+                    SELECT record->>'id' AS id, record->>'recclass' AS recclass, record->>'mass' AS mass,
+                           record->>'year' AS year, record->>'reclat' AS reclat, record->>'reclong' AS reclong
+                    FROM staging_raw
+                ) raw
+            ) checked
+        ) typed
+    """
+
+    _REJECT_CLASSIFICATION = """
+        UPDATE staging_clean c SET reason = 'classification'
+        FROM staging_classification m
+        WHERE c.reason IS NULL AND m.recclass = c.recclass AND NOT m.known
+    """
+
+    _REJECT_GEOCODING = """
+        UPDATE staging_clean c SET reason = 'geocoding'
+        WHERE c.reason IS NULL AND NOT EXISTS (
+            SELECT 1 FROM staging_location l WHERE l.latitude = c.latitude AND l.longitude = c.longitude
+        )
+    """
+
+    _REJECT_LOCATION = """
+        UPDATE staging_clean c SET reason = 'location'
+        FROM staging_location l
+        WHERE c.reason IS NULL AND l.latitude = c.latitude AND l.longitude = c.longitude AND NOT l.found
+    """
+
+    _STAGE_RECORDS = f"""
+        INSERT INTO staging_meteorite ({', '.join(BulkLoader._STAGING_COLUMNS)})
+        SELECT c.nasa_id, c.mass,
+               l.location_latitude, l.location_longitude, l.city, l.state, l.country,
+               c.date, extract(month FROM c.date), extract(quarter FROM c.date), extract(year FROM c.date),
+               m.classification, m.material_type, m.chemical_composition, m.clan, m.clazz
+        FROM staging_clean c
+        JOIN staging_classification m ON m.recclass = c.recclass
+        JOIN staging_location l ON l.latitude = c.latitude AND l.longitude = c.longitude
+        WHERE c.reason IS NULL
+    """
+
+    def __init__(self, data: List[dict] = None, location_cache=None, geocoder: Geocoder = None, batch_size=10000, database_url=None):
+
+        """
+        Initialize the EltLoader instance.
+
+        :param data: A list of raw records, loaded by save_data.
+        :param location_cache: The cache of the locations, a dict if None.
+        :param geocoder: The reverse geocoding backend, NominatimGeocoder if None.
+        :param batch_size: The maximum number of records sent with a single COPY.
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        self.raw_data = data or []
+        self.location_cache = location_cache if location_cache is not None else {}
+        self.geocoder = geocoder or NominatimGeocoder()
+        self.batch_size = batch_size
+        self.rejected = Counter()
+        self.retry_ids = set()
+        self.loaded = 0
+        self.__classified = set() # recclass values already in staging_classification
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"))
+        self.__connection = None
+
+    def __enter__(self):
+        """
+        Open a new database connection and return the EltLoader instance.
+        This method is called when the loader using with
+        return: The current instance of the EltLoader.
+        """
+        self.__connection = self.__engine.raw_connection()
+        with self.__connection.cursor() as cursor:
+            for statement in [BulkLoader._CREATE_STAGING] + self._CREATE_STAGING:
+                cursor.execute(statement)
+            self.__check_round(cursor)
+        self.__connection.commit() # The staging tables must survive a rollback
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        """
+        Close the database connection, the changes not committed are discarded.
+
+        This method is called when with finishs the execution
+        """
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    def save_data(self):
+        """
+        Load the raw data into the database, all the records are committed in atomic way.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        try:
+            self.save_batch(self.raw_data)
+            self.commit()
+        except Exception as e:
+            self.rollback()
+            raise e
+
+    def save_batch(self, data: List[dict]):
+        """
+        Stream a page of raw records to the staging table with COPY, batch_size records at a time,
+        they are transformed by commit.
+
+        :param data: A list of raw records, as returned by the NASA API.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        if not data:
+            return
+        with self.__connection.cursor() as cursor:
+            for i in range(0, len(data), self.batch_size):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows([json.dumps(item)] for item in data[i:i + self.batch_size])
+                buffer.seek(0)
+                cursor.copy_expert("COPY staging_raw (record) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def commit(self):
+        """
+        Transform the raw records staged, move them to the fact and dimension tables, refresh the rollup and commit.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        with self.__connection.cursor() as cursor:
+            cursor.execute(self._CLEAN)
+            self.__classify(cursor)
+            cursor.execute(self._REJECT_CLASSIFICATION)
+            self.__locate(cursor)
+            cursor.execute(self._REJECT_GEOCODING)
+            cursor.execute(self._REJECT_LOCATION)
+            cursor.execute(self._STAGE_RECORDS)
+            loaded = cursor.rowcount
+            for statement in BulkLoader._MOVE_STAGING:
+                cursor.execute(statement)
+            cursor.execute("SELECT reason, count(*) FROM staging_clean WHERE reason IS NOT NULL GROUP BY reason")
+            rejected = Counter(dict(cursor.fetchall()))
+            cursor.execute("SELECT nasa_id FROM staging_clean WHERE reason = 'geocoding' AND nasa_id IS NOT NULL")
+            retry_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("TRUNCATE staging_raw, staging_clean, staging_location")
+            Rollup.refresh(cursor)
+        self.__connection.commit()
+        self.loaded += loaded
+        self.rejected.update(rejected)
+        self.retry_ids.update(retry_ids)
+        metrics.increment("records", loaded, stage="transform")
+        for reason, count in rejected.items():
+            metrics.increment("records_rejected", count, reason=reason)
+
+    def rollback(self):
+        """
+        Discard all the records staged and not yet committed.
+        The classifications inserted by the transaction are discarded too, so they are classified again.
+        """
+        if self.__connection:
+            self.__connection.rollback()
+        self.__classified = set()
+
+    @staticmethod
+    def __check_round(cursor):
+        """
+        Checks the coordinates rounded by the database against the Transformer (round(float(value), 1)).
+
+        Raises:
+            Exception: If a value is rounded differently, the records would not match the record engine.
+        """
+        values = ", ".join(f"'{value}'" for value in _ROUND_CHECK)
+        cursor.execute(f"SELECT value, {_round('value')} FROM unnest(ARRAY[{values}]) AS value")
+        different = [(value, rounded) for value, rounded in cursor.fetchall() if repr(rounded) != repr(round(float(value), 1))]
+        if different:
+            raise Exception(f"The database rounds the coordinates differently from Python: {different[:5]}")
+
+    def __classify(self, cursor):
+        """
+        Classifies in Python the distinct recclass values not yet classified, the classification
+        rules are regular expressions shared with the Transformer.
+        """
+        cursor.execute("SELECT DISTINCT recclass FROM staging_clean WHERE reason IS NULL")
+        rows = []
+        for (recclass,) in cursor.fetchall():
+            if recclass in self.__classified:
+                continue
+            classification = MeteoriteType.classify(recclass)
+            if classification is None:
+                rows.append([recclass, False, None, None, None, None, None])
+            else:
+                rows.append([
+                    recclass, True, classification.group, classification.material,
+                    classification.chemical_composition, classification.clan, classification.clazz
+                ])
+        if rows:
+            self.__copy(cursor, "staging_classification", rows)
+            self.__classified.update(row[0] for row in rows)
+
+    def __locate(self, cursor):
+        """
+        Resolves the distinct coordinates of the records, the coordinates not in cache are requested
+        to the geocoder with a single call, the coordinates failed are not stored in staging_location.
+        """
+        cursor.execute("SELECT latitude, longitude, count(*) FROM staging_clean WHERE reason IS NULL GROUP BY latitude, longitude")
+        positions = cursor.fetchall()
+        missing = [(lat, lon) for lat, lon, _ in positions if (lat, lon) not in self.location_cache]
+        metrics.increment("geocoding_cache", sum(count for lat, lon, count in positions if (lat, lon) in self.location_cache), result="hit")
+        metrics.increment("geocoding_cache", sum(count for lat, lon, count in positions if (lat, lon) not in self.location_cache), result="miss")
+        if missing:
+            logger.info("Resolving %d locations with %s", len(missing), type(self.geocoder).__name__)
+            for coordinates, location in self.geocoder.reverse_many(missing).items():
+                self.location_cache[coordinates] = location
+        rows = []
+        for lat, lon, _ in positions:
+            if (lat, lon) not in self.location_cache:
+                continue
+            location = self.location_cache[(lat, lon)]
+            if location is None:
+                rows.append([lat, lon, False, None, None, None, None, None])
+            else:
+                rows.append([lat, lon, True, location.latitude, location.longitude, location.city, location.state, location.country])
+        if rows:
+            self.__copy(cursor, "staging_location", rows)
+
+    @staticmethod
+    def __copy(cursor, table, rows):
+        """
+        Stream the rows to the table with COPY FROM STDIN.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv)", buffer)
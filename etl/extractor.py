@@ -6,16 +6,24 @@ Author: Giuseppe Valente <valentepeppe@gmail.com>
 This module defines the Extractor class that handles data extraction from
 NASA's Meteorite Landings API. The Extractor class includes methods to
 retrieve and process meteorite landing data with error handling for
-HTTP requests.
+HTTP requests. With a PageCache the raw pages are kept on disk and requested
+again with If-None-Match / If-Modified-Since, so an unchanged page is not downloaded.
+The records are requested ordered by id, so the pages of the same size neither overlap nor skip records,
+with the system fields (:updated_at) and, for an incremental run, only the records updated after a timestamp.
 
 Dependencies:
 - requests: For making HTTP requests to the NASA API.
+- PageCache: Custom class keeping the raw pages and their validators on disk.
 
 Usage:
-    - Create an instance of Extractor.
+    - Create an instance of Extractor, optionally with the endpoint, the page size and the timestamp of the last run.
     - Use the get_data_from_nasa method to retrieve data from the API with specified offsets.
 """
+from etl.metrics import metrics
+from etl.page_cache import PageCache
+import json
 import requests
+import time
 
 class Extractor:
     """
@@ -23,22 +31,42 @@ class Extractor:
 
     This class provides methods to retrieve and process meteorite landing data
     from NASA's open data API. It includes error handling for failed HTTP requests.
+
+    Attributes:
+        page_cache (PageCache): The on-disk cache of the raw pages, None to always download the pages.
+        endpoint (str): The URL of the API, it can point to a local stub server for testing.
+        page_size (int): The number of records requested for each page ($limit), the step of the offsets.
+        updated_since (str): If set, only the records updated after this timestamp (:updated_at) are requested.
     """
     
-    _NASA_API_ENDPOINT = "https://data.nasa.gov/resource/gh4g-9sfh.json?$limit=999"
+    _NASA_API_ENDPOINT = "https://data.nasa.gov/resource/gh4g-9sfh.json"
+    _CHUNK_SIZE = 64 * 1024
 
-    def __init__(self):
+    def __init__(self, page_cache: PageCache = None, endpoint=None, page_size=1000, updated_since=None):
         """
         Initializes the Extractor class.
+        The HTTP session keeps the connection alive between the pages.
+
+        Parameters:
+        - page_cache (PageCache): The on-disk cache of the raw pages, None to always download the pages.
+        - endpoint (str): The URL of the API, if None the NASA endpoint is used.
+        - page_size (int): The number of records of each page, the offsets must be multiples of it.
+        - updated_since (str): If set, only the records updated after this timestamp (:updated_at) are requested.
         """
-        pass
+        self.__session = requests.Session()
+        self.page_cache = page_cache
+        self.endpoint = endpoint or self._NASA_API_ENDPOINT
+        self.page_size = page_size
+        self.updated_since = updated_since
     
     def get_data_from_nasa(self, offset):
         """
         Retrieves data from NASA's Meteorite Landings API with a given offset.
 
-        This method constructs the request URL by appending the offset parameter to the base API endpoint,
-        sends an HTTP GET request, and returns the JSON response if successful. 
+        This method requests page_size records from the offset to the API endpoint, sends an HTTP GET request, and returns the JSON response if successful. The response is
+        requested gzip compressed and decoded while it is streamed. With a page cache the request is
+        conditional and an HTTP 304 is served from disk; in offline mode the API is not called and
+        a page not cached is empty.
 
         Parameters:
         - offset (int): The offset parameter to paginate through the API results.
@@ -50,14 +78,45 @@ class Extractor:
         Raises:
         - Exception: If an unexpected error occurs during the HTTP request.
         """
-        response = requests.get("".join([self._NASA_API_ENDPOINT, "&$offset=", str(offset)]))
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Parse the JSON content into a Python dictionary
-            return response.json()
-        else:
-            raise Exception(f"Failed to retrieve data: HTTP {response.status_code}")
-            
+        # The system fields (:updated_at) are requested for the high-water mark of the incremental runs
+        params = {"$select": ":*, *", "$limit": str(self.page_size), "$offset": str(offset), "$order": ":id"}
+        if self.updated_since:
+            params["$where"] = f":updated_at > '{self.updated_since.rstrip('Z')}'"
+        headers = {"Accept-Encoding": "gzip"}
+        key = None
+        if self.page_cache is not None:
+            key = PageCache.key(self.endpoint, params)
+            if self.page_cache.offline:
+                metrics.increment("page_cache", result="offline")
+                return self.page_cache.load(key) or []
+            headers.update(self.page_cache.conditional_headers(key))
+        start = time.perf_counter()
+        try:
+            with self.__session.get(self.endpoint, params=params, headers=headers, stream=True) as response:
+                if response.status_code == 304 and key is not None:
+                    page = self.page_cache.load(key)
+                    if page is None:
+                        raise Exception(f"Page not modified but missing from {self.page_cache.directory}")
+                    metrics.increment("page_cache", result="not_modified")
+                    return page
+                if response.status_code != 200:
+                    raise Exception(f"Failed to retrieve data: HTTP {response.status_code}")
+                # iter_content decodes the gzip body chunk by chunk
+                body = bytearray()
+                for chunk in response.iter_content(chunk_size=self._CHUNK_SIZE):
+                    body += chunk
+        except Exception:
+            metrics.increment("http_errors", service="nasa")
+            raise
+        finally:
+            metrics.observe("http_request_seconds", time.perf_counter() - start, service="nasa")
+        metrics.increment("pages_fetched", source="threads")
+        if key is not None:
+            metrics.increment("page_cache", result="modified")
+            self.page_cache.store(key, response.url, body, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        # Parse the JSON content into a Python list
+        return json.loads(body)
+
     @property
     def NASA_API_ENDPOINT(self):
         """
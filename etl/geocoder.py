@@ -0,0 +1,227 @@
+"""
+Geocoder Classes for the reverse geocoding of the Location Dimension
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the pluggable geocoder backends used by the Transformer to
+resolve city, state and country from the geographic coordinates:
+- NominatimGeocoder: online reverse geocoding, rate limited, with a bounded number of concurrent requests.
+- BoundaryGeocoder: offline reverse geocoding against a local admin-boundary file
+  (GeoPackage/Shapefile), resolving all the points with a single spatial join.
+
+Dependencies:
+- geopandas: For the reverse geocoding and the spatial join.
+- shapely: For the geometric points.
+- RateLimiter, Backoff: Custom classes for the rate limit and the retries of the online requests.
+
+Usage:
+    - Create an instance of a Geocoder backend.
+    - Pass the instance to the Transformer as geocoder.
+"""
+from models.dimension_location_model import DimensionLocationModel
+from etl.rate_limiter import RateLimiter, Backoff
+from etl.metrics import metrics
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Geocoder:
+
+    """
+    Base class of the geocoder backends.
+
+    The Transformer collects the distinct coordinates not in cache and resolves them with
+    a single call to reverse_many before building the records.
+    """
+
+    def reverse(self, coordinates: tuple) -> DimensionLocationModel:
+        """
+        Resolves a single point.
+
+        Args:
+            coordinates (tuple): The rounded (latitude, longitude) tuple.
+
+        Returns:
+            DimensionLocationModel: The resolved location, or None if the point can't be resolved.
+
+        Raises:
+            Exception: If the service fails, the point may be resolved by a later request.
+        """
+        raise NotImplementedError()
+
+    def reverse_many(self, coordinates: Iterable[tuple]) -> Dict[tuple, DimensionLocationModel]:
+        """
+        Resolves many points, the default implementation calls reverse for each point.
+
+        Args:
+            coordinates (Iterable[tuple]): The rounded (latitude, longitude) tuples.
+
+        Returns:
+            dict: A map from each coordinate to the resolved location (or None),
+                the points failed because of an error are not in the map.
+        """
+        result = {}
+        for c in coordinates:
+            try:
+                result[c] = self.reverse(c)
+            except Exception as e:
+                logger.warning("Location %s fails: %s", c, e)
+        return result
+
+class NominatimGeocoder(Geocoder):
+
+    """
+    Online geocoder using the Nominatim service through geopandas.
+
+    The requests are sent by a bounded pool of threads sharing an adaptive token bucket,
+    so the service is never called faster than `rate`, and the failed requests are retried
+    with exponential backoff up to max_retries times instead of forever.
+
+    Attributes:
+        limiter (RateLimiter): The token bucket shared by all the requests.
+        backoff (Backoff): The retry policy of a single request.
+        concurrency (int): The maximum number of requests in flight.
+    """
+
+    def __init__(self, rate=3.0, concurrency=4, max_retries=5, base_delay=1.0, max_delay=30.0):
+        """
+        Initializes the NominatimGeocoder.
+
+        Args:
+            rate (float): The maximum number of requests per second.
+            concurrency (int): The maximum number of requests in flight.
+            max_retries (int): The number of retries of a failed request.
+            base_delay (float): The delay of the first retry in seconds, doubled at every retry.
+            max_delay (float): The maximum delay between two retries in seconds.
+        """
+        self.limiter = RateLimiter(rate)
+        self.backoff = Backoff(max_retries=max_retries, base_delay=base_delay, max_delay=max_delay)
+        self.concurrency = concurrency
+
+    def reverse(self, coordinates: tuple) -> DimensionLocationModel:
+        return self.backoff(self.__request, coordinates, limiter=self.limiter)
+
+    def reverse_many(self, coordinates: Iterable[tuple]) -> Dict[tuple, DimensionLocationModel]:
+        coordinates = list(dict.fromkeys(coordinates))
+        if not coordinates:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            results = list(executor.map(self.__try_reverse, coordinates))
+        return {c: location for c, (resolved, location) in zip(coordinates, results) if resolved}
+
+    def __try_reverse(self, coordinates: tuple):
+        """
+        Returns (True, location), or (False, None) if the request failed after all the retries.
+        """
+        try:
+            return True, self.reverse(coordinates)
+        except Exception as e:
+            logger.warning("Location %s fails after %d retries: %s", coordinates, self.backoff.max_retries, e)
+            return False, None
+
+    def __request(self, coordinates: tuple) -> DimensionLocationModel:
+        """
+        Sends a single request to the service.
+        """
+        point = Point(coordinates[1], coordinates[0])
+        start = time.perf_counter()
+        try:
+            loc = gpd.tools.reverse_geocode(point)
+        except Exception:
+            metrics.increment("http_errors", service="geocoder")
+            raise
+        finally:
+            metrics.observe("http_request_seconds", time.perf_counter() - start, service="geocoder")
+        address = loc["address"][0]
+        tmp = None
+        if(address is not None and len(address) > 0):
+            tmp = DimensionLocationModel(latitude=coordinates[0], longitude=coordinates[1], state=None, country=None, city=None)
+            split_string = [s.strip() for s in address.split(',')]
+            tmp.city = split_string[len(split_string) - 3] or None
+            tmp.state = split_string[len(split_string) - 2] or None
+            tmp.country = split_string[len(split_string) - 1] or None
+        return tmp
+
+class BoundaryGeocoder(Geocoder):
+
+    """
+    Offline geocoder resolving the points against a local admin-boundary dataset.
+
+    The boundaries are loaded once and indexed by geopandas (STRtree spatial index),
+    all the points are resolved with one vectorized point-in-polygon spatial join.
+
+    Attributes:
+        path (str): The path of the boundary file (GeoPackage, Shapefile, ...).
+        city_column (str): The column containing the city name, None if not available.
+        state_column (str): The column containing the state name, None if not available.
+        country_column (str): The column containing the country name.
+    """
+
+    def __init__(self, path, country_column, state_column=None, city_column=None, layer=None):
+        """
+        Loads the boundary file and builds its spatial index.
+
+        Args:
+            path (str): The path of the boundary file.
+            country_column (str): The column containing the country name.
+            state_column (str): The column containing the state name.
+            city_column (str): The column containing the city name.
+            layer (str): The layer to read, for multi-layer files like GeoPackage.
+        """
+        self.path = path
+        self.city_column = city_column
+        self.state_column = state_column
+        self.country_column = country_column
+        columns = [c for c in (city_column, state_column, country_column) if c is not None]
+        boundaries = gpd.read_file(path, layer=layer) if layer else gpd.read_file(path)
+        if boundaries.crs is not None:
+            boundaries = boundaries.to_crs("EPSG:4326")
+        self.__boundaries = boundaries[columns + ["geometry"]]
+        self.__boundaries.sindex # Build the spatial index once
+
+    def reverse(self, coordinates: tuple) -> DimensionLocationModel:
+        return self.reverse_many([coordinates])[coordinates]
+
+    def reverse_many(self, coordinates: Iterable[tuple]) -> Dict[tuple, DimensionLocationModel]:
+        coordinates = list(dict.fromkeys(coordinates))
+        if not coordinates:
+            return {}
+        points = gpd.GeoDataFrame(
+            geometry=gpd.points_from_xy([c[1] for c in coordinates], [c[0] for c in coordinates]),
+            crs="EPSG:4326"
+        )
+        joined = gpd.sjoin(points, self.__boundaries, how="left", predicate="within")
+        joined = joined[~joined.index.duplicated(keep="first")] # Overlapping polygons, keep the first match
+
+        result = {}
+        for index, c in enumerate(coordinates):
+            row = joined.loc[index]
+            if row["index_right"] != row["index_right"]: # NaN, the point is outside every boundary
+                result[c] = None
+                continue
+            result[c] = DimensionLocationModel(
+                latitude=c[0],
+                longitude=c[1],
+                city=self.__value(row, self.city_column),
+                state=self.__value(row, self.state_column),
+                country=self.__value(row, self.country_column)
+            )
+        return result
+
+    def __value(self, row, column):
+        """
+        Returns the value of the column in the joined row, None if the column is not configured or empty.
+        """
+        if column is None:
+            return None
+        value = row[column]
+        if value is None or value != value or len(str(value)) == 0:
+            return None
+        return str(value)
@@ -0,0 +1,188 @@
+"""
+GeocodingCache Class for persisting the reverse geocoding results
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the GeocodingCache class, a SQLite backed cache that keeps the
+reverse geocoding results between different runs of the ETL process, so that the
+coordinates already resolved are never sent again to the geocoding service.
+
+Dependencies:
+- sqlite3: For storing the cached locations on disk.
+
+Usage:
+    - Create an instance of GeocodingCache passing the path of the cache file.
+    - Pass the instance to the Transformer as location_cache.
+"""
+import sqlite3
+import threading
+import time
+from models.dimension_location_model import DimensionLocationModel
+
+_MISSING = object()
+
+class GeocodingCache:
+
+    """
+    A persistent cache of reverse geocoding results keyed by the rounded (latitude, longitude) tuple.
+
+    The cache behaves like the dict previously used by the Transformer: `in`, `[]` and `[] =`
+    are supported. Negative results (None) are stored as well, so the unresolvable coordinates
+    are not requested again. SQLite in WAL mode is used as storage, so the same file can be
+    shared by concurrent runs.
+
+    Attributes:
+        path (str): The path of the SQLite file.
+        ttl (float): The time to live of an entry in seconds, None means the entries never expire.
+        max_entries (int): The maximum number of entries kept on disk, None means unlimited.
+        read_only (bool): True if the cache can't be modified.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS geocoding_cache (
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            resolved INTEGER NOT NULL,
+            city TEXT,
+            state TEXT,
+            country TEXT,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (latitude, longitude)
+        )
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None, timeout=30.0, read_only=False):
+        """
+        Opens (or creates) the cache file and removes the expired entries.
+
+        Args:
+            path (str): The path of the SQLite file.
+            ttl (float): The time to live of an entry in seconds, None to keep the entries forever.
+            max_entries (int): The maximum number of entries kept on disk, None for no limit.
+            timeout (float): Seconds to wait for a lock held by another run before failing.
+            read_only (bool): Opens the file in read-only mode, used by the processes of the parallel transformation.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.read_only = read_only
+        self.__memory = {} # Entries already read or written by this run
+        self.__lock = threading.Lock()
+        if read_only:
+            self.__connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=timeout, isolation_level=None, check_same_thread=False)
+            return
+        self.__connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__connection.execute(self._SCHEMA)
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS geocoding_cache_created_at ON geocoding_cache (created_at)")
+        self.evict()
+
+    def __reduce__(self):
+        """
+        A pickled cache is reopened in read-only mode on the same file, so it can be shared
+        with the processes of the parallel transformation.
+        """
+        return (GeocodingCache, (self.path, self.ttl, None, self.timeout, True))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, coordinates):
+        return self.get(coordinates, _MISSING) is not _MISSING
+
+    def __getitem__(self, coordinates):
+        value = self.get(coordinates, _MISSING)
+        if value is _MISSING:
+            raise KeyError(coordinates)
+        return value
+
+    def __setitem__(self, coordinates, location: DimensionLocationModel):
+        """
+        Stores the location (or None when the coordinates can't be resolved).
+
+        Args:
+            coordinates (tuple): The rounded (latitude, longitude) tuple.
+            location (DimensionLocationModel): The resolved location or None.
+        """
+        if self.read_only:
+            raise Exception("The geocoding cache is opened in read-only mode")
+        with self.__lock:
+            self.__memory[coordinates] = location
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO geocoding_cache (latitude, longitude, resolved, city, state, country, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    coordinates[0],
+                    coordinates[1],
+                    0 if location is None else 1,
+                    None if location is None else location.city,
+                    None if location is None else location.state,
+                    None if location is None else location.country,
+                    time.time()
+                )
+            )
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM geocoding_cache").fetchone()[0]
+
+    def get(self, coordinates, default=None):
+        """
+        Returns the cached location for the coordinates.
+
+        Args:
+            coordinates (tuple): The rounded (latitude, longitude) tuple.
+            default: The value returned if the coordinates are not cached (or expired).
+
+        Returns:
+            DimensionLocationModel: The cached location, None for a cached negative result, or default.
+        """
+        with self.__lock:
+            if coordinates in self.__memory:
+                return self.__memory[coordinates]
+            query = "SELECT resolved, city, state, country FROM geocoding_cache WHERE latitude = ? AND longitude = ?"
+            params = [coordinates[0], coordinates[1]]
+            if self.ttl is not None:
+                query += " AND created_at >= ?"
+                params.append(time.time() - self.ttl)
+            row = self.__connection.execute(query, params).fetchone()
+            if row is None:
+                return default
+            location = None
+            if row[0]:
+                location = DimensionLocationModel(latitude=coordinates[0], longitude=coordinates[1], city=row[1], state=row[2], country=row[3])
+            self.__memory[coordinates] = location
+            return location
+
+    def evict(self):
+        """
+        Removes the expired entries and, if max_entries is set, the oldest entries over the limit.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        removed = 0
+        if self.read_only:
+            return removed
+        with self.__lock:
+            if self.ttl is not None:
+                removed += self.__connection.execute(
+                    "DELETE FROM geocoding_cache WHERE created_at < ?", (time.time() - self.ttl,)
+                ).rowcount
+            if self.max_entries is not None:
+                removed += self.__connection.execute(
+                    "DELETE FROM geocoding_cache WHERE rowid IN (SELECT rowid FROM geocoding_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                ).rowcount
+        return removed
+
+    def close(self):
+        """
+        Closes the connection to the cache file.
+        """
+        with self.__lock:
+            self.__connection.close()
@@ -8,13 +8,15 @@ Usage:
     - Call method save_data using with
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, delete, values, column, Integer
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import sessionmaker
 from orm.persistence import Meteorite
 from orm.persistence import Classification
 from orm.persistence import Date
 from orm.persistence import Location
 from models.meteorite_model import MeteoriteModel
+from etl.rollup import Rollup
 from models.dimension_location_model import DimensionLocationModel
 from models.dimension_date_model import DimensionDateModel
 from models.dimension_classification_model import DimensionClassificationModel
@@ -24,20 +26,32 @@ import os
 
 class Loader:
 
-    # Environment variable for database url
-    DATABASE_URL = os.getenv("DATABASE_URL")
+    """
+    Loads the MeteoriteModel instances into the star schema.
 
-    def __init__(self, data: List[MeteoriteModel]):
+    Each dimension member is inserted only once: the loader keeps a map from the natural key
+    to the surrogate id of each dimension, preloaded from the database when the session starts,
+    and every fact references the existing member when its natural key is already known.
+    The natural keys are (latitude, longitude) for the location, the timestamp for the date and
+    all the classification attributes for the classification. The facts are upserted on the NASA id,
+    so loading again a record updates it. The rollup of the facts is refreshed by commit, in the same transaction.
+    """
+
+    def __init__(self, data: List[MeteoriteModel], database_url=None):
 
         """
         Initialize the Loader instance.
 
         :param data: A list of MeteoriteModel instances to be loaded into the database.
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
         """
         self.transformed_data = data
-        self.__engine = create_engine(self.DATABASE_URL)
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"))
         self.__Session = sessionmaker(bind=self.__engine)
         self.__session = None
+        self.__location_ids = {} # Natural key -> surrogate id of the location dimension
+        self.__date_ids = {} # Natural key -> surrogate id of the date dimension
+        self.__classification_ids = {} # Natural key -> surrogate id of the classification dimension
 
     def __enter__(self):
         """
@@ -46,6 +60,7 @@ class Loader:
         return: The current instance of the Loader.
         """
         self.__session = self.__Session()
+        self.__preload()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -58,6 +73,44 @@ class Loader:
         if self.__session:
             self.__session.close()
 
+    def __preload(self):
+        """
+        Load the natural key -> surrogate id maps of the dimensions already stored in the database.
+        """
+        self.__location_ids = {
+            (row.latitude, row.longitude): row.id
+            for row in self.__session.execute(select(Location.id, Location.latitude, Location.longitude))
+        }
+        self.__date_ids = {
+            row.date: row.id
+            for row in self.__session.execute(select(Date.id, Date.date))
+        }
+        self.__classification_ids = {
+            (row.classification, row.material_type, row.chemical_composition, row.clan, row.clazz): row.id
+            for row in self.__session.execute(select(
+                Classification.id, Classification.classification, Classification.material_type,
+                Classification.chemical_composition, Classification.clan, Classification.clazz
+            ))
+        }
+
+    def __location_key(self, raw_data: DimensionLocationModel):
+        """
+        Return the natural key of the location dimension.
+        """
+        return (raw_data.location[0], raw_data.location[1])
+
+    def __date_key(self, raw_data: DimensionDateModel):
+        """
+        Return the natural key of the date dimension.
+        """
+        return datetime.fromtimestamp(raw_data.timestamp)
+
+    def __classification_key(self, raw_data: DimensionClassificationModel):
+        """
+        Return the natural key of the classification dimension.
+        """
+        return (raw_data.group, raw_data.material, raw_data.chemical_composition, raw_data.clan, raw_data.clazz)
+
     def __build_location(self, raw_data: DimensionLocationModel):
         """
         Convert DimensionLocationModel to Location entity.
@@ -105,19 +158,99 @@ class Loader:
     def save_data(self):
         """
         Load the transformed data into the database. Each MeteoriteModel is converted to
-        a Meteorite entity with associated Classification, Date, and Location entities.
+        a Meteorite entity referencing the Classification, Date, and Location entities,
+        the dimension entities are created only if not already stored.
         """
         if not self.__session:
             raise Exception("Session not started. ")
         try:
-            for record in self.transformed_data:
-                m = Meteorite()
-                m.classification = self.__build_classification(record.dimensionClassificationModel)
-                m.date = self.__build_date(record.dimensionDateModel)
-                m.location = self.__build_location(record.dimensionLocationModel)
-                m.mass = record.mass
-                self.__session.add(m)
-            self.__session.commit() # Commit changes in atomic way
+            self.save_batch(self.transformed_data)
+            self.commit() # Commit changes in atomic way
         except Exception as e:
+            self.rollback()
+            raise e
+
+    def save_batch(self, data: List[MeteoriteModel]):
+        """
+        Send a batch of MeteoriteModel to the database without committing, the transaction
+        stays open until commit is called. The flushed entities are detached from the session,
+        so the memory used by the loader does not grow with the number of batches.
+
+        :param data: A list of MeteoriteModel instances to be loaded into the database.
+        """
+        if not self.__session:
+            raise Exception("Session not started. ")
+
+        # Insert the dimension members not yet known, once for each natural key
+        locations = {}
+        dates = {}
+        classifications = {}
+        for record in data:
+            key = self.__location_key(record.dimensionLocationModel)
+            if key not in self.__location_ids and key not in locations:
+                locations[key] = self.__build_location(record.dimensionLocationModel)
+            key = self.__date_key(record.dimensionDateModel)
+            if key not in self.__date_ids and key not in dates:
+                dates[key] = self.__build_date(record.dimensionDateModel)
+            key = self.__classification_key(record.dimensionClassificationModel)
+            if key not in self.__classification_ids and key not in classifications:
+                classifications[key] = self.__build_classification(record.dimensionClassificationModel)
+        self.__session.add_all(locations.values())
+        self.__session.add_all(dates.values())
+        self.__session.add_all(classifications.values())
+        self.__session.flush()
+        self.__location_ids.update((key, entity.id) for key, entity in locations.items())
+        self.__date_ids.update((key, entity.id) for key, entity in dates.items())
+        self.__classification_ids.update((key, entity.id) for key, entity in classifications.items())
+
+        # Insert the facts referencing the dimension members
+        facts = [
+            {
+                "nasa_id": record.nasa_id,
+                "mass": record.mass,
+                "id_location": self.__location_ids[self.__location_key(record.dimensionLocationModel)],
+                "id_date": self.__date_ids[self.__date_key(record.dimensionDateModel)],
+                "id_classification": self.__classification_ids[self.__classification_key(record.dimensionClassificationModel)],
+                "year": record.dimensionDateModel.year
+            }
+            for record in data
+        ]
+        if facts:
+            # The facts whose year is changed are moved, the key of a partitioned table includes the year
+            loaded = values(column("nasa_id", Integer), column("year", Integer), name="loaded").data(
+                [(fact["nasa_id"], fact["year"]) for fact in facts]
+            )
+            self.__session.execute(delete(Meteorite).where(
+                Meteorite.nasa_id == loaded.c.nasa_id, Meteorite.year != loaded.c.year
+            ))
+            # The facts already loaded by a previous run are updated
+            statement = insert(Meteorite)
+            self.__session.execute(statement.on_conflict_do_update(
+                constraint="meteorite_nasa_id_key",
+                set_={
+                    "mass": statement.excluded.mass,
+                    "id_location": statement.excluded.id_location,
+                    "id_date": statement.excluded.id_date,
+                    "id_classification": statement.excluded.id_classification
+                }
+            ), facts)
+        self.__session.expunge_all()
+
+    def commit(self):
+        """
+        Refresh the rollup and commit all the batches sent to the database.
+        """
+        if not self.__session:
+            raise Exception("Session not started. ")
+        with self.__session.connection().connection.cursor() as cursor:
+            Rollup.refresh(cursor)
+        self.__session.commit()
+
+    def rollback(self):
+        """
+        Discard all the batches sent to the database and not yet committed.
+        The surrogate id maps are reloaded, because the discarded members no longer exist.
+        """
+        if self.__session:
             self.__session.rollback()
-            raise e
\ No newline at end of file
+            self.__preload()
@@ -0,0 +1,199 @@
+"""
+Metrics Class for the instrumentation of the ETL process
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the Metrics class, a small thread-safe registry of counters and
+histograms filled by the stages of the ETL process, and the `metrics` instance shared by
+all the classes of the package. At the end of a run the registry is exported as JSON or
+in the Prometheus text format, together with the derived rates (records/s of each stage,
+hit ratio of the geocoding cache, pages not modified).
+
+Metrics recorded by the ETL classes:
+- stage_seconds{stage}: wall time spent by each stage (extract, transform, load, run).
+- records{stage}: records produced by each stage.
+- pages_fetched{source}: pages received from the NASA API.
+- http_request_seconds{service}: latency histogram of the HTTP requests (nasa, geocoder).
+- http_errors{service}: failed HTTP requests.
+- geocoding_cache{result}: location lookups by result (hit, miss).
+- page_cache{result}: pages requested with the raw page cache (modified, not_modified, offline).
+- records_rejected{reason}: records rejected by the transformation.
+
+Dependencies:
+- threading: For updating the registry from concurrent stages.
+
+Usage:
+    - Import `metrics` and call increment, observe or timer.
+    - Call to_json or to_prometheus at the end of the run.
+"""
+from contextlib import contextmanager
+import bisect
+import json
+import threading
+import time
+
+class Metrics:
+
+    """
+    A thread-safe registry of labelled counters and histograms.
+
+    Attributes:
+        buckets (tuple): The upper bounds (seconds) of the histogram buckets.
+    """
+
+    _BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=_BUCKETS):
+        """
+        Initializes an empty registry.
+
+        Args:
+            buckets (tuple): The upper bounds of the histogram buckets, in increasing order.
+        """
+        self.buckets = tuple(buckets)
+        self.__counters = {} # (name, labels) -> value
+        self.__histograms = {} # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.__lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds value to the counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (float): The amount to add.
+            **labels: The labels of the counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value (e.g. a latency in seconds) in the histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            value (float): The observed value.
+            **labels: The labels of the histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[bisect.bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Adds the wall time of the with block to stage_seconds{stage}.
+
+        Args:
+            stage (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.increment("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def value(self, name, **labels):
+        """
+        Returns the value of the counter, 0 if never incremented.
+        """
+        with self.__lock:
+            return self.__counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        """
+        Removes all the recorded values.
+        """
+        with self.__lock:
+            self.__counters = {}
+            self.__histograms = {}
+
+    def snapshot(self) -> dict:
+        """
+        Returns the recorded values and the derived rates.
+
+        Returns:
+            dict: A dict with the counters, the histograms (cumulative buckets) and the rates.
+        """
+        with self.__lock:
+            counters = dict(self.__counters)
+            histograms = {key: list(values) for key, values in self.__histograms.items()}
+
+        result = {"counters": [], "histograms": [], "rates": {}}
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].append({"name": name, "labels": dict(labels), "value": value})
+        for (name, labels), values in sorted(histograms.items()):
+            cumulative, buckets = 0, {}
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            result["histograms"].append({"name": name, "labels": dict(labels), "buckets": buckets, "count": cumulative, "sum": values[-1]})
+
+        for (name, labels), seconds in counters.items():
+            labels = dict(labels)
+            if name == "stage_seconds" and seconds > 0 and ("records", (("stage", labels["stage"]),)) in counters:
+                result["rates"][f"{labels['stage']}_records_per_second"] = counters[("records", (("stage", labels["stage"]),))] / seconds
+        hits = counters.get(("geocoding_cache", (("result", "hit"),)), 0)
+        misses = counters.get(("geocoding_cache", (("result", "miss"),)), 0)
+        if hits + misses > 0:
+            result["rates"]["geocoding_cache_hit_ratio"] = hits / (hits + misses)
+        not_modified = counters.get(("page_cache", (("result", "not_modified"),)), 0)
+        modified = counters.get(("page_cache", (("result", "modified"),)), 0)
+        if not_modified + modified > 0:
+            result["rates"]["page_cache_not_modified_ratio"] = not_modified / (not_modified + modified)
+        return result
+
+    def to_json(self) -> str:
+        """
+        Returns the snapshot in JSON format.
+        """
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="etl_") -> str:
+        """
+        Returns the snapshot in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): The prefix added to the name of every metric.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in snapshot["counters"]:
+            name = f"{prefix}{counter['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self.__labels(counter['labels'])} {counter['value']}")
+        for histogram in snapshot["histograms"]:
+            name = f"{prefix}{histogram['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in histogram["buckets"].items():
+                lines.append(f"{name}_bucket{self.__labels(dict(histogram['labels'], le=bound))} {count}")
+            lines.append(f"{name}_sum{self.__labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{self.__labels(histogram['labels'])} {histogram['count']}")
+        for rate, value in sorted(snapshot["rates"].items()):
+            lines.append(f"# TYPE {prefix}{rate} gauge")
+            lines.append(f"{prefix}{rate} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __labels(labels: dict) -> str:
+        """
+        Formats the labels of a Prometheus sample.
+        """
+        if not labels:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for v in labels.values())
+        return "{" + ",".join(f"{k}=\"{v}\"" for k, v in zip(labels.keys(), escaped)) + "}"
+
+# The registry shared by the ETL classes
+metrics = Metrics()
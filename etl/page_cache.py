@@ -0,0 +1,126 @@
+"""
+PageCache Class for keeping the raw pages of the NASA API on disk
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the PageCache class used by the extractors: every page is stored on disk
+(gzip compressed) with the ETag and Last-Modified headers of the response. The next request of
+the same page sends If-None-Match / If-Modified-Since, so an unchanged page comes back as
+HTTP 304 without body and is read from disk. In offline mode the API is never called.
+
+Dependencies:
+- gzip, hashlib, json: For the compressed pages, the keys and the metadata.
+
+Usage:
+    - Create an instance of PageCache passing the directory.
+    - Pass the instance to the Extractor or to the AsyncExtractor as page_cache.
+"""
+from urllib.parse import urlencode
+import gzip
+import hashlib
+import json
+import os
+import time
+
+class PageCache:
+
+    """
+    A directory of raw pages keyed by the request (URL and parameters).
+
+    For each page two files are stored: <key>.json.gz with the body as returned by the API
+    and <key>.meta.json with the URL and the validators (ETag, Last-Modified) of the response.
+
+    Attributes:
+        directory (str): The directory of the cached pages.
+        offline (bool): True if the pages must be read only from disk, the missing pages are empty.
+    """
+
+    def __init__(self, directory, offline=False):
+        """
+        Initializes the PageCache, the directory is created if needed.
+
+        Args:
+            directory (str): The directory of the cached pages.
+            offline (bool): Reads the pages only from disk, without calling the API.
+        """
+        self.directory = directory
+        self.offline = offline
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url, params: dict = None) -> str:
+        """
+        Returns the key of a request.
+
+        Args:
+            url (str): The URL of the request.
+            params (dict): The query parameters not included in the URL.
+        """
+        request = url if not params else f"{url}?{urlencode(sorted(params.items()))}"
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def conditional_headers(self, key) -> dict:
+        """
+        Returns the headers making the request conditional, empty if the page is not cached.
+
+        Args:
+            key (str): The key of the request.
+        """
+        meta = self.__meta(key)
+        if meta is None or not os.path.exists(self.__body_path(key)):
+            return {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load(self, key):
+        """
+        Returns the cached page.
+
+        Args:
+            key (str): The key of the request.
+
+        Returns:
+            list: The records of the page, None if the page is not cached.
+        """
+        try:
+            with gzip.open(self.__body_path(key), "rb") as file:
+                return json.loads(file.read())
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, url, body: bytes, etag=None, last_modified=None):
+        """
+        Stores the body of a response and its validators, the files are replaced atomically.
+
+        Args:
+            key (str): The key of the request.
+            url (str): The URL of the request, stored for debugging.
+            body (bytes): The decoded body of the response.
+            etag (str): The ETag header of the response.
+            last_modified (str): The Last-Modified header of the response.
+        """
+        path = self.__body_path(key)
+        with gzip.open(f"{path}.tmp", "wb", compresslevel=1) as file:
+            file.write(body)
+        os.replace(f"{path}.tmp", path)
+        meta_path = self.__meta_path(key)
+        with open(f"{meta_path}.tmp", "w") as file:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified, "stored_at": time.time()}, file)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def __meta(self, key):
+        try:
+            with open(self.__meta_path(key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def __body_path(self, key):
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def __meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.meta.json")
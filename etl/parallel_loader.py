@@ -0,0 +1,222 @@
+"""
+ParallelLoader Class for implement the loader process over many database connections
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the ParallelLoader class, an alternative to the BulkLoader for the large
+loads: the dimension members of each batch are stored first, then the facts are partitioned
+by NASA id and written with COPY over a pool of connections at the same time, each partition
+committing in batches of bounded size. The load time then depends on the write capacity of
+the database instead of a single connection.
+
+Dependencies:
+- psycopg2: For COPY FROM STDIN (copy_expert).
+- concurrent.futures: For the writers of the partitions.
+
+Usage:
+    - Create an instance of ParallelLoader.
+    - Call method save_data using with, or save_batch and commit like the other loaders.
+"""
+
+from sqlalchemy import create_engine
+from models.meteorite_model import MeteoriteModel
+from etl.bulk_loader import BulkLoader
+from etl.rollup import Rollup
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import List
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class ParallelLoader:
+
+    """
+    Loads the MeteoriteModel instances over `workers` connections, it has the same interface of the Loader.
+
+    For every batch the distinct dimension members are copied to the staging table of the dimension
+    connection and committed before the facts, so every writer can resolve the surrogate keys.
+    The facts are partitioned on the NASA id: each partition has its own connection and its own
+    thread, so the same record is always written by the same connection, in order, and two
+    connections never wait for each other on the same row. Each partition commits every
+    `batch_size` facts and save_batch returns while the facts are written.
+
+    Unlike the other loaders the load is not a single transaction: commit waits until all the
+    facts are written and committed, rollback only discards the facts not yet written. The facts
+    are upserted on the NASA id, so loading again the same records after a failure is safe.
+    The rollup of the facts is refreshed by commit, after all the facts are committed.
+
+    Attributes:
+        transformed_data (List[MeteoriteModel]): The records loaded by save_data.
+        workers (int): The number of connections writing the facts.
+        batch_size (int): The maximum number of facts sent with a single COPY and committed at once.
+        isolation_level (str): The isolation level of the connections.
+        max_pending_batches (int): The maximum number of fact batches waiting for each connection.
+    """
+
+    _ISOLATION_LEVELS = ("READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE")
+
+    def __init__(self, data: List[MeteoriteModel], workers=4, batch_size=5000, isolation_level="READ COMMITTED", max_pending_batches=2, database_url=None):
+
+        """
+        Initialize the ParallelLoader instance.
+
+        :param data: A list of MeteoriteModel instances to be loaded into the database.
+        :param workers: The number of connections writing the facts.
+        :param batch_size: The maximum number of facts sent with a single COPY and committed at once.
+        :param isolation_level: READ COMMITTED, REPEATABLE READ or SERIALIZABLE.
+        :param max_pending_batches: The maximum number of fact batches waiting for each connection.
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        if isolation_level not in self._ISOLATION_LEVELS:
+            raise ValueError(f"Unknown isolation level: {isolation_level}")
+        self.transformed_data = data
+        self.workers = workers
+        self.batch_size = batch_size
+        self.isolation_level = isolation_level
+        self.max_pending_batches = max_pending_batches
+        # One connection for the dimensions and one for each partition of the facts
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"), pool_size=workers + 1, max_overflow=0, isolation_level=isolation_level)
+        self.__connection = None
+        self.__writers = []
+
+    def __enter__(self):
+        """
+        Open the connections and the writers of the partitions, return the ParallelLoader instance.
+        This method is called when the loader using with
+        return: The current instance of the ParallelLoader.
+        """
+        self.__connection = self.__open()
+        for _ in range(self.workers):
+            self.__writers.append((self.__open(), ThreadPoolExecutor(max_workers=1), deque()))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        """
+        Stop the writers and close the connections, the facts not yet written are discarded.
+
+        This method is called when with finishs the execution
+        """
+        for connection, executor, pending in self.__writers:
+            executor.shutdown(wait=True, cancel_futures=True)
+            connection.close()
+        self.__writers = []
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    def save_data(self):
+        """
+        Load the transformed data into the database in batches of batch_size records.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        try:
+            for i in range(0, len(self.transformed_data), self.batch_size):
+                self.save_batch(self.transformed_data[i:i + self.batch_size])
+            self.commit()
+        except Exception as e:
+            self.rollback()
+            raise e
+
+    def save_batch(self, data: List[MeteoriteModel]):
+        """
+        Store the dimension members of the batch and queue the facts to the writers of their partitions.
+        It waits only if a writer has max_pending_batches batches not yet written.
+
+        :param data: A list of MeteoriteModel instances to be loaded into the database.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        if not data:
+            return
+        rows = [BulkLoader.build_row(record) for record in data]
+
+        # The distinct dimension members, without the fact columns
+        dimensions = {tuple(row[2:]): [None, None, *row[2:]] for row in rows}
+        try:
+            with self.__connection.cursor() as cursor:
+                BulkLoader.copy_rows(cursor, dimensions.values())
+                for statement in BulkLoader._MOVE_DIMENSIONS:
+                    cursor.execute(statement)
+                cursor.execute("TRUNCATE staging_meteorite")
+            self.__connection.commit()
+        except Exception:
+            self.__connection.rollback()
+            raise
+
+        partitions = [[] for _ in range(self.workers)]
+        for row in rows:
+            partitions[(row[0] or 0) % self.workers].append(row)
+        for (connection, executor, pending), partition in zip(self.__writers, partitions):
+            for i in range(0, len(partition), self.batch_size):
+                while len(pending) >= self.max_pending_batches:
+                    pending.popleft().result() # Raises the error of the writer
+                pending.append(executor.submit(self.__write_facts, connection, partition[i:i + self.batch_size]))
+
+    def commit(self):
+        """
+        Wait until all the facts queued are written and committed, then refresh the rollup.
+        """
+        if not self.__connection:
+            raise Exception("Connection not opened. ")
+        errors = []
+        for connection, executor, pending in self.__writers:
+            while pending:
+                try:
+                    pending.popleft().result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        try:
+            with self.__connection.cursor() as cursor:
+                Rollup.refresh(cursor)
+            self.__connection.commit()
+        except Exception:
+            self.__connection.rollback()
+            raise
+
+    def rollback(self):
+        """
+        Discard the facts queued and not yet written, the batches already committed are kept.
+        """
+        for connection, executor, pending in self.__writers:
+            while pending:
+                future = pending.popleft()
+                if not future.cancel():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.debug("Discarded error of a writer: %s", e)
+        if self.__connection:
+            self.__connection.rollback()
+
+    def __open(self):
+        """
+        Take a connection from the pool and create its staging table.
+        """
+        connection = self.__engine.raw_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(BulkLoader._CREATE_STAGING)
+        connection.commit()
+        return connection
+
+    @staticmethod
+    def __write_facts(connection, rows):
+        """
+        Copy the facts to the staging table of the connection, move them to the fact table and commit.
+        It runs in the thread of the partition.
+        """
+        try:
+            with connection.cursor() as cursor:
+                BulkLoader.copy_rows(cursor, rows)
+                cursor.execute(BulkLoader._DELETE_MOVED_FACTS)
+                cursor.execute(BulkLoader._MOVE_FACTS)
+                cursor.execute("TRUNCATE staging_meteorite")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
@@ -0,0 +1,223 @@
+"""
+Pipeline Class for the streaming ETL process
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the Pipeline class that connects the extraction, the transformation
+and the loading stages with bounded queues. Every page flows to the next stage as soon as
+it is available, so the stages overlap and the memory used does not depend on the size
+of the dataset.
+
+Dependencies:
+- threading: For running the stages concurrently.
+- queue: For the bounded queues between the stages.
+
+Usage:
+    - Create an instance of Pipeline with an iterable of pages, a Transformer and an opened Loader.
+    - Call the run method.
+"""
+from etl.transformer import Transformer
+from etl.loader import Loader
+from etl.metrics import metrics
+from typing import Iterable
+import threading
+import queue
+import time
+
+class Pipeline:
+
+    """
+    Streams the pages from the extraction stage to the transformation and loading stages.
+
+    The extraction and the transformation run in dedicated threads, the loading runs in the caller thread.
+    The queues between the stages are bounded: when a stage is slower than the previous one, the previous
+    stage waits (backpressure). By default all the batches are loaded in a single transaction committed at
+    the end, with commit_every the transaction is committed every commit_every batches and on_commit is
+    notified, so a checkpoint can record the pages already loaded. If any stage fails the transaction not yet
+    committed is rolled back and the error is raised by run.
+    The time spent by each stage and the records it produced are recorded in `metrics`
+    (stage_seconds and records), the time waiting on the queues is not included.
+    Without transformer the pages are already transformed batches (e.g. read from a StageStore), without
+    loader the batches are discarded after the transformation (e.g. when they are written by the StageStore).
+    With a profiler every stage runs inside profiler.stage(name).
+
+    Attributes:
+        pages (Iterable[list]): The pages of raw data, e.g. a generator fed by the Extractor.
+        transformer (Transformer): The transformer used for each page, None if the pages are already transformed.
+        loader (Loader): The loader (already opened with `with`) used for each transformed batch, None to discard them.
+        loaded (int): The number of records sent to the database.
+        commit_every (int): The number of batches committed at once, None to commit only at the end.
+        on_commit (callable): Called after every commit with the number of batches committed since the beginning.
+        profiler (StageProfiler): The profiler of the stages, None to not profile them.
+    """
+
+    _END = object() # Marks the end of a queue
+
+    def __init__(self, pages: Iterable[list], transformer: Transformer, loader: Loader, max_pending_pages=4, max_pending_batches=4, commit_every=None, on_commit=None, profiler=None):
+        """
+        Initializes the Pipeline.
+
+        Args:
+            pages (Iterable[list]): The pages of raw data.
+            transformer (Transformer): The transformer used for each page, None if the pages are already transformed.
+            loader (Loader): The opened loader, None to discard the batches.
+            max_pending_pages (int): The maximum number of pages waiting for the transformation.
+            max_pending_batches (int): The maximum number of transformed batches waiting for the loading.
+            commit_every (int): The number of batches committed at once, None to commit only at the end.
+            on_commit (callable): Called after every commit with the number of batches committed.
+            profiler (StageProfiler): The profiler of the stages, None to not profile them.
+        """
+        self.pages = pages
+        self.transformer = transformer
+        self.loader = loader
+        self.loaded = 0
+        self.commit_every = commit_every
+        self.on_commit = on_commit
+        self.profiler = profiler
+        self.__batches = 0 # Batches sent to the database
+        self.__page_queue = queue.Queue(maxsize=max_pending_pages)
+        self.__batch_queue = queue.Queue(maxsize=max_pending_batches)
+        self.__stop = threading.Event()
+        self.__errors = []
+
+    def run(self):
+        """
+        Runs the pipeline until all the pages are loaded and committed.
+
+        Returns:
+            int: The number of records loaded.
+
+        Raises:
+            Exception: The first error raised by any stage.
+        """
+        threads = [
+            threading.Thread(target=self.__stage, args=("extract", self.__extract), name="pipeline-extract", daemon=True),
+            threading.Thread(target=self.__stage, args=("transform", self.__transform), name="pipeline-transform", daemon=True)
+        ]
+        with metrics.timer("pipeline"):
+            for thread in threads:
+                thread.start()
+            try:
+                self.__stage("load", self.__load)
+            except Exception as e:
+                self.__fail(e)
+            for thread in threads:
+                thread.join()
+
+        if self.__errors:
+            if self.loader is not None:
+                self.loader.rollback()
+            raise self.__errors[0]
+        self.__commit()
+        return self.loaded
+
+    def __stage(self, name, function):
+        """
+        Runs the function of a stage, inside the profiler if any.
+        """
+        if self.profiler is None:
+            return function()
+        with self.profiler.stage(name):
+            return function()
+
+    def __extract(self):
+        try:
+            pages = iter(self.pages)
+            while True:
+                start = time.perf_counter()
+                page = next(pages, self._END)
+                metrics.increment("stage_seconds", time.perf_counter() - start, stage="extract")
+                if page is self._END:
+                    break
+                metrics.increment("records", len(page), stage="extract")
+                if not self.__put(self.__page_queue, page):
+                    return
+            self.__put(self.__page_queue, self._END)
+        except Exception as e:
+            self.__fail(e)
+        finally:
+            close = getattr(self.pages, "close", None)
+            if close is not None:
+                close() # Stops a generator source that is still producing pages
+
+    def __transform(self):
+        try:
+            while True:
+                page = self.__get(self.__page_queue)
+                if page is None:
+                    return
+                if page is self._END:
+                    self.__put(self.__batch_queue, self._END)
+                    return
+                if self.transformer is None:
+                    batch = page
+                else:
+                    with metrics.timer("transform"):
+                        batch = self.transformer.transform_batch(page)
+                    metrics.increment("records", len(batch), stage="transform")
+                if not self.__put(self.__batch_queue, batch):
+                    return
+        except Exception as e:
+            self.__fail(e)
+
+    def __load(self):
+        while True:
+            batch = self.__get(self.__batch_queue)
+            if batch is None or batch is self._END:
+                return
+            if self.loader is None:
+                continue
+            with metrics.timer("load"):
+                self.loader.save_batch(batch)
+            metrics.increment("records", len(batch), stage="load")
+            self.loaded += len(batch)
+            self.__batches += 1
+            if self.commit_every and self.__batches % self.commit_every == 0:
+                self.__commit()
+
+    def __commit(self):
+        """
+        Commits the batches sent to the database and notifies on_commit.
+        """
+        if self.loader is None:
+            return
+        with metrics.timer("load"):
+            self.loader.commit()
+        if self.on_commit is not None:
+            self.on_commit(self.__batches)
+
+    def __put(self, q: queue.Queue, item):
+        """
+        Puts the item in the queue waiting for free space, gives up if the pipeline is failed.
+
+        Returns:
+            bool: True if the item has been queued.
+        """
+        while not self.__stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, q: queue.Queue):
+        """
+        Gets an item from the queue waiting for it, gives up if the pipeline is failed.
+
+        Returns:
+            The item, or None if the pipeline is failed.
+        """
+        while not self.__stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def __fail(self, error: Exception):
+        """
+        Records the error and stops all the stages.
+        """
+        self.__errors.append(error)
+        self.__stop.set()
@@ -0,0 +1,185 @@
+"""
+StageProfiler Class for profiling the stages of the ETL process
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the StageProfiler class that records where the time and the memory of a run
+go, written to a directory at the end of the run:
+- <stage>.pstats: the cProfile statistics of each stage of the Pipeline (extract, transform, load),
+  to be read with pstats or snakeviz. Since Python 3.12 cProfile profiles all the threads at once
+  (sys.monitoring), so the statistics of all the stages are written together in run.pstats.
+- <stage>.collapsed: the stacks sampled every interval seconds in the collapsed format of
+  flamegraph.pl and speedscope, one file for each stage and for each other thread (e.g. the
+  threads of the extractor), the time spent waiting on the queues included.
+- memory.txt: with memory, the tracemalloc peak and the lines allocating the memory held at
+  the peak and at the end of the run, compared with the beginning.
+The transformation workers (TRANSFORM_WORKERS > 1) run in other processes and are not profiled.
+
+Dependencies:
+- cProfile, pstats: For the deterministic profiles of the stages.
+- sys._current_frames: For the sampled stacks.
+- tracemalloc: For the memory snapshots.
+
+Usage:
+    - Create an instance of StageProfiler passing the directory and use it with `with` around the run.
+    - Give it to the Pipeline, which wraps each stage with stage(name).
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+class StageProfiler:
+
+    """
+    Profiles the stages of a run with cProfile, a stack sampler and optionally tracemalloc.
+
+    The profiler does nothing until it is entered with `with`, and the Pipeline calls it only once
+    for each stage: a run without profiler does not pay for it.
+
+    Attributes:
+        directory (str): The directory of the profiles, created if needed.
+        memory (bool): True to record the memory with tracemalloc, it slows down the run.
+        interval (float): The seconds between two samples of the stacks.
+    """
+
+    # cProfile uses sys.monitoring since Python 3.12, a single profiler is active for all the threads
+    _PROFILE_PER_THREAD = sys.version_info < (3, 12)
+
+    _MEMORY_INTERVAL = 0.25 # Seconds between two checks of the traced memory
+    _MEMORY_GROWTH = 1.25 # Growth of the traced memory taking a new snapshot of the peak
+    _MEMORY_TOP = 25 # Lines of each memory comparison
+    # Files whose allocations are not reported, the memory of tracemalloc and of the imports
+    _MEMORY_IGNORED = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>")
+
+    def __init__(self, directory, memory=False, interval=0.005):
+        """
+        Initializes the StageProfiler.
+
+        Args:
+            directory (str): The directory of the profiles.
+            memory (bool): True to record the memory with tracemalloc.
+            interval (float): The seconds between two samples of the stacks.
+        """
+        self.directory = directory
+        self.memory = memory
+        self.interval = interval
+        self.__stages = {} # Thread id -> name of the stage running in it
+        self.__stacks = defaultdict(Counter) # Name of the stage or of the thread -> collapsed stack -> samples
+        self.__stop = threading.Event()
+        self.__sampler = None
+        self.__profile = None
+        self.__baseline = None
+        self.__peak = None
+        self.__peak_size = 0
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory:
+            tracemalloc.start() # A frame for each allocation, the statistics are by line
+            self.__baseline = tracemalloc.take_snapshot()
+        if not self._PROFILE_PER_THREAD:
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        self.__sampler = threading.Thread(target=self.__sample, name="profiler", daemon=True)
+        self.__sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__stop.set()
+        self.__sampler.join()
+        if self.__profile is not None:
+            self.__profile.disable()
+            self.__profile.dump_stats(os.path.join(self.directory, "run.pstats"))
+        for name, stacks in self.__stacks.items():
+            with open(os.path.join(self.directory, f"{name}.collapsed"), "w") as file:
+                for stack, samples in sorted(stacks.items()):
+                    file.write(f"{stack} {samples}\n")
+        if self.memory:
+            self.__write_memory()
+            tracemalloc.stop()
+        logger.info("Profiles written to %s", self.directory)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Profiles the stage running in the current thread.
+
+        Args:
+            name (str): The name of the stage, used for the names of the files.
+        """
+        thread = threading.get_ident()
+        self.__stages[thread] = name
+        profile = cProfile.Profile() if self._PROFILE_PER_THREAD else None
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(os.path.join(self.directory, f"{name}.pstats"))
+            self.__stages.pop(thread, None)
+
+    def __sample(self):
+        """
+        Samples the stacks of all the threads, and the memory, until the profiler is exited.
+        """
+        names = {}
+        next_memory = time.monotonic()
+        while not self.__stop.wait(self.interval):
+            for thread, frame in sys._current_frames().items():
+                if thread == threading.get_ident():
+                    continue
+                name = self.__stages.get(thread)
+                if name is None:
+                    if thread not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    name = names.get(thread, str(thread))
+                self.__stacks[name][self.__collapse(frame)] += 1
+            if self.memory and time.monotonic() >= next_memory:
+                next_memory = time.monotonic() + self._MEMORY_INTERVAL
+                current, _ = tracemalloc.get_traced_memory()
+                # A new snapshot only when the memory held grows, a snapshot costs as the number of blocks
+                # (the traces are filtered only when written, filter_traces is slower than the snapshot)
+                if current > max(self.__peak_size * self._MEMORY_GROWTH, self.__peak_size + 2**20):
+                    self.__peak = tracemalloc.take_snapshot()
+                    self.__peak_size = current
+
+    @staticmethod
+    def __collapse(frame):
+        """
+        Returns the stack of the frame in the collapsed format, from the outermost function.
+        """
+        functions = []
+        while frame is not None:
+            code = frame.f_code
+            functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(functions))
+
+    def __write_memory(self):
+        """
+        Writes the peak of the traced memory and the allocations at the peak and at the end, compared with the beginning.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        comparisons = [("At the peak sampled", self.__peak), ("At the end", tracemalloc.take_snapshot())]
+        with open(os.path.join(self.directory, "memory.txt"), "w") as file:
+            file.write(f"Traced memory: {current / 2**20:.1f} MiB at the end, {peak / 2**20:.1f} MiB at the peak\n")
+            for title, snapshot in comparisons:
+                if snapshot is None:
+                    continue
+                file.write(f"\n{title}, compared with the beginning:\n")
+                statistics = [
+                    statistic for statistic in snapshot.compare_to(self.__baseline, "lineno")
+                    if statistic.traceback[0].filename not in self._MEMORY_IGNORED
+                ]
+                for statistic in statistics[:self._MEMORY_TOP]:
+                    file.write(f"{statistic}\n")
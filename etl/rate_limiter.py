@@ -0,0 +1,140 @@
+"""
+RateLimiter and Backoff Classes for the requests to the external services
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the helpers used to call a rate limited service without exceeding
+its limits and without waiting forever when it fails:
+- RateLimiter: an adaptive token bucket shared by all the threads sending requests.
+- Backoff: the exponential backoff with full jitter and a maximum number of retries.
+
+Dependencies:
+- threading: For sharing the token bucket between the threads.
+
+Usage:
+    - Create an instance of RateLimiter and call acquire before every request.
+    - Create an instance of Backoff and call it with the function sending the request.
+"""
+import random
+import threading
+import time
+
+class RateLimiter:
+
+    """
+    A thread-safe token bucket: the tokens are refilled at `rate` per second up to `burst`,
+    every request consumes one token and waits if the bucket is empty.
+
+    The limiter is adaptive: a failure (e.g. HTTP 429) halves the current rate, down to
+    min_rate, and every success gives back a small part of it, up to the configured rate.
+
+    Attributes:
+        rate (float): The maximum number of requests per second.
+        burst (int): The maximum number of requests sent at once after an idle period.
+        min_rate (float): The lowest rate reached by the adaptive decrease.
+        current_rate (float): The rate currently applied.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=None):
+        """
+        Initializes the RateLimiter with a full bucket.
+
+        Args:
+            rate (float): The maximum number of requests per second.
+            burst (int): The capacity of the bucket.
+            min_rate (float): The lowest adaptive rate, by default a tenth of rate.
+        """
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.current_rate = rate
+        self.__tokens = float(self.burst)
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a token is available and consumes it.
+        """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated_at) * self.current_rate)
+                self.__updated_at = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.current_rate
+            time.sleep(wait)
+
+    def success(self):
+        """
+        Increases the current rate after a successful request (additive increase).
+        """
+        with self.__lock:
+            self.current_rate = min(self.rate, self.current_rate + self.rate / 10)
+
+    def failure(self):
+        """
+        Decreases the current rate after a failed request (multiplicative decrease).
+        """
+        with self.__lock:
+            self.current_rate = max(self.min_rate, self.current_rate / 2)
+
+class Backoff:
+
+    """
+    Retries a function with exponential backoff and full jitter: the n-th retry waits a random
+    time between 0 and min(max_delay, base_delay * 2 ** n) seconds.
+
+    Attributes:
+        max_retries (int): The number of retries after the first attempt.
+        base_delay (float): The delay of the first retry in seconds.
+        max_delay (float): The maximum delay between two attempts in seconds.
+    """
+
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=30.0):
+        """
+        Initializes the Backoff.
+
+        Args:
+            max_retries (int): The number of retries after the first attempt.
+            base_delay (float): The delay of the first retry in seconds.
+            max_delay (float): The maximum delay between two attempts in seconds.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def __call__(self, function, *args, limiter: RateLimiter = None):
+        """
+        Calls the function until it succeeds or the retries are exhausted.
+
+        Args:
+            function (callable): The function to call.
+            *args: The arguments of the function.
+            limiter (RateLimiter): An optional rate limiter acquired before every attempt and notified of the result.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Exception: The error of the last attempt.
+        """
+        for attempt in range(self.max_retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                result = function(*args)
+            except Exception:
+                if limiter is not None:
+                    limiter.failure()
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            if limiter is not None:
+                limiter.success()
+            return result
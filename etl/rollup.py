@@ -0,0 +1,131 @@
+"""
+Rollup Class for the maintenance of the pre-aggregated meteorite facts
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the Rollup class that keeps the meteorite_rollup table up to date: the
+number of meteorites and their total, minimum and maximum mass for each year, quarter,
+country and classification, the grain of the dashboards. The triggers of the meteorite table
+record the dimension members of the facts changed (init-scripts/init.sql), the refresh
+computes again only the groups of those members, so its cost depends on the facts loaded
+since the previous refresh and not on the size of the fact table.
+
+Dependencies:
+- psycopg2: The statements run on the cursor of the loader.
+
+Usage:
+    - Call Rollup.refresh with the cursor of the loader before the commit, the rollup is committed with the facts.
+    - Call Rollup.rebuild to compute again all the groups, e.g. after changing the rollup table.
+"""
+
+from etl.metrics import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Rollup:
+
+    """
+    The refresh of meteorite_rollup from the changes recorded in meteorite_rollup_pending.
+
+    The groups of the pending members are removed and computed again from the facts, in the
+    transaction of the caller. Two refreshes never run at the same time: the second waits for
+    the commit of the first, then it finds only the changes committed after it.
+    """
+
+    # Any constant shared by the refreshes, the lock is released at the end of the transaction
+    _LOCK = "SELECT pg_advisory_xact_lock(7462051)"
+
+    _CREATE_DIRTY = """
+        CREATE TEMPORARY TABLE IF NOT EXISTS rollup_dirty (
+            year integer,
+            quarter integer,
+            country varchar(255),
+            id_classification integer
+        ) ON COMMIT DELETE ROWS
+    """
+
+    _COLLECT_DIRTY = """
+        WITH pending AS (
+            DELETE FROM public.meteorite_rollup_pending RETURNING id_date, id_location, id_classification
+        )
+        INSERT INTO rollup_dirty (year, quarter, country, id_classification)
+        SELECT DISTINCT d.year, d.quarter, l.country, p.id_classification
+        FROM (SELECT DISTINCT id_date, id_location, id_classification FROM pending) p
+        JOIN public.date d ON d.id = p.id_date
+        JOIN public.location l ON l.id = p.id_location
+    """
+
+    _CLEAR_PENDING = "DELETE FROM public.meteorite_rollup_pending"
+
+    _REMOVE_DIRTY = """
+        DELETE FROM public.meteorite_rollup r
+        USING rollup_dirty g
+        WHERE r.year IS NOT DISTINCT FROM g.year
+          AND r.quarter IS NOT DISTINCT FROM g.quarter
+          AND r.country IS NOT DISTINCT FROM g.country
+          AND r.id_classification = g.id_classification
+    """
+
+    _AGGREGATE = """
+        INSERT INTO public.meteorite_rollup (
+            year, quarter, country, id_classification,
+            classification, material_type, chemical_composition, clan, clazz,
+            meteorites, total_mass, min_mass, max_mass
+        )
+        SELECT d.year, d.quarter, l.country, m.id_classification,
+               c.classification, c.material_type, c.chemical_composition, c.clan, c.clazz,
+               count(*), sum(m.mass::double precision), min(m.mass), max(m.mass)
+        FROM public.meteorite m
+        JOIN public.date d ON d.id = m.id_date
+        JOIN public.location l ON l.id = m.id_location
+        JOIN public.classification c ON c.id = m.id_classification
+        {filter}
+        GROUP BY d.year, d.quarter, l.country, m.id_classification,
+                 c.classification, c.material_type, c.chemical_composition, c.clan, c.clazz
+    """
+
+    _DIRTY_FILTER = """
+        JOIN rollup_dirty g
+          ON g.year IS NOT DISTINCT FROM d.year
+         AND g.quarter IS NOT DISTINCT FROM d.quarter
+         AND g.country IS NOT DISTINCT FROM l.country
+         AND g.id_classification = m.id_classification
+    """
+
+    @classmethod
+    def refresh(cls, cursor):
+        """
+        Compute again the groups of the facts changed since the previous refresh, without committing.
+
+        :param cursor: A psycopg2 cursor of the transaction writing the facts, or of a later one.
+        :return: The number of groups computed again.
+        """
+        with metrics.timer("rollup"):
+            cursor.execute(cls._LOCK)
+            cursor.execute(cls._CREATE_DIRTY)
+            cursor.execute(cls._COLLECT_DIRTY)
+            groups = cursor.rowcount
+            if groups:
+                cursor.execute(cls._REMOVE_DIRTY)
+                cursor.execute(cls._AGGREGATE.format(filter=cls._DIRTY_FILTER))
+        metrics.increment("rollup_groups", groups)
+        logger.debug("Rollup refreshed, %d groups computed again", groups)
+        return groups
+
+    @classmethod
+    def rebuild(cls, cursor):
+        """
+        Compute again all the groups from the fact table, without committing.
+
+        :param cursor: A psycopg2 cursor.
+        :return: The number of groups.
+        """
+        with metrics.timer("rollup"):
+            cursor.execute(cls._LOCK)
+            cursor.execute(cls._CLEAR_PENDING)
+            cursor.execute("DELETE FROM public.meteorite_rollup")
+            cursor.execute(cls._AGGREGATE.format(filter=""))
+            groups = cursor.rowcount
+        logger.info("Rollup rebuilt, %d groups", groups)
+        return groups
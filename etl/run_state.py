@@ -0,0 +1,172 @@
+"""
+RunState Class for the incremental ETL runs
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the RunState class that tracks what has already been loaded:
+a content hash for each NASA record and, for each run, the high-water mark of the
+NASA update timestamp (:updated_at). An incremental run requests only the records
+updated after the last high-water mark and skips the records whose content did not change.
+The records rejected for a transient reason (e.g. the geocoding failed) are not stored and the
+high-water mark stays below their update timestamp, so the next run requests them again.
+
+Dependencies:
+- hashlib: For the content hash of the records.
+
+Usage:
+    - Create an instance of RunState using with.
+    - Wrap the pages of the extractor with track.
+    - Call save after the records have been committed, with the NASA ids to retry.
+"""
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+from orm.persistence import EtlRecordState
+from orm.persistence import EtlRun
+from datetime import datetime
+from typing import Iterable
+import hashlib
+import json
+import os
+
+class RunState:
+
+    """
+    Tracks the state of the ETL runs in the run-state tables.
+
+    Attributes:
+        mode (str): 'full' to process every record, 'incremental' to process only the new or changed records.
+        high_water_mark (str): The high-water mark of the last run, None if there is no previous run or it must be loaded again.
+        skipped (int): The number of records skipped because not changed.
+    """
+
+    def __init__(self, mode="full", database_url=None):
+        """
+        Initialize the RunState instance.
+
+        :param mode: 'full' or 'incremental'.
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        if mode not in ("full", "incremental"):
+            raise ValueError(f"Unknown ETL mode: {mode}")
+        self.mode = mode
+        self.high_water_mark = None
+        self.skipped = 0
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"))
+        self.__Session = sessionmaker(bind=self.__engine)
+        self.__hashes = {} # nasa_id -> content hash of the records already loaded
+        self.__pending = {} # nasa_id -> (content hash, :updated_at) of the records seen by this run
+        self.__new_high_water_mark = None
+        self.__started_at = None
+
+    def __enter__(self):
+        """
+        Read the state of the previous runs.
+        return: The current instance of the RunState.
+        """
+        self.__started_at = datetime.now()
+        with self.__Session() as session:
+            # The mark of the last run, it can be lower than a previous one if records must be requested again
+            self.high_water_mark = session.execute(
+                select(EtlRun.high_water_mark).where(EtlRun.finished_at.is_not(None)).order_by(EtlRun.id.desc()).limit(1)
+            ).scalar()
+            if self.mode == "incremental":
+                self.__hashes = dict(session.execute(select(EtlRecordState.nasa_id, EtlRecordState.content_hash)).all())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__hashes = {}
+        self.__pending = {}
+
+    @property
+    def updated_since(self):
+        """
+        Returns the timestamp after which the records must be requested, None for a full run.
+        """
+        return self.high_water_mark if self.mode == "incremental" else None
+
+    @staticmethod
+    def content_hash(item: dict):
+        """
+        Returns the SHA-256 of the raw record, ignoring the system fields (starting with ':').
+
+        :param item: The raw record.
+        :return: The hexadecimal hash.
+        """
+        content = {k: v for k, v in item.items() if not k.startswith(":")}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def track(self, pages: Iterable[list]):
+        """
+        Records the content hash and the update timestamp of every record of the pages,
+        in incremental mode the records not changed since the last run are removed.
+
+        :param pages: The pages of raw data.
+        :return: A generator of the (filtered) pages, one for each page even if empty.
+        """
+        try:
+            for page in pages:
+                changed = []
+                for item in page:
+                    updated_at = item.get(":updated_at")
+                    if updated_at and (self.__new_high_water_mark is None or updated_at > self.__new_high_water_mark):
+                        self.__new_high_water_mark = updated_at
+                    nasa_id = str(item.get("id", ""))
+                    if not nasa_id.isdigit():
+                        changed.append(item)
+                        continue
+                    content_hash = self.content_hash(item)
+                    if self.__hashes.get(int(nasa_id)) == content_hash:
+                        self.skipped += 1
+                        continue
+                    self.__pending[int(nasa_id)] = (content_hash, updated_at)
+                    changed.append(item)
+                yield changed # Also when empty, the checkpoint counts the pages given to the Pipeline
+        finally:
+            close = getattr(pages, "close", None)
+            if close is not None:
+                close()
+
+    def save(self, records, retry_ids=(), batch_size=5000):
+        """
+        Stores the hashes of the records seen by the run and the new high-water mark.
+        It must be called only after the records have been committed.
+
+        The records to retry are not stored and the high-water mark stays below their update
+        timestamp, so the next incremental run requests them and does not skip them.
+
+        :param records: The number of records loaded by the run.
+        :param retry_ids: The NASA ids of the records rejected for a transient reason, e.g. the geocoding.
+        :param batch_size: The maximum number of hashes written with a single statement.
+        """
+        now = datetime.now()
+        retry = [self.__pending.pop(nasa_id) for nasa_id in retry_ids if nasa_id in self.__pending]
+        limit = min((updated_at for _, updated_at in retry if updated_at), default=None)
+        with self.__Session() as session:
+            pending = [(nasa_id, content_hash) for nasa_id, (content_hash, _) in self.__pending.items()]
+            for i in range(0, len(pending), batch_size):
+                statement = insert(EtlRecordState).values([
+                    {"nasa_id": nasa_id, "content_hash": content_hash, "loaded_at": now}
+                    for nasa_id, content_hash in pending[i:i + batch_size]
+                ])
+                session.execute(statement.on_conflict_do_update(
+                    index_elements=[EtlRecordState.nasa_id],
+                    set_={"content_hash": statement.excluded.content_hash, "loaded_at": statement.excluded.loaded_at}
+                ))
+            high_water_mark = self.__new_high_water_mark
+            if high_water_mark is None or (self.high_water_mark is not None and self.high_water_mark > high_water_mark):
+                high_water_mark = self.high_water_mark
+            if limit is not None and high_water_mark is not None and high_water_mark >= limit:
+                # The greatest timestamp loaded below the records to retry, none if the next run must request everything
+                high_water_mark = max((updated_at for _, updated_at in self.__pending.values() if updated_at and updated_at < limit), default=None)
+            session.add(EtlRun(
+                mode=self.mode,
+                started_at=self.__started_at,
+                finished_at=now,
+                high_water_mark=high_water_mark,
+                records=records
+            ))
+            session.commit()
+        self.__hashes.update(pending)
+        self.__pending = {}
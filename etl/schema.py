@@ -0,0 +1,194 @@
+"""
+Schema Class for the management of the indexes and of the partitions of the star schema
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the Schema class that owns the secondary indexes of the star schema, the
+indexes of the filters and of the joins not covered by the natural keys (init-scripts/init.sql):
+- B-tree on the foreign keys of the facts, on the country and on the chemical composition.
+- BRIN on the year of the facts and on the year and the timestamp of the date dimension.
+The indexes are dropped before a bulk load, so the loaders do not update them for each record,
+and built again with CREATE INDEX CONCURRENTLY after it, without blocking the readers.
+The fact table can be partitioned by year range, the queries filtering the year read only
+the partitions of those years.
+
+Dependencies:
+- sqlalchemy: For the database connection.
+- argparse: For the command line.
+
+Usage:
+    - Call drop_indexes before the load and create_indexes after it, main.py does it.
+    - python -m etl.schema create-indexes
+    - python -m etl.schema partition --first-year 1800 --last-year 2030 --step 10
+"""
+
+from sqlalchemy import create_engine, text
+import argparse
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class Schema:
+
+    """
+    Creates and drops the secondary indexes and partitions the fact table.
+
+    On a partitioned table an index is created on the parent only, then concurrently on every
+    partition and attached to the parent, PostgreSQL does not build concurrently the index of a
+    partitioned table. An index left invalid by a failed concurrent build is dropped and built again.
+
+    Attributes:
+        INDEXES (dict): The secondary indexes, the name -> (table, method, columns).
+    """
+
+    INDEXES = {
+        "meteorite_id_location_idx": ("meteorite", "btree", "id_location"),
+        "meteorite_id_date_idx": ("meteorite", "btree", "id_date"),
+        "meteorite_id_classification_idx": ("meteorite", "btree", "id_classification"),
+        "meteorite_year_idx": ("meteorite", "brin", "year"),
+        "date_year_idx": ("date", "brin", "year, date"),
+        "location_country_idx": ("location", "btree", "country"),
+        "classification_chemical_composition_idx": ("classification", "btree", "chemical_composition")
+    }
+
+    def __init__(self, database_url=None):
+
+        """
+        Initialize the Schema instance.
+
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        # CREATE INDEX CONCURRENTLY does not run inside a transaction
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"), isolation_level="AUTOCOMMIT")
+
+    def drop_indexes(self):
+        """
+        Drop the secondary indexes, the natural keys used by the loaders are kept.
+        """
+        with self.__engine.connect() as connection:
+            for name in self.INDEXES:
+                connection.execute(text(f'DROP INDEX IF EXISTS public."{name}"'))
+        logger.info("Secondary indexes dropped")
+
+    def create_indexes(self, concurrently=True):
+        """
+        Create the secondary indexes not existing, the existing ones are kept.
+
+        :param concurrently: True to build the indexes without blocking the writes to the tables.
+        """
+        with self.__engine.connect() as connection:
+            for name, (table, method, columns) in self.INDEXES.items():
+                partitions = self.__partitions(connection, table)
+                if partitions is None:
+                    self.__create_index(connection, name, table, method, columns, concurrently)
+                    continue
+                connection.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY public."{table}" USING {method} ({columns})'))
+                for partition in partitions:
+                    partition_index = f"{partition}_{name.removeprefix(table + '_')}"
+                    self.__create_index(connection, partition_index, partition, method, columns, concurrently)
+                    if not connection.execute(text("""
+                        SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(:parent) AND inhrelid = to_regclass(:child)
+                    """), {"parent": f"public.{name}", "child": f"public.{partition_index}"}).first():
+                        connection.execute(text(f'ALTER INDEX public."{name}" ATTACH PARTITION public."{partition_index}"'))
+        logger.info("Secondary indexes created")
+
+    def partition_by_year(self, first_year, last_year, step=10):
+        """
+        Convert the fact table into a table partitioned by year range, the facts are copied.
+        The partitions cover [first_year, last_year) in ranges of step years, the other years
+        are stored in the default partition. The secondary indexes are created by create_indexes.
+
+        :param first_year: The first year of the first partition.
+        :param last_year: The year after the last partition.
+        :param step: The number of years of each partition.
+        :return: False if the table is already partitioned.
+        """
+        if first_year >= last_year or step <= 0:
+            raise ValueError("Invalid range of years")
+        with self.__engine.connect().execution_options(isolation_level="READ COMMITTED") as connection, connection.begin():
+            connection.execute(text("LOCK TABLE public.meteorite IN ACCESS EXCLUSIVE MODE"))
+            if self.__partitions(connection, "meteorite") is not None:
+                logger.warning("The fact table is already partitioned")
+                return False
+            triggers = connection.execute(text("""
+                SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = 'public.meteorite'::regclass AND NOT tgisinternal
+            """)).scalars().all()
+
+            connection.execute(text("ALTER TABLE public.meteorite RENAME TO meteorite_unpartitioned"))
+            connection.execute(text("""
+                CREATE TABLE public.meteorite (LIKE public.meteorite_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                PARTITION BY RANGE (year)
+            """))
+            for year in range(first_year, last_year, step):
+                connection.execute(text(f"""
+                    CREATE TABLE public.meteorite_{year} PARTITION OF public.meteorite
+                    FOR VALUES FROM ({year}) TO ({min(year + step, last_year)})
+                """))
+            connection.execute(text("CREATE TABLE public.meteorite_default PARTITION OF public.meteorite DEFAULT"))
+            connection.execute(text("INSERT INTO public.meteorite SELECT * FROM public.meteorite_unpartitioned"))
+            connection.execute(text("DROP TABLE public.meteorite_unpartitioned"))
+
+            # The unique keys of a partitioned table include the key of the partitions
+            connection.execute(text("""
+                ALTER TABLE public.meteorite
+                    ADD CONSTRAINT meteorite_pkey PRIMARY KEY (id, year),
+                    ADD CONSTRAINT meteorite_nasa_id_key UNIQUE (nasa_id, year),
+                    ADD CONSTRAINT meteorite_id_classification_fkey FOREIGN KEY (id_classification) REFERENCES public.classification(id),
+                    ADD CONSTRAINT meteorite_id_date_fkey FOREIGN KEY (id_date) REFERENCES public.date(id),
+                    ADD CONSTRAINT meteorite_id_location_fkey FOREIGN KEY (id_location) REFERENCES public.location(id)
+            """))
+            for trigger in triggers:
+                connection.execute(text(trigger)) # Read before the rename, on public.meteorite
+        logger.info("Fact table partitioned by year from %d to %d every %d years", first_year, last_year, step)
+        return True
+
+    @staticmethod
+    def __partitions(connection, table):
+        """
+        Return the names of the partitions of the table, None if the table is not partitioned.
+        """
+        if connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": f"public.{table}"}).scalar() != "p":
+            return None
+        return connection.execute(text("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname
+        """), {"table": f"public.{table}"}).scalars().all()
+
+    @staticmethod
+    def __create_index(connection, name, table, method, columns, concurrently):
+        """
+        Create the index on a table not partitioned, an invalid index with the same name is dropped before.
+        """
+        valid = connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": f"public.{name}"}).scalar()
+        if valid is False:
+            logger.warning("Index %s is invalid, it is built again", name)
+            connection.execute(text(f'DROP INDEX public."{name}"'))
+        connection.execute(text(
+            f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS "{name}" ON public."{table}" USING {method} ({columns})'
+        ))
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Indexes and partitions of the Meteorite Landings star schema")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create-indexes", help="Create the secondary indexes not existing")
+    create.add_argument("--no-concurrently", action="store_true", help="Build the indexes blocking the writes, faster")
+    commands.add_parser("drop-indexes", help="Drop the secondary indexes")
+    partition = commands.add_parser("partition", help="Partition the fact table by year and create the indexes")
+    partition.add_argument("--first-year", type=int, default=1800)
+    partition.add_argument("--last-year", type=int, default=2030)
+    partition.add_argument("--step", type=int, default=10, help="Years of each partition")
+    args = parser.parse_args(argv)
+
+    schema = Schema()
+    if args.command == "create-indexes":
+        schema.create_indexes(concurrently=not args.no_concurrently)
+    elif args.command == "drop-indexes":
+        schema.drop_indexes()
+    else:
+        schema.partition_by_year(args.first_year, args.last_year, args.step)
+        schema.create_indexes()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+StageStore Class for the columnar intermediate files between the ETL stages
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the StageStore class that writes the output of the stages to a directory
+as Arrow IPC files and reads it back through memory mapping, so the stages can run as separate
+processes (or on separate schedules) and a new transformation or load does not repeat the
+previous stages:
+- raw/<n>.arrow: the raw pages returned by the extraction, one file per page, a JSON string for
+  each record, so the records keep exactly their fields whatever the other records of the page.
+- transformed/<n>/: the transformed batches, one directory per batch with the fact table
+  (facts.arrow, the dimensions referenced by position) and the dimension tables
+  (dates.arrow, locations.arrow, classifications.arrow). The dates are stored as the naive
+  NASA date and time, read back the same in any timezone. The cleaning and the resolution of the
+  dimensions run in the same pass of the Transformer, so the cleaned records are the fact table.
+The files are written uncompressed, so the numeric columns are read without copies.
+
+Dependencies:
+- pyarrow: For the Arrow IPC files and the memory mapping.
+- MeteoriteBatch: The columnar batches written and read back, each dimension stored once.
+
+Usage:
+    - Create an instance of StageStore passing the directory.
+    - Wrap the pages of the extractor with spill_raw, or read them back with raw_pages.
+    - Use writer(loader) as the loader of the Pipeline to write the transformed batches, read them back with batches.
+"""
+from models.meteorite_model import MeteoriteModel
+from models.meteorite_batch import MeteoriteBatch
+from models.dimension_date_model import DimensionDateModel
+from models.dimension_location_model import DimensionLocationModel
+from models.dimension_classification_model import DimensionClassificationModel
+from typing import Iterable, List
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+class StageStore:
+
+    """
+    The Arrow files of the raw pages and of the transformed batches, stored in a directory.
+
+    The files are numbered in the order they are written and read back in the same order.
+    Writing a stage replaces the files written by a previous run of the same stage.
+
+    Attributes:
+        directory (str): The directory of the stage files.
+    """
+
+    RAW = "raw"
+    TRANSFORMED = "transformed"
+
+    _RAW_SCHEMA = pa.schema([("record", pa.string())])
+    _FACTS_SCHEMA = pa.schema([
+        ("nasa_id", pa.int64()),
+        ("mass", pa.float64()),
+        ("date", pa.int32()),
+        ("location", pa.int32()),
+        ("classification", pa.int32())
+    ])
+    _DATES_SCHEMA = pa.schema([("date", pa.timestamp("ms"))])
+    _LOCATIONS_SCHEMA = pa.schema([
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("city", pa.string()),
+        ("state", pa.string()),
+        ("country", pa.string())
+    ])
+    _CLASSIFICATIONS_SCHEMA = pa.schema([
+        ("group", pa.string()),
+        ("clan", pa.string()),
+        ("clazz", pa.string()),
+        ("chemical_composition", pa.string()),
+        ("material", pa.string())
+    ])
+
+    def __init__(self, directory):
+        """
+        Initializes the StageStore.
+
+        Args:
+            directory (str): The directory of the stage files, created if needed.
+        """
+        self.directory = directory
+
+    def clear(self, stage):
+        """
+        Removes the files of a stage.
+
+        Args:
+            stage (str): StageStore.RAW or StageStore.TRANSFORMED.
+        """
+        shutil.rmtree(self.__stage_directory(stage), ignore_errors=True)
+        os.makedirs(self.__stage_directory(stage))
+
+    def spill_raw(self, pages: Iterable[list]):
+        """
+        Writes every raw page to the raw stage before giving it to the next stage.
+
+        Args:
+            pages (Iterable[list]): The raw pages, e.g. from the extractor.
+
+        Returns:
+            Generator[list]: The same pages.
+        """
+        self.clear(self.RAW)
+        try:
+            for n, page in enumerate(pages):
+                if page:
+                    path = os.path.join(self.__stage_directory(self.RAW), f"{n:08d}.arrow")
+                    self.__write(path, pa.Table.from_pydict({"record": [json.dumps(record) for record in page]}, schema=self._RAW_SCHEMA))
+                yield page
+        finally:
+            close = getattr(pages, "close", None)
+            if close is not None:
+                close()
+
+    def raw_pages(self):
+        """
+        Yields the raw pages written by spill_raw, equal to the pages written.
+
+        Returns:
+            Generator[list]: The raw pages.
+        """
+        for path in self.__files(self.RAW):
+            yield self.__read_page(path)
+
+    def write_batch(self, batch: List[MeteoriteModel], n):
+        """
+        Writes a transformed batch as a fact table and its dimension tables.
+
+        Args:
+            batch (List[MeteoriteModel]): The transformed records, a list or a MeteoriteBatch.
+            n (int): The number of the batch, used to order the batches.
+        """
+        # The MeteoriteBatch stores each distinct dimension once, the facts keep their positions
+        batch = batch if isinstance(batch, MeteoriteBatch) else MeteoriteBatch(batch)
+        columns = batch.columns()
+        facts = pa.Table.from_arrays([
+            pa.array(columns["nasa_id"], mask=columns["nasa_id"] < 0),
+            pa.array(columns["mass"]),
+            pa.array(columns["date"].astype(np.int32)),
+            pa.array(columns["location"].astype(np.int32)),
+            pa.array(columns["classification"].astype(np.int32))
+        ], schema=self._FACTS_SCHEMA)
+
+        directory = os.path.join(self.__stage_directory(self.TRANSFORMED), f"{n:08d}")
+        shutil.rmtree(f"{directory}.tmp", ignore_errors=True)
+        os.makedirs(f"{directory}.tmp")
+        self.__write(os.path.join(f"{directory}.tmp", "facts.arrow"), facts)
+        self.__write(os.path.join(f"{directory}.tmp", "dates.arrow"), self.__table(self._DATES_SCHEMA, batch.dates))
+        self.__write(os.path.join(f"{directory}.tmp", "locations.arrow"), self.__table(self._LOCATIONS_SCHEMA, batch.locations))
+        self.__write(os.path.join(f"{directory}.tmp", "classifications.arrow"), self.__table(self._CLASSIFICATIONS_SCHEMA, batch.classifications))
+        os.replace(f"{directory}.tmp", directory)
+
+    def batches(self):
+        """
+        Yields the transformed batches written by write_batch.
+        The date dimensions are the shared instances of DimensionDateModel.parse, built from the naive dates.
+
+        Returns:
+            Generator[MeteoriteBatch]: The transformed batches.
+        """
+        stage_directory = self.__stage_directory(self.TRANSFORMED)
+        for name in sorted(os.listdir(stage_directory)):
+            if name.endswith(".tmp"):
+                continue
+            directory = os.path.join(stage_directory, name)
+            dates = [
+                DimensionDateModel.parse(date.isoformat(timespec="milliseconds"))
+                for date in self.__read(os.path.join(directory, "dates.arrow")).column("date").to_pylist()
+            ]
+            locations = [DimensionLocationModel(**row) for row in self.__read(os.path.join(directory, "locations.arrow")).to_pylist()]
+            classifications = [DimensionClassificationModel(**row) for row in self.__read(os.path.join(directory, "classifications.arrow")).to_pylist()]
+            facts = self.__read(os.path.join(directory, "facts.arrow"))
+            # The numeric columns are read from the mapped file without converting each value
+            columns = {name: facts.column(name).to_numpy() for name in ("mass", "date", "location", "classification")}
+            columns["nasa_id"] = facts.column("nasa_id").fill_null(-1).to_numpy()
+            yield MeteoriteBatch.from_columns(columns, dates, locations, classifications)
+
+    def writer(self, loader=None):
+        """
+        Returns a loader writing the transformed batches to the store, and also to the given loader.
+
+        Args:
+            loader (Loader): The loader of the database, None to only write the files.
+
+        Returns:
+            StageWriter: The loader to give to the Pipeline.
+        """
+        return StageWriter(self, loader)
+
+    @staticmethod
+    def __table(schema: pa.Schema, instances: list) -> pa.Table:
+        """
+        Builds the table of a dimension from the attributes of its instances.
+        """
+        return pa.Table.from_pydict(
+            {name: [getattr(instance, name) for instance in instances] for name in schema.names},
+            schema=schema
+        )
+
+    @staticmethod
+    def __write(path, table: pa.Table):
+        """
+        Writes the table to an Arrow IPC file, replaced atomically.
+        """
+        with pa.OSFile(f"{path}.tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def __read(path) -> pa.Table:
+        """
+        Reads an Arrow IPC file through memory mapping, the buffers of the table are not copied.
+        """
+        with pa.memory_map(path, "r") as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def __read_page(self, path) -> list:
+        """
+        Reads a raw page written by spill_raw.
+        """
+        return [json.loads(record) for record in self.__read(path).column("record").to_pylist()]
+
+    def __files(self, stage):
+        directory = self.__stage_directory(stage)
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".arrow")]
+
+    def __stage_directory(self, stage):
+        return os.path.join(self.directory, stage)
+
+class StageWriter:
+
+    """
+    A loader writing every transformed batch to the StageStore, used as the loader of the Pipeline.
+    The batches are also given to the wrapped loader, if any, and commit and rollback are forwarded to it.
+
+    Attributes:
+        store (StageStore): The store of the transformed batches.
+        loader (Loader): The wrapped loader, None to only write the files.
+    """
+
+    def __init__(self, store: StageStore, loader=None):
+        """
+        Initializes the StageWriter, the transformed batches of a previous run are removed.
+
+        Args:
+            store (StageStore): The store of the transformed batches.
+            loader (Loader): The wrapped loader (already opened), None to only write the files.
+        """
+        self.store = store
+        self.loader = loader
+        self.__batches = 0
+        store.clear(StageStore.TRANSFORMED)
+
+    def save_batch(self, data: List[MeteoriteModel]):
+        """
+        Writes the batch and gives it to the wrapped loader.
+
+        Args:
+            data (List[MeteoriteModel]): The transformed batch.
+        """
+        self.store.write_batch(data, self.__batches)
+        self.__batches += 1
+        if self.loader is not None:
+            self.loader.save_batch(data)
+
+    def commit(self):
+        if self.loader is not None:
+            self.loader.commit()
+
+    def rollback(self):
+        if self.loader is not None:
+            self.loader.rollback()
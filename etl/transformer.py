@@ -11,18 +11,53 @@ Usage:
 from models.meteorite_landing_raw import MeteoriteLandingRaw
 from models.dimension_date_model import DimensionDateModel
 from models.meteorite_model import MeteoriteModel
-from models.dimension_location_model import DimensionLocationModel
 from models.dimension_classification_model import DimensionClassificationModel
 from models.meteorite_type import MeteoriteType
+from etl.geocoder import Geocoder, NominatimGeocoder
+from etl.metrics import metrics
 from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
 
-import geopandas as gpd
-from shapely.geometry import Point
 from math import isclose
-from models.meteorite_type import MeteoriteType
 
-import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bounding boxes ((min lat, max lat), (min lon, max lon), recoverable) checked in order,
+# the first box containing the coordinates decides if the location is recoverable
+REGIONS = [
+    ((15.0, 75.0), (-168.0, -52.0), False), # North America
+    ((-55.0, 12.0), (-82.0, -34.0), False), # South America
+    ((36.0, 71.0), (-10.0, 40.0), True), # Europe
+    # ((27.0, 43.8), (-18.1, 4.3), True), # Spain
+    # ((41.3, 51.1), (-5.2, 9.6), True), # France
+    # ((47.3, 55.1), (5.9, 15.1), True), # Germany
+    # ((45.8, 47.8), (5.9, 10.5), True), # Switzerland
+    # ((49.9, 61.3), (-8.6, 1.8), True), # UK
+    ((-35.0, 38.0), (-18.0, 52.0), False), # Africa
+    ((-10.0, 81.0), (26.0, 180.0), False), # Asia
+    ((-50.0, -10.0), (110.0, 180.0), False) # Oceania
+]
+
+_worker_transformer = None # The Transformer of a process of the pool
+_MISSING = object() # A location not cached, None is a cached negative result
+
+def _init_worker(engine, location_cache):
+    """
+    Initializes a process of the pool with its own transformer (of the same engine) and the read-only location cache.
+    """
+    global _worker_transformer
+    _worker_transformer = engine([], location_cache=location_cache)
 
+def _prepare_chunk(chunk):
+    """
+    Runs Transformer.prepare on a chunk in a process of the pool,
+    the records rejected by the chunk are returned with the candidates.
+    """
+    _worker_transformer.rejected.clear()
+    return _worker_transformer.prepare(chunk), dict(_worker_transformer.rejected)
 
 
 class Transformer:
@@ -33,20 +68,42 @@ class Transformer:
     Attributes:
         raw_data (list): A list of raw meteorite landing from the Extractor
         transformed_data (List[MeteoriteModel]): A list to store the transformed `MeteoriteModel` instances.
-        location_cache (dict): A cache to store the transformed location data to avoid redundant API calls.
+        location_cache (dict): A cache to store the transformed location data to avoid redundant API calls,
+            a persistent GeocodingCache can be used to keep the locations between different runs.
+        geocoder (Geocoder): The backend used to resolve the coordinates not found in cache.
+        workers (int): The number of processes used to transform a batch, the geocoding always runs in the current process.
+        chunk_size (int): The number of items sent to a process at once.
+        rejected (Counter): The number of rejected records by reason ('clean', 'date', 'classification', 'geocoding', 'location').
+        retry_ids (set): The NASA ids of the records rejected because the geocoding failed, to transform again in a later run.
     """    
 
 
-    def __init__(self, raw_data):
+    def __init__(self, raw_data, location_cache=None, geocoder: Geocoder = None, workers=1, chunk_size=250):
         """
         Initializes the Transformer with raw meteorite landing data.
 
         Args:
-            raw_data (list): A list containing raw meteorite landing data.
+            raw_data (list): A list containing raw meteorite landing data, empty if only transform_batch is used.
+            location_cache (dict): An optional cache of locations (e.g. GeocodingCache), if None an in-memory dict is used.
+            geocoder (Geocoder): The reverse geocoding backend, if None the online NominatimGeocoder is used.
+            workers (int): The number of processes used to transform a batch, 1 to transform in the current process.
+            chunk_size (int): The number of items sent to a process at once.
         """
         self.raw_data = raw_data
         self.transformed_data: List[MeteoriteModel] = []
-        self.location_cache = {} # Cache a simple hash map of location
+        self.location_cache = location_cache if location_cache is not None else {} # Cache a simple hash map of location
+        self.geocoder = geocoder if geocoder is not None else NominatimGeocoder()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.rejected = Counter()
+        self.retry_ids = set()
+        self.__executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def transform(self):
 
@@ -56,74 +113,156 @@ class Transformer:
         The method processes each item in `raw_data`, cleans it, transforms location data, and creates `MeteoriteModel`
         instances.
         """
-        
-        progress = 0
-        for item in self.raw_data:
+        self.transformed_data.extend(self.transform_batch(self.raw_data))
 
-            percentage = (progress/len(self.raw_data)) * 100
-            #print(f"\rProgress: {percentage:.2f}%", end='', flush=True)
+    def transform_batch(self, raw_data) -> List[MeteoriteModel]:
 
-            print(f"Transformation of {item}")
-            
-            print("clean...")
-            tmp = self.__clean(item)
-            if(tmp is None):
-                progress = progress + 1
-                print("The element will be deleted by clean process")
-                continue
-            print("clean DONE...")
+        """
+        Transforms a batch of raw data (e.g. a single page from the Extractor) into `MeteoriteModel` instances.
 
-            print("Dimension Date....")
-            date = DimensionDateModel(tmp.year)
-            if(date is None):
-                print("The element will be deleted, because the year field is not well formed")
-                progress = progress + 1
-                continue
-            print("Dimension Date DONE....")
+        The batch is not stored in `transformed_data`, so the streaming pipeline can hand it over to the loader
+        without keeping the whole dataset in memory.
 
-            
-            primitive_achonrdites = MeteoriteType.primitive_achonrdites(tmp.recclass)
-            achonrdites = MeteoriteType.achonrdites(tmp.recclass)
-            chondrites = MeteoriteType.chondrites(tmp.recclass)
+        Args:
+            raw_data (list): A list containing raw meteorite landing data.
 
-            print("Dimension Classification....")
-            # Determine classification
-            classification = (primitive_achonrdites or achonrdites or chondrites)
-            
+        Returns:
+            List[MeteoriteModel]: The transformed instances of the batch.
+        """
+        rejected = self.rejected.copy()
+        if self.workers > 1 and len(raw_data) > self.chunk_size:
+            candidates = self.__prepare_parallel(raw_data)
+        else:
+            candidates = self.prepare(raw_data)
 
-            # Check if classification was found
-            if classification is None:
-                print("The element will be deleted, because the recclass field is not well formed or recognised")
-                progress += 1
-                continue
-            print("Dimension Classification Done")
+        transformed_data: List[MeteoriteModel] = []
+        unresolved = [(tmp.reclat, tmp.reclong) for tmp, _, _, resolved, _ in candidates if not resolved]
+        metrics.increment("geocoding_cache", len(candidates) - len(unresolved), result="hit")
+        metrics.increment("geocoding_cache", len(unresolved), result="miss")
+        if unresolved:
+            # Resolve all the distinct coordinates not in cache with a single call to the geocoder
+            self.__resolve_locations(unresolved)
+
+        for tmp, date, classification, resolved, location in candidates:
         
-            location = None
-            print("Dimension Location...")
-            while True:
-                try:
-                    location = self.__transform_location_dimension((tmp.reclat, tmp.reclong))
-                    break # exit from while
-                except Exception as e:
-                    print(f" Location ({tmp.reclat}, {tmp.reclong}) fails, we need to wait the API limit - 1 second waiting before to send a new request")
-                    time.sleep(1) # 1 second
+            if not resolved:
+                location = self.location_cache.get((tmp.reclat, tmp.reclong), _MISSING)
+                if location is _MISSING:
+                    # The geocoder failed after all the retries, the location is not cached so a later run requests it again
+                    logger.debug("Dimension Location will be deleted because the location (%s, %s) can't be requested", tmp.reclat, tmp.reclong)
+                    self.rejected["geocoding"] += 1
+                    if tmp.id is not None:
+                        self.retry_ids.add(tmp.id)
+                    continue
                 
             if(location is None):
-                print("Dimension Location will be deleted because the geographic coordinates are not compliant with our purpose")
-                progress = progress + 1
+                logger.debug("Dimension Location will be deleted because the geographic coordinates are not compliant with our purpose")
+                self.rejected["location"] += 1
                 continue
 
-            print("Dimension Location DONE")    
             m = MeteoriteModel(
                 dimensionDateModel = date,
                 mass = tmp.mass,
                 dimensionLocationModel=location,
-                dimensionClassificationModel=classification
+                dimensionClassificationModel=classification,
+                nasa_id = tmp.id
             )
 
-            self.transformed_data.append(m)
-            progress = progress + 1
-        
+            transformed_data.append(m)
+
+        for reason, count in (self.rejected - rejected).items():
+            metrics.increment("records_rejected", count, reason=reason)
+        return transformed_data
+
+    def prepare(self, raw_data) -> list:
+
+        """
+        Runs the CPU-bound part of the transformation: cleaning, date and classification dimensions,
+        and the lookup of the location in cache (read-only, the geocoder is never called).
+
+        Args:
+            raw_data (list): A list containing raw meteorite landing data.
+
+        Returns:
+            list: A (MeteoriteLandingRaw, DimensionDateModel, DimensionClassificationModel, resolved, location) tuple
+                for each valid item, in the order of raw_data; resolved is False if the location is not in cache.
+        """
+        candidates = []
+        for item in raw_data:
+
+            logger.debug("Transformation of %s", item)
+
+            tmp = self.__clean(item)
+            if(tmp is None):
+                logger.debug("The element will be deleted by clean process")
+                self.rejected["clean"] += 1
+                continue
+
+            # Parsed once for each distinct year string, None if it is malformed
+            date = DimensionDateModel.parse(tmp.year)
+            if(date is None):
+                logger.debug("The element will be deleted, because the year field is not well formed")
+                self.rejected["date"] += 1
+                continue
+
+            # Determine classification (memoized for each distinct recclass)
+            classification = MeteoriteType.classify(tmp.recclass)
+
+            # Check if classification was found
+            if classification is None:
+                logger.debug("The element will be deleted, because the recclass field is not well formed or recognised")
+                self.rejected["classification"] += 1
+                continue
+
+            coordinates = (round(tmp.reclat, 1), round(tmp.reclong, 1))
+            # A single read, an entry of the cache can expire between two reads
+            location = self.location_cache.get(coordinates, _MISSING)
+            resolved = location is not _MISSING
+            location = location if resolved else None
+            candidates.append((tmp, date, classification, resolved, location))
+
+        return candidates
+
+    def __prepare_parallel(self, raw_data) -> list:
+
+        """
+        Shards the raw data in chunks of chunk_size items and runs prepare on the process pool.
+        The chunks are merged in their original order, so the result does not depend on the workers.
+
+        Args:
+            raw_data (list): A list containing raw meteorite landing data.
+
+        Returns:
+            list: The same result of prepare.
+        """
+        if self.__executor is None:
+            # Every worker receives a read-only copy of the location cache
+            self.__executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(type(self), self.location_cache)
+            )
+        chunks = [raw_data[i:i + self.chunk_size] for i in range(0, len(raw_data), self.chunk_size)]
+        candidates = []
+        for chunk, rejected in self.__executor.map(_prepare_chunk, chunks):
+            self.rejected.update(rejected)
+            for tmp, _, _, resolved, _ in chunk:
+                # The dimensions are copies made by the processes, the shared instances of this process are used instead
+                location = self.location_cache.get((tmp.reclat, tmp.reclong), _MISSING) if resolved else None
+                if location is _MISSING:
+                    # Expired since the process read it, requested again as in the serial path
+                    resolved, location = False, None
+                candidates.append((tmp, DimensionDateModel.parse(tmp.year), MeteoriteType.classify(tmp.recclass), resolved, location))
+        return candidates
+
+    def close(self):
+
+        """
+        Shuts down the process pool used by the parallel transformation.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
 
     def __clean(self, item) -> MeteoriteLandingRaw:
 
@@ -166,42 +305,26 @@ class Transformer:
             mass = float(mass),
             year = date,
             reclat = round(float(lat), 1),
-            reclong = round(float(long), 1)
+            reclong = round(float(long), 1),
+            id = int(item['id']) if str(item.get('id', '')).isdigit() else None
         )
 
-    def __transform_location_dimension(self, position:tuple):
+    def __resolve_locations(self, positions: List[tuple]):
 
         """
-        Transforms coordinates into a `DimensionLocationModel` instance using reverse geocoding.
+        Resolves in bulk the positions not already in cache and stores the results in the cache,
+        the positions failed because of an error are not stored.
 
         Args:
-            position (tuple): A tuple containing latitude and longitude.
-
-        Returns:
-            DimensionLocationModel: A `DimensionLocationModel` instance with location details, or None if the location couldn't be resolved.
+            positions (List[tuple]): The list of (latitude, longitude) tuples.
         """
+        missing = [c for c in dict.fromkeys((round(p[0], 1), round(p[1], 1)) for p in positions) if c not in self.location_cache]
+        if not missing:
+            return
+        logger.info("Resolving %d locations with %s", len(missing), type(self.geocoder).__name__)
+        for coordinates, location in self.geocoder.reverse_many(missing).items():
+            self.location_cache[coordinates] = location
 
-        coordinates = (round(position[0], 1), round(position[1], 1))
-        
-        if coordinates in self.location_cache:
-            return self.location_cache[coordinates] # Value present in cache
-        
-        point = Point(coordinates[1], coordinates[0])
-        time.sleep(0.3)
-        loc = gpd.tools.reverse_geocode(point)
-        address = loc["address"][0]
-        tmp = None
-        if(address is not None and len(address) > 0):
-            tmp = DimensionLocationModel(latitude=coordinates[0], longitude=coordinates[1], state=None, country=None, city=None)
-            split_string = [s.strip() for s in address.split(',')]
-            tmp.city = split_string[len(split_string) - 3] or None
-            tmp.state = split_string[len(split_string) - 2] or None
-            tmp.country = split_string[len(split_string) - 1] or None
-        
-        # Add item in cache if not found add None
-        self.location_cache[coordinates] = tmp
-        return tmp
-    
     def __is_valid_coordinate(self, lat, lon):
 
         """
@@ -233,27 +356,7 @@ class Transformer:
         """
         if not self.__is_valid_coordinate(lat, lon):
             return False # Boundary Coordinate
-        if 15.0 <= lat <= 75.0 and -168.0 <= lon <= -52.0:
-            return False # North America
-        elif -55.0 <= lat <= 12.0 and -82.0 <= lon <= -34.0:
-            return False # South America
-        elif 36.0 <= lat <= 71.0 and -10.0 <= lon <= 40.0:
-            #if 27.0 <= lat <= 43.8 and -18.1 <= lon <= 4.3:
-            #    return True # Spain
-            #elif 41.3 <= lat <= 51.1 and -5.2 <= lon <= 9.6:
-            #    return True # France
-            #elif 47.3 <= lat <= 55.1 and 5.9 <= lon <= 15.1:
-            #    return True # Germany
-            #elif 45.8 <= lat <= 47.8 and 5.9 <= lon <= 10.5:
-            #    return True # Switzerland
-            #elif 49.9 <= lat <= 61.3 and -8.6 <= lon <= 1.8:
-            #    return True # UK
-            return True # Europe
-        elif -35.0 <= lat <= 38.0 and -18.0 <= lon <= 52.0:
-            return False # Africa
-        elif -10.0 <= lat <= 81.0 and 26.0 <= lon <= 180.0:
-            return False # Asia
-        elif -50.0 <= lat <= -10.0 and 110.0 <= lon <= 180.0:
-            return False # Oceania
-        else:
-            return False #Remote Area
\ No newline at end of file
+        for (min_lat, max_lat), (min_lon, max_lon), recoverable in REGIONS:
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                return recoverable
+        return False #Remote Area
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+VectorizedTransformer Class for implement the transformation process with pandas
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the VectorizedTransformer class, a columnar engine producing exactly
+the same MeteoriteModel instances of the Transformer: the raw page is loaded in a DataFrame
+and the cleaning, the coordinate validation and the bounding box filtering run as column
+operations instead of one record at a time.
+
+Dependencies:
+- pandas: For the DataFrame.
+- numpy: For the column operations.
+
+Usage:
+    - Create an instance of VectorizedTransformer, it has the same interface of the Transformer.
+"""
+
+from etl.transformer import Transformer, REGIONS, _MISSING
+from models.meteorite_landing_raw import MeteoriteLandingRaw
+from models.dimension_date_model import DimensionDateModel
+from models.meteorite_type import MeteoriteType
+
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+class VectorizedTransformer(Transformer):
+
+    """
+    A columnar version of the Transformer.
+
+    Only the CPU-bound part (prepare) is replaced: the geocoding and the creation of the
+    MeteoriteModel instances are inherited, so both engines produce the same output.
+    The date and classification dimensions are derived once for each distinct raw value
+    and shared by all the records with that value.
+    """
+
+    _COLUMNS = ['id', 'recclass', 'mass', 'year', 'reclat', 'reclong']
+
+    def prepare(self, raw_data) -> list:
+
+        """
+        Runs the CPU-bound part of the transformation on the whole batch with column operations.
+
+        Args:
+            raw_data (list): A list containing raw meteorite landing data.
+
+        Returns:
+            list: The same result of Transformer.prepare.
+        """
+        if len(raw_data) == 0:
+            return []
+        df = pd.DataFrame(raw_data, columns=self._COLUMNS)
+        logger.debug("Transformation of %d records", len(df))
+
+        # The checks run in the same order of the record engine, so float() is applied to the same values
+        df = df[self.__present(df['recclass'])]
+        df = df[self.__present(df['mass'])]
+        df = df.assign(mass=df['mass'].astype(float))
+        df = df[df['mass'] != 0]
+        df = df[self.__present(df['year'])]
+        df = df[self.__present(df['reclat'])]
+        df = df[self.__present(df['reclong'])]
+        df = df.assign(reclat=df['reclat'].astype(float), reclong=df['reclong'].astype(float))
+        df = df[self.__recoverable_location(df['reclat'].to_numpy(), df['reclong'].to_numpy())]
+        logger.debug("%d records left by the clean process", len(df))
+        self.rejected["clean"] += len(raw_data) - len(df)
+        if len(df) == 0:
+            return []
+
+        # Python round (correctly rounded) instead of numpy round, the coordinates must match the record engine
+        reclat = [round(v, 1) for v in df['reclat'].tolist()]
+        reclong = [round(v, 1) for v in df['reclong'].tolist()]
+        ids = df['id'].astype(str)
+        ids = [int(v) if digit else None for v, digit in zip(ids.tolist(), ids.str.isdigit().tolist())]
+
+        # Dimensions derived once for each distinct value
+        dates = {year: DimensionDateModel.parse(year) for year in df['year'].unique()}
+        classifications = {recclass: MeteoriteType.classify(recclass) for recclass in df['recclass'].unique()}
+        locations = {}
+        for coordinates in dict.fromkeys(zip(reclat, reclong)):
+            # A single read, an entry of the cache can expire between two reads
+            location = self.location_cache.get(coordinates, _MISSING)
+            locations[coordinates] = (location is not _MISSING, None if location is _MISSING else location)
+
+        candidates = []
+        for id, recclass, mass, year, lat, lon in zip(ids, df['recclass'].tolist(), df['mass'].tolist(), df['year'].tolist(), reclat, reclong):
+            date = dates[year]
+            if date is None:
+                self.rejected["date"] += 1
+                continue
+            classification = classifications[recclass]
+            if classification is None:
+                self.rejected["classification"] += 1
+                continue
+            tmp = MeteoriteLandingRaw(recclass=recclass, mass=mass, year=year, reclat=lat, reclong=lon, id=id)
+            resolved, location = locations[(lat, lon)]
+            candidates.append((tmp, date, classification, resolved, location))
+        logger.debug("%d records left by the date and classification dimensions", len(candidates))
+        return candidates
+
+    def __present(self, column: pd.Series) -> pd.Series:
+
+        """
+        Returns the mask of the values not null and not empty.
+        """
+        return column.notna() & (column.astype(str).str.len() > 0)
+
+    def __recoverable_location(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+
+        """
+        Returns the mask of the recoverable coordinates, the vectorized version of the record engine check.
+        """
+        valid = ~((lat == 0.0) & (lon == 0.0)) & (lat >= -90.0) & (lat <= 90.0) & (lon >= -180.0) & (lon <= 180.0)
+        recoverable = np.zeros(len(lat), dtype=bool)
+        decided = ~valid
+        for (min_lat, max_lat), (min_lon, max_lon), region_recoverable in REGIONS:
+            inside = ~decided & (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+            recoverable[inside] = region_recoverable
+            decided |= inside
+        return recoverable
@@ -1,3 +1,6 @@
+-- The volume replaces the init scripts of the postgis image, so the extension is created here
+CREATE EXTENSION IF NOT EXISTS postgis;
+
 DROP TABLE IF EXISTS "classification";
 DROP SEQUENCE IF EXISTS classification_id_seq;
 CREATE SEQUENCE classification_id_seq INCREMENT 1 MINVALUE 1 MAXVALUE 2147483647 CACHE 1;
@@ -9,7 +12,8 @@ CREATE TABLE "public"."classification" (
     "chemical_composition" character varying(255),
     "clan" character varying(255),
     "clazz" character varying(255),
-    CONSTRAINT "classification_pkey" PRIMARY KEY ("id")
+    CONSTRAINT "classification_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "classification_natural_key" UNIQUE NULLS NOT DISTINCT ("classification", "material_type", "chemical_composition", "clan", "clazz")
 ) WITH (oids = false);
 
 
@@ -23,7 +27,8 @@ CREATE TABLE "public"."date" (
     "month" integer,
     "quarter" integer,
     "year" integer,
-    CONSTRAINT "date_pkey" PRIMARY KEY ("id")
+    CONSTRAINT "date_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "date_natural_key" UNIQUE ("date")
 ) WITH (oids = false);
 
 
@@ -38,23 +43,112 @@ CREATE TABLE "public"."location" (
     "city" character varying(255),
     "state" character varying(255),
     "country" character varying(255),
-    CONSTRAINT "location_pkey" PRIMARY KEY ("id")
+    "geog" geography(Point, 4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint("longitude", "latitude"), 4326)::geography) STORED,
+    CONSTRAINT "location_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "location_natural_key" UNIQUE ("latitude", "longitude")
 ) WITH (oids = false);
 
+-- Radius and nearest neighbour searches (meters on the spheroid), bounding boxes in degrees on the cast
+CREATE INDEX "location_geog_idx" ON "public"."location" USING GIST ("geog");
+CREATE INDEX "location_geom_idx" ON "public"."location" USING GIST (("geog"::geometry));
+
 
 DROP TABLE IF EXISTS "meteorite";
 DROP SEQUENCE IF EXISTS meteorite_id_seq;
 CREATE SEQUENCE meteorite_id_seq INCREMENT 1 MINVALUE 1 MAXVALUE 2147483647 CACHE 1;
 
 CREATE TABLE "public"."meteorite" (
+    "id" integer DEFAULT nextval('meteorite_id_seq') NOT NULL,
+    "nasa_id" integer,
     "mass" real NOT NULL,
     "id_location" integer NOT NULL,
     "id_classification" integer NOT NULL,
     "id_date" integer NOT NULL,
-    PRIMARY KEY (id_location, id_classification, id_date)
+    "year" integer NOT NULL,
+    CONSTRAINT "meteorite_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "meteorite_nasa_id_key" UNIQUE ("nasa_id")
 ) WITH (oids = false);
 
 
 ALTER TABLE ONLY "public"."meteorite" ADD CONSTRAINT "meteorite_id_classification_fkey" FOREIGN KEY (id_classification) REFERENCES classification(id) NOT DEFERRABLE;
 ALTER TABLE ONLY "public"."meteorite" ADD CONSTRAINT "meteorite_id_date_fkey" FOREIGN KEY (id_date) REFERENCES date(id) NOT DEFERRABLE;
-ALTER TABLE ONLY "public"."meteorite" ADD CONSTRAINT "meteorite_id_location_fkey" FOREIGN KEY (id_location) REFERENCES location(id) NOT DEFERRABLE;
\ No newline at end of file
+ALTER TABLE ONLY "public"."meteorite" ADD CONSTRAINT "meteorite_id_location_fkey" FOREIGN KEY (id_location) REFERENCES location(id) NOT DEFERRABLE;
+
+
+DROP TABLE IF EXISTS "etl_record_state";
+
+CREATE TABLE "public"."etl_record_state" (
+    "nasa_id" integer NOT NULL,
+    "content_hash" character varying(64) NOT NULL,
+    "loaded_at" timestamp NOT NULL,
+    CONSTRAINT "etl_record_state_pkey" PRIMARY KEY ("nasa_id")
+) WITH (oids = false);
+
+
+DROP TABLE IF EXISTS "etl_run";
+DROP SEQUENCE IF EXISTS etl_run_id_seq;
+CREATE SEQUENCE etl_run_id_seq INCREMENT 1 MINVALUE 1 MAXVALUE 2147483647 CACHE 1;
+
+CREATE TABLE "public"."etl_run" (
+    "id" integer DEFAULT nextval('etl_run_id_seq') NOT NULL,
+    "mode" character varying(32) NOT NULL,
+    "started_at" timestamp NOT NULL,
+    "finished_at" timestamp,
+    "high_water_mark" character varying(64),
+    "records" integer,
+    CONSTRAINT "etl_run_pkey" PRIMARY KEY ("id")
+) WITH (oids = false);
+
+DROP TABLE IF EXISTS "meteorite_rollup";
+
+CREATE TABLE "public"."meteorite_rollup" (
+    "year" integer,
+    "quarter" integer,
+    "country" character varying(255),
+    "id_classification" integer NOT NULL,
+    "classification" character varying(255),
+    "material_type" character varying(255),
+    "chemical_composition" character varying(255),
+    "clan" character varying(255),
+    "clazz" character varying(255),
+    "meteorites" integer NOT NULL,
+    "total_mass" double precision NOT NULL,
+    "min_mass" real NOT NULL,
+    "max_mass" real NOT NULL,
+    CONSTRAINT "meteorite_rollup_key" UNIQUE NULLS NOT DISTINCT ("year", "quarter", "country", "id_classification")
+) WITH (oids = false);
+
+CREATE INDEX "meteorite_rollup_country_idx" ON "public"."meteorite_rollup" USING btree ("country");
+CREATE INDEX "meteorite_rollup_chemical_composition_idx" ON "public"."meteorite_rollup" USING btree ("chemical_composition");
+
+
+-- The dimension members of the facts changed since the last refresh of meteorite_rollup
+DROP TABLE IF EXISTS "meteorite_rollup_pending";
+
+CREATE TABLE "public"."meteorite_rollup_pending" (
+    "id_date" integer NOT NULL,
+    "id_location" integer NOT NULL,
+    "id_classification" integer NOT NULL
+) WITH (oids = false);
+
+CREATE OR REPLACE FUNCTION "public"."meteorite_rollup_track"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    -- Only appends, so the loaders writing the facts at the same time never wait for each other
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO public.meteorite_rollup_pending (id_date, id_location, id_classification)
+        SELECT DISTINCT id_date, id_location, id_classification FROM old_rows;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.meteorite_rollup_pending (id_date, id_location, id_classification)
+        SELECT DISTINCT id_date, id_location, id_classification FROM new_rows;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER "meteorite_rollup_insert" AFTER INSERT ON "public"."meteorite"
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION "public"."meteorite_rollup_track"();
+CREATE TRIGGER "meteorite_rollup_update" AFTER UPDATE ON "public"."meteorite"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION "public"."meteorite_rollup_track"();
+CREATE TRIGGER "meteorite_rollup_delete" AFTER DELETE ON "public"."meteorite"
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION "public"."meteorite_rollup_track"();
\ No newline at end of file
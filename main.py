@@ -7,100 +7,407 @@ This script is responsible to manage the ETL process of the Meteorite Landings
 
 Dependencies:
 - threading: For managing concurrent threads.
-- queue: For handling failed data retrieval ranges.
+- queue: For handling failed data retrieval ranges and the pages waiting to be transformed.
 - Extractor: Custom class to handle data extraction from NASA's API.
-- Transformer: Custom class for Transformation process
+- AsyncExtractor: Custom class to handle the concurrent data extraction from NASA's API with asyncio.
+- Transformer, VectorizedTransformer: Custom classes for Transformation process (record at a time or columnar)
+- GeocodingCache: Custom class to persist the reverse geocoding results between runs
+- Geocoder: Custom classes for the online or offline reverse geocoding
+- EltLoader: Custom class transforming the raw records inside PostgreSQL with set-based SQL (sql engine)
+- Loader, BulkLoader, ParallelLoader: Custom classes for the loading process with the ORM, with PostgreSQL COPY or with COPY over many connections
+- Pipeline: Custom class streaming the pages through the transformation and the loading
+- RunState: Custom class tracking the records already loaded for the incremental runs
+- PageCache: Custom class keeping the raw pages on disk, requested again only if changed
+- StageStore: Custom class writing the output of the stages to Arrow files, so the stages can run separately
+- Checkpoint: Custom class keeping the pages and the progress of a run, so a failed run can be resumed
+- Schema: Custom class dropping the secondary indexes before the load and building them again concurrently after it
+- metrics: Custom registry of the metrics of the run, written at the end in JSON or Prometheus text format
+- StageProfiler: Custom class writing the profiles, the sampled stacks and the memory of each stage
+- Config: Custom class reading the settings from the command line, the environment variables and a TOML file
 
 Usage:
     python main.py
+    python main.py --help
+    python main.py --config etl.toml --extractor-concurrency 8 --loader-batch-size 20000
+    python main.py --only extract --stage-dir stages, then --only transform and --only load with the same --stage-dir
+    PROFILE_DIR=profiles python main.py
 """
 
 from etl.extractor import Extractor
+from etl.async_extractor import AsyncExtractor
 from etl.transformer import Transformer
+from etl.vectorized_transformer import VectorizedTransformer
+from etl.geocoding_cache import GeocodingCache
+from etl.geocoder import NominatimGeocoder, BoundaryGeocoder
 import threading
 import queue
 import time
 from etl.loader import Loader
+from etl.bulk_loader import BulkLoader
+from etl.parallel_loader import ParallelLoader
+from etl.elt_loader import EltLoader
+from etl.pipeline import Pipeline
+from etl.run_state import RunState
+from etl.checkpoint import Checkpoint
+from etl.page_cache import PageCache
+from etl.stage_store import StageStore
+from etl.schema import Schema
+from contextlib import nullcontext
+from etl.metrics import metrics
+from etl.profiler import StageProfiler
+from etl.config import Config
+import itertools
+import logging
 
-def recover_data(start_offset, end_offset, data_list, lock, failure_queue):
+logger = logging.getLogger(__name__)
+
+def build_geocoder(config):
+    """
+    Builds the reverse geocoding backend selected by the geocoder_backend setting.
+
+    Parameters:
+    - config (Config): The settings of the run.
+
+    Returns:
+    - Geocoder: A NominatimGeocoder for the online backend or a BoundaryGeocoder for the offline backend.
+
+    Exceptions:
+    - ValueError: If the backend is unknown or the boundary file is not configured.
+    """
+    if config.geocoder_backend == "nominatim":
+        return NominatimGeocoder(rate=config.geocoder_rate, concurrency=config.geocoder_concurrency, max_retries=config.geocoder_max_retries)
+    if config.geocoder_backend == "boundary":
+        if not config.geocoder_boundary_path:
+            raise ValueError("GEOCODER_BOUNDARY_PATH is required by the boundary geocoder")
+        return BoundaryGeocoder(
+            config.geocoder_boundary_path,
+            country_column=config.geocoder_country_column,
+            state_column=config.geocoder_state_column or None,
+            city_column=config.geocoder_city_column or None,
+            layer=config.geocoder_boundary_layer or None
+        )
+    raise ValueError(f"Unknown geocoder backend: {config.geocoder_backend}")
+
+def build_loader(config, location_cache=None):
+    """
+    Builds the loader selected by the loader_mode setting, or the EltLoader of the sql engine.
+
+    Parameters:
+    - config (Config): The settings of the run.
+    - location_cache (GeocodingCache): The cache of the locations, used by the sql engine.
+
+    Returns:
+    - Loader: A BulkLoader, a ParallelLoader, a Loader or an EltLoader, to be opened with `with`.
+
+    Exceptions:
+    - ValueError: If the mode is unknown.
+    """
+    if config.transform_engine == "sql":
+        # The raw records are transformed by the database when they are committed
+        return EltLoader(location_cache=location_cache, geocoder=build_geocoder(config), batch_size=config.loader_batch_size,
+                         database_url=config.database_url)
+    if config.loader_mode == "copy":
+        return BulkLoader([], batch_size=config.loader_batch_size, database_url=config.database_url)
+    if config.loader_mode == "parallel":
+        return ParallelLoader([], workers=config.loader_workers, batch_size=config.loader_batch_size,
+                              isolation_level=config.loader_isolation_level, database_url=config.database_url)
+    if config.loader_mode == "orm":
+        return Loader([], database_url=config.database_url)
+    raise ValueError(f"Unknown loader mode: {config.loader_mode}")
+
+def recover_data(extractor, start_offset, step, page_queue, failure_queue, stop, skip_offsets=frozenset()):
     """
-    Retrieves data from a specified range of offsets using the Extractor class.
+    Retrieves the pages at start_offset, start_offset + step, ... using the Extractor class.
 
-    This function attempts to fetch data in chunks of 1000 from the start_offset to the end_offset.
-    If any errors occur during the data retrieval, the range that failed is put into the failure_queue
-    for potential retry or logging.
+    This function fetches the pages of extractor.page_size records until a page is not full, the end of the
+    dataset. The threads start at the consecutive pages and step over the pages of the other threads, so
+    together they request every page once. If any errors occur during the data retrieval, the range of the
+    page that failed is put into the failure_queue for potential retry or logging.
 
     Parameters:
-    - start_offset (int): The starting offset for data retrieval.
-    - end_offset (int): The ending offset for data retrieval. Data retrieval stops if this offset is reached.
-    - data_list (list): A list to which the retrieved data will be appended. This list is shared among threads.
-    - lock (threading.Lock): A lock object used to synchronize access to the shared data_list, ensuring thread-safe modifications.
+    - extractor (Extractor): The extractor of the thread, with the endpoint and the page size.
+    - start_offset (int): The offset of the first page.
+    - step (int): The distance between two pages of the thread, the page size times the number of threads.
+    - page_queue (queue.Queue): A bounded queue to which every retrieved page is put. This queue is shared among threads.
     - failure_queue (queue.Queue): A queue used to store the ranges of offsets where data retrieval failed. This allows for tracking and handling of errors.
+    - stop (threading.Event): An event set when the consumer of the pages is gone, the retrieval stops as soon as possible.
+    - skip_offsets (set): The offsets of the pages already retrieved by a previous run, not requested again.
 
     Returns:
-    - None: This function does not return any value. It modifies data_list in-place and uses failure_queue to report errors.
+    - None: This function does not return any value. It puts the pages in page_queue and uses failure_queue to report errors.
     
     Side Effects:
-    - Appends successfully retrieved data to the data_list, while maintaining thread safety using the provided lock.
-    - Puts failed offset ranges into the failure_queue for further processing if an exception occurs.
+    - Puts successfully retrieved (offset, page) tuples into the page_queue, waiting when the queue is full.
+    - Puts the failed offset range into the failure_queue for further processing if an exception occurs.
 
     Exceptions:
     - Any exception raised during data retrieval is caught, and the corresponding range is added to the failure_queue.
     """
-    extractor = Extractor()
+    offset = start_offset
     try:
-        for i in range(start_offset, end_offset, 1000):
-            print(f"Recovering 999 raw data from offset = {i}")
-            tmp_data = extractor.get_data_from_nasa(i)
+        for offset in itertools.count(start_offset, step):
+            if offset in skip_offsets:
+                continue
+            logger.info("Recovering %d raw data from offset = %d", extractor.page_size, offset)
+            tmp_data = extractor.get_data_from_nasa(offset)
             if not tmp_data:
                 break
-            with lock:
-                data_list.extend(tmp_data)
+            while not stop.is_set():
+                try:
+                    page_queue.put((offset, tmp_data), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set() or len(tmp_data) < extractor.page_size:
+                return
     except Exception as e:
-        print(f"Error in range ({start_offset}, {end_offset}): {e}")
-        failure_queue.put((start_offset, end_offset))
+        logger.error("Error in range (%d, %d): %s", offset, offset + extractor.page_size, e)
+        failure_queue.put((offset, offset + extractor.page_size))
 
-def main():
-     
-    start_time = time.time()
-    num_threads = 5
-    offsets = [(i * 10000, (i + 1) * 10000) for i in range(num_threads)]
-    
-    json_data = []
-    lock = threading.Lock()
-    failure_queue = queue.Queue()
+def stream_data(config, failure_queue, max_pending_pages=4, skip_offsets=frozenset(), page_cache=None, updated_since=None):
+    """
+    Yields the pages retrieved by extractor_concurrency threads, as soon as they are available.
+
+    Parameters:
+    - config (Config): The settings of the run: the endpoint, the page size and the number of threads.
+    - failure_queue (queue.Queue): The queue where the threads put the failed ranges.
+    - max_pending_pages (int): The maximum number of pages retrieved and not yet consumed.
+    - skip_offsets (set): The offsets of the pages already retrieved by a previous run, not requested again.
+    - page_cache (PageCache): The on-disk cache of the raw pages, shared by the threads.
+    - updated_since (str): If set, only the records updated after this timestamp (:updated_at) are requested.
+
+    Returns:
+    - Generator: The (offset, page) tuples of raw data.
 
+    Exceptions:
+    - Exception: Raised after the last page if one or more ranges failed.
+    """
+    page_queue = queue.Queue(maxsize=max_pending_pages)
+    stop = threading.Event()
     threads = []
-    for start_offset, end_offset in offsets:
-        thread = threading.Thread(target=recover_data, args=(start_offset, end_offset, json_data, lock, failure_queue))
+    page_size = config.extractor_page_size
+    for i in range(config.extractor_concurrency):
+        # A session for each thread, requests.Session is not thread safe
+        extractor = Extractor(page_cache, endpoint=config.nasa_api_endpoint, page_size=page_size, updated_since=updated_since)
+        thread = threading.Thread(
+            target=recover_data,
+            args=(extractor, i * page_size, config.extractor_concurrency * page_size, page_queue, failure_queue, stop, skip_offsets),
+            name=f"extractor-{i}",
+            daemon=True
+        )
         threads.append(thread)
         thread.start()
 
-    for thread in threads:
-        thread.join()
+    try:
+        while any(thread.is_alive() for thread in threads) or not page_queue.empty():
+            try:
+                yield page_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+    finally:
+        stop.set()
 
-    if failure_queue.empty():
-        print("Extraction completed")
-         # Transform process
-        transformer = Transformer(json_data)
-        transformer.transform()
-        print("")
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(f"Executed in {execution_time:.4f} seconds")
+    if not failure_queue.empty():
+        raise Exception("One or more threads failed")
+    logger.info("Extraction completed")
 
-        with Loader(transformer.transformed_data) as loader:
+def drop_offsets(pages):
+    """
+    Yields the pages of the (offset, page) tuples, used when the checkpoint is disabled.
+
+    Parameters:
+    - pages (Iterable): The (offset, page) tuples.
+
+    Returns:
+    - Generator: The pages of raw data.
+    """
+    try:
+        for _, page in pages:
+            yield page
+    finally:
+        close = getattr(pages, "close", None)
+        if close is not None:
+            close()
+
+STAGES = ("extract", "transform", "load")
+
+def parse_stages(config):
+    """
+    Parses the comma separated stages to run.
+
+    Parameters:
+    - config (Config): The settings of the run, etl_stages are the stages, e.g. "extract,transform".
+
+    Returns:
+    - set: The stages to run.
+
+    Exceptions:
+    - ValueError: If a stage is unknown, the stages are not contiguous, STAGE_DIR is missing for a partial run,
+      or the sql engine would run the transform stage without the load stage (or vice versa).
+    """
+    value = config.etl_stages
+    stages = {stage.strip() for stage in value.split(",") if stage.strip()}
+    unknown = stages - set(STAGES)
+    if unknown or not stages:
+        raise ValueError(f"Unknown ETL stages: {value}")
+    positions = sorted(STAGES.index(stage) for stage in stages)
+    if positions != list(range(positions[0], positions[-1] + 1)):
+        raise ValueError(f"The ETL stages must be contiguous: {value}")
+    if len(stages) < len(STAGES) and not config.stage_dir:
+        raise ValueError("STAGE_DIR is required to run only some of the ETL stages")
+    if config.transform_engine == "sql" and ("transform" in stages) != ("load" in stages):
+        raise ValueError("The sql engine runs the transform and load stages together")
+    return stages
+
+def write_metrics(config):
+    """
+    Writes the metrics of the run in the metrics_format format to metrics_path, or to stdout.
+
+    Parameters:
+    - config (Config): The settings of the run.
+
+    Exceptions:
+    - ValueError: If the format is unknown.
+    """
+    if config.metrics_format == "json":
+        report = metrics.to_json()
+    elif config.metrics_format == "prometheus":
+        report = metrics.to_prometheus()
+    else:
+        raise ValueError(f"Unknown metrics format: {config.metrics_format}")
+    if config.metrics_path:
+        with open(config.metrics_path, "w") as file:
+            file.write(report)
+        logger.info("Metrics written to %s", config.metrics_path)
+    else:
+        print(report)
+
+def main(argv=None):
+    """
+    Runs the ETL process with the settings of the command line, of the environment variables and of the configuration file.
+
+    Parameters:
+    - argv (list): The command line arguments, sys.argv[1:] if None.
+    """
+    config = Config.load(argv)
+    logging.basicConfig(level=config.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    start_time = time.time()
+    failure_queue = queue.Queue()
+
+    stages = parse_stages(config)
+    store = StageStore(config.stage_dir) if config.stage_dir else None
+    # The checkpoint counts the pages committed, so it is used only when the pages flow from the API to the database
+    use_checkpoint = config.checkpoint_dir and len(stages) == len(STAGES)
+
+    profiler = StageProfiler(config.profile_dir, memory=config.profile_memory) if config.profile_dir else None
+    # The run state is read to filter the changed records and written after the load, so a full run
+    # extracting without loading (e.g. --only extract) does not need the database
+    use_run_state = "extract" in stages and ("load" in stages or config.etl_mode == "incremental")
+
+    with (profiler or nullcontext()), (RunState(config.etl_mode, database_url=config.database_url) if use_run_state else nullcontext()) as run_state, (GeocodingCache(
+        config.geocoding_cache_path,
+        ttl=config.geocoding_cache_ttl,
+        max_entries=config.geocoding_cache_max_entries
+    ) if "transform" in stages else nullcontext()) as location_cache, (Checkpoint(config.checkpoint_dir, {
+        # A failed run is resumed only by a run requesting the same pages
+        "backend": config.extractor_backend,
+        "endpoint": config.nasa_api_endpoint,
+        "page_size": config.extractor_page_size,
+        "mode": config.etl_mode,
+        "updated_since": run_state.updated_since
+    }) if use_checkpoint else nullcontext()) as checkpoint:
+        if "extract" in stages:
+            page_cache = PageCache(config.page_cache_dir, offline=config.page_cache_offline) if config.page_cache_dir else None
+            if config.extractor_backend == "async":
+                pages = AsyncExtractor(
+                    config.nasa_api_endpoint,
+                    page_size=config.extractor_page_size,
+                    concurrency=config.extractor_concurrency,
+                    updated_since=run_state.updated_since if run_state else None,
+                    skip_offsets=checkpoint.skip_offsets(config.extractor_page_size) if checkpoint else None,
+                    page_cache=page_cache
+                ).iter_pages(with_offsets=True)
+            else:
+                pages = stream_data(
+                    config,
+                    failure_queue,
+                    skip_offsets=checkpoint.skip_offsets(config.extractor_page_size) if checkpoint else frozenset(),
+                    page_cache=page_cache,
+                    updated_since=run_state.updated_since if run_state else None
+                )
+            # With the checkpoint the pages are written to disk and the pages not loaded by a failed run are loaded first
+            pages = checkpoint.pages(pages) if checkpoint else drop_offsets(pages)
+            if run_state:
+                pages = run_state.track(pages)
+            if store:
+                pages = store.spill_raw(pages)
+        elif "transform" in stages:
+            pages = store.raw_pages()
+        else:
+            pages = store.batches()
+
+        # The secondary indexes are not updated record by record during the load, they are built again after it
+        schema = Schema(config.database_url) if "load" in stages else None
+        if schema and (config.schema_drop_indexes == "always" or config.schema_drop_indexes == "full" and config.etl_mode == "full"):
+            schema.drop_indexes()
+
+        # Extract, transform and load processes run concurrently, page by page
+        engine = VectorizedTransformer if config.transform_engine == "vectorized" else Transformer
+        with (engine(
+            [],
+            location_cache=location_cache,
+            geocoder=build_geocoder(config),
+            workers=config.transform_workers,
+            chunk_size=config.transform_chunk_size
+        ) if "transform" in stages and config.transform_engine != "sql" else nullcontext()) as transformer, (
+            build_loader(config, location_cache) if "load" in stages else nullcontext()) as loader:
+            # With the sql engine the loader receives the raw pages and transforms them
+            transformation = loader if config.transform_engine == "sql" else transformer
+            if store and transformer is not None:
+                loader = store.writer(loader) # The transformed batches are written to STAGE_DIR, and loaded if required
             try:
-                loader.save_data()
-                print(f"The ETL process finished without error")
+                pipeline = Pipeline(
+                    pages,
+                    transformer,
+                    loader,
+                    commit_every=config.checkpoint_commit_every if checkpoint else None,
+                    on_commit=checkpoint.committed if checkpoint else None,
+                    profiler=profiler
+                )
+                loaded = pipeline.run()
+                if config.transform_engine == "sql":
+                    loaded = loader.loaded # The pipeline counts the raw records staged
+                if "extract" in stages and "load" in stages:
+                    run_state.save(loaded, retry_ids=transformation.retry_ids if transformation is not None else ())
+                if checkpoint:
+                    checkpoint.complete()
+                logger.info("The ETL process finished without error - stages %s, %d records loaded, %d not changed",
+                            ",".join(s for s in STAGES if s in stages), loaded, run_state.skipped if run_state else 0)
+                if transformation is not None and transformation.rejected:
+                    logger.info("Rejected records: %s", dict(transformation.rejected))
             except Exception as e:
-                print(f"The ETL process is failed - {str(e)}")
-        
-    else:
-        print("One or more threads failed. Reviewing failure details.")
+                logger.error("The ETL process is failed - %s", e)
+                if checkpoint:
+                    checkpoint.fail(list(failure_queue.queue))
+                    logger.error("The pages retrieved are kept in %s, run again to resume", config.checkpoint_dir)
+
+        if schema:
+            try:
+                schema.create_indexes()
+            except Exception as e:
+                logger.error("The secondary indexes are not built - %s, run python -m etl.schema create-indexes", e)
+
+    end_time = time.time()
+    execution_time = end_time - start_time
+    metrics.increment("stage_seconds", execution_time, stage="run")
+    logger.info("Executed in %.4f seconds", execution_time)
+
+    if not failure_queue.empty():
+        logger.error("One or more threads failed. Reviewing failure details.")
         while not failure_queue.empty():
             failed_range = failure_queue.get()
-            print(f"Failed range: {failed_range}")
+            logger.error("Failed range: %s", failed_range)
+    write_metrics(config)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,10 +6,16 @@ Author: Giuseppe Valente <valentepeppe@gmail.com>
 Usage:
     - Create an instance of DimensionClassificationModel.
 """
+from dataclasses import dataclass
+
+@dataclass(frozen=True, slots=True)
 class DimensionClassificationModel:
     """
     Represents the classification of a meteorite in the data model.
 
+    The instances are immutable, so the same instance is shared by all the meteorites
+    with the same classification.
+
     Attributes:
         group (str): The classification group of the meteorite.
         clan (str): The clan classification of the meteorite.
@@ -18,18 +24,8 @@ class DimensionClassificationModel:
         material (str): The material type of the meteorite.
     """
 
-    def __init__(self, group=None, clan=None, clazz=None, chemical_composition=None, material=None):
-        """
-        Initialize a DimensionClassificationModel instance.
-
-        :param group: The classification group of the meteorite
-        :param clan: The clan classification of the meteorite
-        :param clazz: The class classification of the meteorite
-        :param chemical_composition: The chemical composition of the meteorite
-        :param material: The material type of the meteorite
-        """
-        self.group = group
-        self.clan = clan
-        self.clazz = clazz
-        self.chemical_composition = chemical_composition
-        self.material = material
\ No newline at end of file
+    group: str = None
+    clan: str = None
+    clazz: str = None
+    chemical_composition: str = None
+    material: str = None
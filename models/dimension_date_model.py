@@ -7,40 +7,85 @@ Dependencies:
     - datetime
 
 Usage:
+    - Call DimensionDateModel.parse(timestamp) to get the shared DimensionDateModel of a timestamp
     - Create a DimensionDateModel instance
 """
 from datetime import datetime
+from functools import lru_cache
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# The format used by NASA, parsed without strptime
+_NASA_TIMESTAMP = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})\.(\d{3})", re.ASCII)
 
 class DimensionDateModel:
 
     """
-    Represents a Date with year, month, quarter and timestamp.
+    Represents a Date with year, month, quarter, date and timestamp.
+
+    The instances returned by parse are shared by all the records with the same timestamp,
+    so they must not be modified.
 
     Attributes:
         year (int): The numerical year.
         month (int): The numerical month
         quarter (int): The numerical quarter
-        timestamp (float): The timestamp.
+        date (datetime): The naive date and time parsed from the string.
+        timestamp (float): The timestamp, in the local timezone of the process.
     """
 
+    __slots__ = ('year', 'month', 'quarter', 'date', 'timestamp')
+
     def __init__(self, timestamp: str):
         """
         Initializes a DimensionDateModel object starting from the timestamp in str format.
-        If the timestamp cannot be convert returns None
         Args:
             timestamp (str): The timestamp in str
+        Raises:
+            ValueError: If the timestamp cannot be converted
+        """
+        date_obj = DimensionDateModel.__to_datetime(timestamp)
+        # Extract the year
+        self.year = date_obj.year
+        # Extract the month
+        self.month = date_obj.month
+        # Calculate the quarter
+        self.quarter = (self.month - 1) // 3 + 1
+        # Keep the date as written, independent of the timezone
+        self.date = date_obj
+        # Get the timestamp
+        self.timestamp = date_obj.timestamp()
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def parse(timestamp: str):
+        """
+        Returns the DimensionDateModel of the timestamp in str format, memoized by the raw string:
+        NASA uses a few hundred distinct values, so the same instance is shared by many records.
+        Args:
+            timestamp (str): The timestamp in str
+        Returns:
+            DimensionDateModel: The shared instance, or None if the timestamp cannot be converted
         """
         try:
-            date_obj = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f')
-            # Extract the year
-            self.year = date_obj.year
-            # Extract the month
-            self.month = date_obj.month
-            # Calculate the quarter
-            self.quarter = (self.month - 1) // 3 + 1
-            # Get the timestamp
-            self.timestamp = date_obj.timestamp()
-
-        except ValueError as ve:
-            print(f"Error: {str(ve)}")
-            return None
\ No newline at end of file
+            return DimensionDateModel(timestamp)
+        except (ValueError, TypeError) as ve:
+            logger.debug("Error: %s", ve)
+            return None
+
+    @staticmethod
+    def __to_datetime(timestamp: str) -> datetime:
+        """
+        Converts the timestamp in the format '%Y-%m-%dT%H:%M:%S.%f', the fixed NASA format
+        (milliseconds) is converted without strptime.
+        """
+        match = _NASA_TIMESTAMP.fullmatch(timestamp)
+        if match is not None:
+            year, month, day, hour, minute, second, millisecond = (int(g) for g in match.groups())
+            try:
+                return datetime(year, month, day, hour, minute, second, millisecond * 1000)
+            except ValueError:
+                pass # Out of range values, strptime raises the error
+        return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f')
@@ -20,6 +20,9 @@ class DimensionLocationModel:
         country (str): The name of the country.
     """
 
+    # No per instance __dict__, the coordinates are stored as two floats instead of a tuple
+    __slots__ = ('latitude', 'longitude', 'city', 'state', 'country')
+
     def __init__(self, latitude, longitude, city, state, country):
 
         """
@@ -33,11 +36,19 @@ class DimensionLocationModel:
             country (str): The country associated with the location.
         """
 
-        self.location = (latitude, longitude)
+        self.latitude = latitude
+        self.longitude = longitude
         self.city = city
         self.state = state
         self.country = country
 
+    @property
+    def location(self) -> tuple:
+        """
+        Returns the geographical coordinates as (latitude, longitude) tuple.
+        """
+        return (self.latitude, self.longitude)
+
     def __eq__(self, other):
 
         """
@@ -50,7 +61,7 @@ class DimensionLocationModel:
             bool: True if the locations (latitude and longitude) are the same, otherwise False.
         """
         if isinstance(other, DimensionLocationModel):
-            return self.location[0] == other.location[0] and self.location[1] == other.location[1]
+            return self.latitude == other.latitude and self.longitude == other.longitude
         return False
 
     def __hash__(self) -> int:
@@ -60,4 +71,4 @@ class DimensionLocationModel:
          Returns:
             int: The hash value of the location (latitude and longitude).
         """
-        return hash(self.location)
\ No newline at end of file
+        return hash((self.latitude, self.longitude))
@@ -0,0 +1,192 @@
+"""
+MeteoriteBatch Class for holding many MeteoriteModel in columns
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the MeteoriteBatch class, a struct-of-arrays container for the transformed
+records: the numeric fields are stored in typed arrays and every dimension is stored once,
+each record only keeps the index of its dimensions. It is meant for the bulk paths, when the
+whole dataset is kept in memory between the transformation and the load.
+
+Dependencies:
+- array: For the typed columns.
+- numpy: For the zero-copy views of the columns.
+
+Usage:
+    - Create an instance of MeteoriteBatch, optionally from a list of MeteoriteModel.
+    - Or build it with from_columns from the columns and the dimensions, e.g. read from a file.
+    - Pass it to the loaders in place of the list, it supports len, slices and iteration.
+"""
+
+from models.meteorite_model import MeteoriteModel
+from array import array
+from typing import Iterable
+
+import numpy as np
+
+class MeteoriteBatch:
+
+    """
+    A columnar list of MeteoriteModel.
+
+    Iterating or indexing the batch returns MeteoriteModel instances built on the fly,
+    they reference the shared dimension instances held by the batch.
+
+    Attributes:
+        nasa_id (array): The NASA ids ('q'), -1 if not available.
+        mass (array): The masses in grams ('d').
+        latitude (array): The latitudes of the locations ('d').
+        longitude (array): The longitudes of the locations ('d').
+        timestamp (array): The timestamps of the dates ('d').
+        dates (list): The distinct DimensionDateModel of the batch.
+        locations (list): The distinct DimensionLocationModel of the batch.
+        classifications (list): The distinct DimensionClassificationModel of the batch.
+    """
+
+    _MISSING_ID = -1
+
+    def __init__(self, data: Iterable[MeteoriteModel] = ()):
+        """
+        Initializes the batch with the given records.
+
+        Args:
+            data (Iterable[MeteoriteModel]): The records to store.
+        """
+        self.nasa_id = array('q')
+        self.mass = array('d')
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.timestamp = array('d')
+        self.dates = []
+        self.locations = []
+        self.classifications = []
+        # Index of each record in the dimension lists ('I' is at least 32 bits on the supported platforms)
+        self.__date_index = array('I')
+        self.__location_index = array('I')
+        self.__classification_index = array('I')
+        # Position of each dimension instance in its list, the instances are compared by identity
+        self.__positions = ({}, {}, {})
+        self.extend(data)
+
+    @classmethod
+    def from_columns(cls, columns: dict, dates: list, locations: list, classifications: list):
+        """
+        Builds a batch from the columns returned by columns() and the distinct dimensions they index.
+
+        Args:
+            columns (dict): The nasa_id, mass, date, location and classification columns.
+            dates (list): The DimensionDateModel indexed by the date column.
+            locations (list): The DimensionLocationModel indexed by the location column.
+            classifications (list): The DimensionClassificationModel indexed by the classification column.
+
+        Returns:
+            MeteoriteBatch: The batch, the dimension instances are shared, not copied.
+        """
+        batch = cls()
+        batch.nasa_id.frombytes(np.ascontiguousarray(columns["nasa_id"], dtype=np.int64).tobytes())
+        batch.mass.frombytes(np.ascontiguousarray(columns["mass"], dtype=np.float64).tobytes())
+        batch.__date_index.frombytes(np.ascontiguousarray(columns["date"], dtype=np.uint32).tobytes())
+        batch.__location_index.frombytes(np.ascontiguousarray(columns["location"], dtype=np.uint32).tobytes())
+        batch.__classification_index.frombytes(np.ascontiguousarray(columns["classification"], dtype=np.uint32).tobytes())
+        location = np.frombuffer(batch.__location_index, dtype=np.uint32)
+        batch.latitude.frombytes(np.array([l.latitude for l in locations], dtype=np.float64)[location].tobytes())
+        batch.longitude.frombytes(np.array([l.longitude for l in locations], dtype=np.float64)[location].tobytes())
+        date = np.frombuffer(batch.__date_index, dtype=np.uint32)
+        batch.timestamp.frombytes(np.array([d.timestamp for d in dates], dtype=np.float64)[date].tobytes())
+        for dimension, instances, target in ((0, dates, batch.dates), (1, locations, batch.locations), (2, classifications, batch.classifications)):
+            for instance in instances:
+                batch.__intern(dimension, target, instance)
+        return batch
+
+    def __len__(self):
+        return len(self.mass)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.__model(i)
+
+    def __getitem__(self, index):
+        """
+        Returns the MeteoriteModel at the index, or a new MeteoriteBatch for a slice.
+        """
+        if isinstance(index, slice):
+            batch = MeteoriteBatch()
+            batch.extend(self.__model(i) for i in range(*index.indices(len(self))))
+            return batch
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("MeteoriteBatch index out of range")
+        return self.__model(index)
+
+    def append(self, record: MeteoriteModel):
+        """
+        Appends a record, its dimensions are stored only if not already in the batch.
+
+        Args:
+            record (MeteoriteModel): The record to append.
+        """
+        date = record.dimensionDateModel
+        location = record.dimensionLocationModel
+        self.nasa_id.append(self._MISSING_ID if record.nasa_id is None else record.nasa_id)
+        self.mass.append(record.mass)
+        self.latitude.append(location.latitude)
+        self.longitude.append(location.longitude)
+        self.timestamp.append(date.timestamp)
+        self.__date_index.append(self.__intern(0, self.dates, date))
+        self.__location_index.append(self.__intern(1, self.locations, location))
+        self.__classification_index.append(self.__intern(2, self.classifications, record.dimensionClassificationModel))
+
+    def extend(self, data: Iterable[MeteoriteModel]):
+        """
+        Appends all the records.
+
+        Args:
+            data (Iterable[MeteoriteModel]): The records to append.
+        """
+        for record in data:
+            self.append(record)
+
+    def columns(self) -> dict:
+        """
+        Returns the numeric columns as NumPy arrays sharing the memory of the batch,
+        they are valid until the next append.
+
+        Returns:
+            dict: The arrays of nasa_id, mass, latitude, longitude and timestamp, and of the positions
+            of the dimensions of each record in dates, locations and classifications.
+        """
+        return {
+            "nasa_id": np.frombuffer(self.nasa_id, dtype=np.int64),
+            "mass": np.frombuffer(self.mass, dtype=np.float64),
+            "latitude": np.frombuffer(self.latitude, dtype=np.float64),
+            "longitude": np.frombuffer(self.longitude, dtype=np.float64),
+            "timestamp": np.frombuffer(self.timestamp, dtype=np.float64),
+            "date": np.frombuffer(self.__date_index, dtype=np.uint32),
+            "location": np.frombuffer(self.__location_index, dtype=np.uint32),
+            "classification": np.frombuffer(self.__classification_index, dtype=np.uint32)
+        }
+
+    def __intern(self, dimension, instances: list, instance):
+        """
+        Returns the position of the instance in the list of the dimension, adding it if needed.
+        """
+        positions = self.__positions[dimension]
+        position = positions.get(id(instance))
+        if position is None:
+            position = positions[id(instance)] = len(instances)
+            instances.append(instance)
+        return position
+
+    def __model(self, i) -> MeteoriteModel:
+        """
+        Builds the MeteoriteModel at the position i.
+        """
+        nasa_id = self.nasa_id[i]
+        return MeteoriteModel(
+            dimensionDateModel=self.dates[self.__date_index[i]],
+            mass=self.mass[i],
+            dimensionLocationModel=self.locations[self.__location_index[i]],
+            dimensionClassificationModel=self.classifications[self.__classification_index[i]],
+            nasa_id=None if nasa_id == self._MISSING_ID else nasa_id
+        )
@@ -23,8 +23,12 @@ class MeteoriteLandingRaw:
         year (str): The year the meteorite fell or was discovered, represented as a string.
         reclat (float): The latitude of the meteorite landing location in decimal degrees.
         reclong (float): The longitude of the meteorite landing location in decimal degrees.
+        id (int): The id of the record in the NASA dataset.
     """   
-    def __init__(self, recclass, mass, year, reclat, reclong):
+
+    __slots__ = ('recclass', 'mass', 'year', 'reclat', 'reclong', 'id')
+
+    def __init__(self, recclass, mass, year, reclat, reclong, id=None):
         """
         Initializes a new instance of the MeteoriteLandingRaw class.
 
@@ -34,9 +38,11 @@ class MeteoriteLandingRaw:
             year (str): The year the meteorite fell or was discovered.
             reclat (float): The latitude of the meteorite landing location in decimal degrees.
             reclong (float): The longitude of the meteorite landing location in decimal degrees.
+            id (int): The id of the record in the NASA dataset.
         """
         self.recclass = recclass
         self.mass = mass
         self.year = year
         self.reclat = reclat
-        self.reclong = reclong
\ No newline at end of file
+        self.reclong = reclong
+        self.id = id
@@ -21,9 +21,13 @@ class MeteoriteModel:
         dimensionDateModel (DimensionDateModel): The model releated to the Date dimension
         dimensionLocationModel (DimensionLocationModel): The model releated to the Location dimension
         mass (float): The mass (in grams) of the meteorite
+        nasa_id (int): The id of the record in the NASA dataset, None if not available
     """ 
+
+    # The dimensions are shared between the records, each record only holds the references
+    __slots__ = ('dimensionDateModel', 'dimensionLocationModel', 'dimensionClassificationModel', 'mass', 'nasa_id')
     
-    def __init__(self, dimensionDateModel: DimensionDateModel, mass, dimensionLocationModel: DimensionLocationModel, dimensionClassificationModel: DimensionClassificationModel):
+    def __init__(self, dimensionDateModel: DimensionDateModel, mass, dimensionLocationModel: DimensionLocationModel, dimensionClassificationModel: DimensionClassificationModel, nasa_id=None):
 
         """
         Initializes a new instance of the MeteoriteModel class.
@@ -32,8 +36,10 @@ class MeteoriteModel:
             dimensionDateModel (DimensionDateModel): The model releated to the Date dimension
             dimensionLocationModel (DimensionLocationModel): The model releated to the Location dimension
             mass (float): The mass (in grams) of the meteorite
+            nasa_id (int): The id of the record in the NASA dataset
         """
         self.dimensionDateModel = dimensionDateModel
         self.dimensionLocationModel = dimensionLocationModel
         self.dimensionClassificationModel = dimensionClassificationModel
-        self.mass = mass
\ No newline at end of file
+        self.mass = mass
+        self.nasa_id = nasa_id
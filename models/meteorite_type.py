@@ -3,323 +3,151 @@ MeteoriteType Class to classify meteorites based on NASA classification strings.
 
 Author: Giuseppe Valente <valentepeppe@gmail.com>
 
+The classification rules are declared in tables (one for each family) and compiled once
+into a single regular expression, the result of each distinct NASA classification string
+is memoized, so a dataset with a few hundred distinct values costs a few hundred evaluations.
+
 Usage:
-    - Create an instance of DimensionClassificationModel.
+    - Call MeteoriteType.classify(nasa_classification) to get the DimensionClassificationModel.
 """
 from models.dimension_classification_model import DimensionClassificationModel
+from functools import lru_cache
+import re
+
+# Each rule is (pattern, group, clan, clazz, material), the pattern is matched at the beginning
+# of the upper case NASA classification, a leading ".*" means "contains".
+_PRIMITIVE_ACHONDRITES = [
+    ("URE", "URE", None, None, "STONY"),
+    ("BRA", "BRA", None, None, "STONY"),
+    ("ACA", "ACA", "ACA-LOD", None, "STONY"),
+    ("LOD", "LOD", "ACA-LOD", None, "STONY"),
+    ("WIN", "WIN", "WIN-IAB-IICD", None, "STONY"),
+    ("IRON, IAB", "IAB", "WIN-IAB-IICD", None, "IRON"),
+]
+
+_ACHONDRITES = [
+    ("ANG", "ANG", None, None, "STONY"),
+    ("AUB", "AUB", None, None, "STONY"),
+    ("EUC", "EUC", "VESTA", None, "STONY"),
+    ("DIO", "DIO", "VESTA", None, "STONY"),
+    ("HOW", "HOW", "VESTA", None, "STONY"),
+    ("MES", "MES", None, None, "STONY-IRON"),
+    ("PAL", "PAL", None, None, "STONY-IRON"),
+    ("IRON, IC", "IRON, IC", None, None, "IRON"),
+    ("IRON, IIAB", "IRON, IIAB", None, None, "IRON"),
+    ("IRON, IIC", "IRON, IIC", None, None, "IRON"),
+    ("IRON, IID", "IRON, IID", None, None, "IRON"),
+    ("IRON, IIE", "IRON, IIE", None, None, "IRON"),
+    ("IRON, IIIAB", "IRON, IIIAB", None, None, "IRON"),
+    ("IRON, IIIE", "IRON, IIIE", None, None, "IRON"),
+    ("IRON, IIIF", "IRON, IIIF", None, None, "IRON"),
+    ("IRON, IVA", "IRON, IVA", None, None, "IRON"),
+    ("IRON, IVB", "IRON, IVB", None, None, "IRON"),
+    (".*SHE", "SHE", "MARS", None, "STONY"),
+    (".*NAK", "NAK", "MARS", None, "STONY"),
+    (".*CHA", "CHA", "MARS", None, "STONY"),
+    (".*OPX", "OPX", "MARS", None, "STONY"),
+]
+
+_CHONDRITES = [
+    ("CI", "CI", "CI", "C", "STONY"),
+    ("CM", "CM", "CM-CO", "C", "STONY"),
+    ("CO", "CO", "CM-CO", "C", "STONY"),
+    ("CV", "CV", "CV-CK", "C", "STONY"),
+    ("CK", "CK", "CV-CK", "C", "STONY"),
+    ("CR", "CR", "CR-CLAN", "C", "STONY"),
+    ("CH", "CH", "CR-CLAN", "C", "STONY"),
+    ("CB", "CB", "CR-CLAN", "C", "STONY"),
+    (r"H(?!OWARDITE\Z)", "H", "H-L-LL", "O", "STONY"),
+    ("L(?!L)", "L", "H-L-LL", "O", "STONY"),
+    ("LL", "LL", "H-L-LL", "O", "STONY"),
+    ("EH", "EH", "EH-EL", "E", "STONY"),
+    ("EL", "EL", "EH-EL", "E", "STONY"),
+    ("R(?!E)", "R", None, None, "STONY"),
+    ("K", "K", None, None, "STONY"),
+]
+
+class _CompiledRules:
+
+    """
+    A table of rules compiled into a single regular expression.
+
+    The alternatives are tried in the order of the table, so the first matching rule wins
+    exactly like the original if/elif chains. Every rule builds its DimensionClassificationModel
+    once, the same immutable instance is returned for every match.
+    """
+
+    def __init__(self, families):
+        """
+        Compiles the rules of the families, in the given order.
+
+        Args:
+            families (list): A list of (rules, chemical_composition) tuples.
+        """
+        alternatives = []
+        self.models = {}
+        for rules, chemical_composition in families:
+            for pattern, group, clan, clazz, material in rules:
+                name = f"r{len(alternatives)}"
+                alternatives.append(f"(?P<{name}>{pattern})")
+                self.models[name] = DimensionClassificationModel(
+                    group=group,
+                    clan=clan,
+                    clazz=clazz,
+                    chemical_composition=chemical_composition,
+                    material=material
+                )
+        self.regex = re.compile("|".join(alternatives), re.DOTALL)
+
+    def classify(self, nasa_classification: str) -> DimensionClassificationModel:
+        """
+        Returns the model of the first matching rule, or None.
+        """
+        match = self.regex.match(nasa_classification.upper())
+        return self.models[match.lastgroup] if match else None
+
+_PRIMITIVE_ACHONDRITES_RULES = _CompiledRules([(_PRIMITIVE_ACHONDRITES, "PRIMITIVE_ACHONDRITES")])
+_ACHONDRITES_RULES = _CompiledRules([(_ACHONDRITES, "ACHONDRITES")])
+_CHONDRITES_RULES = _CompiledRules([(_CHONDRITES, "CHONDRITES")])
+_ALL_RULES = _CompiledRules([
+    (_PRIMITIVE_ACHONDRITES, "PRIMITIVE_ACHONDRITES"),
+    (_ACHONDRITES, "ACHONDRITES"),
+    (_CHONDRITES, "CHONDRITES")
+])
+
 class MeteoriteType:
 
     """
     Provides methods to classify meteorites based on NASA classification strings.
 
-    This class includes static methods to generate `DimensionClassificationModel`
-    instances for different types of meteorites: Primitive Achondrites, Chondrites,
-    and Achondrites.
+    This class includes static methods to get the `DimensionClassificationModel`
+    of the different types of meteorites: Primitive Achondrites, Chondrites,
+    and Achondrites. The returned instances are shared and immutable.
     """
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def classify(nasa_classification: str) -> DimensionClassificationModel:
+        """
+        Classifies the NASA classification string, the families are checked in the order
+        primitive achondrites, achondrites, chondrites.
+
+        Args:
+            nasa_classification (str): The NASA classification (recclass).
+
+        Returns:
+            DimensionClassificationModel: The shared classification, or None if not recognised.
+        """
+        return _ALL_RULES.classify(nasa_classification)
+
     @staticmethod
     def primitive_achonrdites(nasa_classification:str):
-    
-        classification_model = DimensionClassificationModel()
-        if(nasa_classification.upper().startswith("URE")):
-            classification_model.material = "STONY"
-            classification_model.group = "URE"
-            classification_model.chemical_composition = "PRIMITIVE_ACHONDRITES"
-            return classification_model
-        elif(nasa_classification.upper().startswith("BRA")):
-            classification_model.material = "STONY"
-            classification_model.group = "BRA"
-            classification_model.chemical_composition = "PRIMITIVE_ACHONDRITES"
-            return classification_model
-        elif(nasa_classification.upper().startswith("ACA")):
-            classification_model.material = "STONY"
-            classification_model.group = "ACA"
-            classification_model.chemical_composition = "PRIMITIVE_ACHONDRITES"
-            classification_model.clan = "ACA-LOD"
-            return classification_model
-        elif(nasa_classification.upper().startswith("LOD")):
-            classification_model.material = "STONY"
-            classification_model.group = "LOD"
-            classification_model.chemical_composition = "PRIMITIVE_ACHONDRITES"
-            classification_model.clan = "ACA-LOD"
-            return classification_model
-        elif(nasa_classification.upper().startswith("WIN")):
-            classification_model.material = "STONY"
-            classification_model.group = "WIN"
-            classification_model.chemical_composition = "PRIMITIVE_ACHONDRITES"
-            classification_model.clan = "WIN-IAB-IICD"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IAB")):
-            classification_model.material = "IRON"
-            classification_model.group = "IAB"
-            classification_model.chemical_composition = "PRIMITIVE_ACHONDRITES"
-            classification_model.clan = "WIN-IAB-IICD"
-            return classification_model
-        else:
-            return None
-        
+        return _PRIMITIVE_ACHONDRITES_RULES.classify(nasa_classification)
+
     @staticmethod
     def chondrites(nasa_classification:str):
+        return _CHONDRITES_RULES.classify(nasa_classification)
 
-        classification_model = DimensionClassificationModel()
-        if(nasa_classification.upper().startswith("CI")):
-            classification_model.group = "CI"
-            classification_model.clan = "CI"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CM")):
-            classification_model.group = "CM"
-            classification_model.clan = "CM-CO"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CO")):
-            classification_model.group = "CO"
-            classification_model.clan = "CM-CO"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CV")):
-            classification_model.group = "CV"
-            classification_model.clan = "CV-CK"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CK")):
-            classification_model.group = "CK"
-            classification_model.clan = "CV-CK"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CR")):
-            classification_model.group = "CR"
-            classification_model.clan = "CR-CLAN"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CH")):
-            classification_model.group = "CH"
-            classification_model.clan = "CR-CLAN"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("CB")):
-            classification_model.group = "CB"
-            classification_model.clan = "CR-CLAN"
-            classification_model.clazz = "C"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("H") and nasa_classification.upper() != "HOWARDITE"):
-            classification_model.group = "H"
-            classification_model.clan = "H-L-LL"
-            classification_model.clazz = "O"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("L") and not nasa_classification.upper().startswith("LL")):
-            classification_model.group = "L"
-            classification_model.clan = "H-L-LL"
-            classification_model.clazz = "O"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("LL")):
-            classification_model.group = "LL"
-            classification_model.clan = "H-L-LL"
-            classification_model.clazz = "O"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("EH")):
-            classification_model.group = "EH"
-            classification_model.clan = "EH-EL"
-            classification_model.clazz = "E"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("EL")):
-            classification_model.group = "EL"
-            classification_model.clan = "EH-EL"
-            classification_model.clazz = "E"
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("R") and not nasa_classification.upper().startswith("RE")):
-            classification_model.group = "R"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("K")):
-            classification_model.group = "K"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "CHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        else:
-            return None
-    
     @staticmethod
     def achonrdites(nasa_classification:str):
-
-        classification_model = DimensionClassificationModel()
-        if(nasa_classification.upper().startswith("ANG")):
-            classification_model.group = "ANG"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("AUB")):
-            classification_model.group = "AUB"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("EUC")):
-            classification_model.group = "EUC"
-            classification_model.clan = "VESTA"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("DIO")):
-            classification_model.group = "DIO"
-            classification_model.clan = "VESTA"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("HOW")):
-            classification_model.group = "HOW"
-            classification_model.clan = "VESTA"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif(nasa_classification.upper().startswith("MES")):
-            classification_model.group = "MES"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY-IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("PAL")):
-            classification_model.group = "PAL"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY-IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IC")):
-            classification_model.group = "IRON, IC"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IIAB")):
-            classification_model.group = "IRON, IIAB"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IIC")):
-            classification_model.group = "IRON, IIC"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IID")):
-            classification_model.group = "IRON, IID"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IIE")):
-            classification_model.group = "IRON, IIE"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IIIAB")):
-            classification_model.group = "IRON, IIIAB"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IIIE")):
-            classification_model.group = "IRON, IIIE"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IIIF")):
-            classification_model.group = "IRON, IIIF"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IVA")):
-            classification_model.group = "IRON, IVA"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif(nasa_classification.upper().startswith("IRON, IVB")):
-            classification_model.group = "IRON, IVB"
-            classification_model.clan = None
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "IRON"
-            return classification_model
-        elif("SHE" in nasa_classification.upper()):
-            classification_model.group = "SHE"
-            classification_model.clan = "MARS"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif("NAK" in nasa_classification.upper()):
-            classification_model.group = "NAK"
-            classification_model.clan = "MARS"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif("CHA" in nasa_classification.upper()):
-            classification_model.group = "CHA"
-            classification_model.clan = "MARS"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        elif("OPX" in nasa_classification.upper()):
-            classification_model.group = "OPX"
-            classification_model.clan = "MARS"
-            classification_model.clazz = None
-            classification_model.chemical_composition = "ACHONDRITES"
-            classification_model.material = "STONY"
-            return classification_model
-        else:
-            return None
\ No newline at end of file
+        return _ACHONDRITES_RULES.classify(nasa_classification)
@@ -0,0 +1,136 @@
+"""
+AggregateQuery Class for the aggregations of the meteorite facts
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the AggregateQuery class, the aggregations of the dashboards (number and
+mass of the meteorites by year, quarter, country and classification) are read from the
+meteorite_rollup table, a few thousand rows maintained by the loaders (etl/rollup.py),
+instead of joining and scanning all the facts. The aggregations on the attributes not in
+the rollup (month, city, state) are computed from the facts.
+
+Dependencies:
+- sqlalchemy: For the database connection.
+
+Usage:
+    - Create an instance of AggregateQuery.
+    - Call aggregate with the attributes of the groups, the filters and the measures, it returns a list of dict.
+"""
+
+from sqlalchemy import create_engine, text
+from typing import List
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class AggregateQuery:
+
+    """
+    Aggregates the meteorite facts, routing the query to the rollup when all its attributes are in the rollup.
+
+    Attributes:
+        DIMENSIONS (tuple): The attributes accepted for the groups and the filters.
+        MEASURES (tuple): The measures accepted: meteorites, total_mass, min_mass, max_mass and mean_mass.
+    """
+
+    # Attribute -> (column of the rollup, column of the facts), None if not in the rollup
+    _DIMENSIONS = {
+        "year": ("r.year", "d.year"),
+        "quarter": ("r.quarter", "d.quarter"),
+        "month": (None, "d.month"),
+        "country": ("r.country", "l.country"),
+        "state": (None, "l.state"),
+        "city": (None, "l.city"),
+        "classification": ("r.classification", "c.classification"),
+        "material_type": ("r.material_type", "c.material_type"),
+        "chemical_composition": ("r.chemical_composition", "c.chemical_composition"),
+        "clan": ("r.clan", "c.clan"),
+        "clazz": ("r.clazz", "c.clazz")
+    }
+
+    # Measure -> (aggregation of the rollup, aggregation of the facts)
+    _MEASURES = {
+        "meteorites": ("coalesce(sum(r.meteorites), 0)", "count(*)"),
+        "total_mass": ("sum(r.total_mass)", "sum(m.mass::double precision)"),
+        "min_mass": ("min(r.min_mass)", "min(m.mass)"),
+        "max_mass": ("max(r.max_mass)", "max(m.mass)"),
+        "mean_mass": ("sum(r.total_mass) / sum(r.meteorites)", "avg(m.mass::double precision)")
+    }
+
+    _SOURCES = {
+        "rollup": "public.meteorite_rollup r",
+        "facts": """public.meteorite m
+                    JOIN public.date d ON d.id = m.id_date
+                    JOIN public.location l ON l.id = m.id_location
+                    JOIN public.classification c ON c.id = m.id_classification"""
+    }
+
+    DIMENSIONS = tuple(_DIMENSIONS)
+    MEASURES = tuple(_MEASURES)
+
+    def __init__(self, database_url=None):
+
+        """
+        Initialize the AggregateQuery instance.
+
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"))
+
+    def source(self, group_by: List[str], filters: dict = None) -> str:
+        """
+        Return the source answering the query: 'rollup' if all the attributes are in the rollup, otherwise 'facts'.
+
+        :param group_by: The attributes of the groups.
+        :param filters: The attributes filtered.
+        :return: 'rollup' or 'facts'.
+        """
+        names = list(group_by) + list(filters or {})
+        for name in names:
+            if name not in self._DIMENSIONS:
+                raise ValueError(f"Unknown attribute: {name}")
+        return "rollup" if all(self._DIMENSIONS[name][0] for name in names) else "facts"
+
+    def aggregate(self, group_by: List[str], filters: dict = None, measures=("meteorites", "total_mass")) -> List[dict]:
+        """
+        Return the measures of each group, ordered by the attributes of the groups.
+
+        A filter is an attribute with a value, None or a list of values, e.g.
+        aggregate(["year"], {"country": "Italia", "quarter": [1, 2]}, ["meteorites", "mean_mass"]).
+
+        :param group_by: The attributes of the groups, empty for a single group of all the facts.
+        :param filters: The values of the attributes of the facts aggregated.
+        :param measures: The measures of each group.
+        :return: A list of dict, one for each group, with the attributes and the measures.
+        """
+        filters = filters or {}
+        source = self.source(group_by, filters)
+        column = 0 if source == "rollup" else 1
+        for name in measures:
+            if name not in self._MEASURES:
+                raise ValueError(f"Unknown measure: {name}")
+
+        selected = [f"{self._DIMENSIONS[name][column]} AS {name}" for name in group_by]
+        selected += [f"{self._MEASURES[name][column]} AS {name}" for name in measures]
+        conditions, parameters = [], {}
+        for name, value in filters.items():
+            expression = self._DIMENSIONS[name][column]
+            if value is None:
+                conditions.append(f"{expression} IS NULL")
+            elif isinstance(value, (list, tuple, set)):
+                conditions.append(f"{expression} = ANY(:{name})")
+                parameters[name] = list(value)
+            else:
+                conditions.append(f"{expression} = :{name}")
+                parameters[name] = value
+
+        statement = f"SELECT {', '.join(selected)} FROM {self._SOURCES[source]}"
+        if conditions:
+            statement += f" WHERE {' AND '.join(conditions)}"
+        if group_by:
+            groups = ", ".join(self._DIMENSIONS[name][column] for name in group_by)
+            statement += f" GROUP BY {groups} ORDER BY {groups}"
+        logger.debug("Aggregation by %s answered by the %s", group_by, source)
+        with self.__engine.connect() as connection:
+            return [dict(row) for row in connection.execute(text(statement), parameters).mappings()]
@@ -4,7 +4,8 @@ Entity classes used to manage database data
 Author: Giuseppe Valente <valentepeppe@gmail.com>
 
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Sequence, Double, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Sequence, Double, DateTime, UniqueConstraint, Index, Computed, text
+from geoalchemy2 import Geography
 from sqlalchemy.orm import declarative_base, relationship, Mapped
 from sqlalchemy.orm import composite, mapped_column
 
@@ -14,7 +15,7 @@ Base = declarative_base()
 class Classification(Base):
     """
     Represents the classification of a meteorite, including its material type, chemical composition,
-    and other classification attributes.
+    and other classification attributes. All the attributes together are the natural key.
 
     Attributes:
         id (int): Primary key, unique identifier for the classification.
@@ -25,7 +26,10 @@ class Classification(Base):
         clazz (str): Class of the meteorite.
     """
     __tablename__ = 'classification'
-    __table_args__ = {'schema': 'public'}
+    __table_args__ = (
+        UniqueConstraint('classification', 'material_type', 'chemical_composition', 'clan', 'clazz', name='classification_natural_key', postgresql_nulls_not_distinct=True),
+        {'schema': 'public'}
+    )
     
     id = Column(Integer, Sequence('classification_id_seq'), primary_key=True, autoincrement=True)
     classification = Column(String(255))
@@ -40,6 +44,7 @@ class Classification(Base):
 class Date(Base):
     """
     Represents a date record used to track when a meteorite was observed or collected.
+    The date is the natural key.
 
     Attributes:
         id (int): Primary key, unique identifier for the date.
@@ -49,7 +54,10 @@ class Date(Base):
         year (int): Year of the event.
     """
     __tablename__ = 'date'
-    __table_args__ = {'schema': 'public'}
+    __table_args__ = (
+        UniqueConstraint('date', name='date_natural_key'),
+        {'schema': 'public'}
+    )
     
     id = Column(Integer, Sequence('date_id_seq'), primary_key=True, autoincrement=True)
     date = Column(DateTime)
@@ -63,6 +71,8 @@ class Date(Base):
 class Location(Base):
     """
     Represents the location where a meteorite was found.
+    The coordinates (latitude, longitude) are the natural key, the point geog is computed by the
+    database from the coordinates when the location is inserted and indexed with GiST.
 
     Attributes:
         id (int): Primary key, unique identifier for the location.
@@ -71,9 +81,16 @@ class Location(Base):
         city (str): City where the meteorite was found.
         state (str): State where the meteorite was found.
         country (str): Country where the meteorite was found.
+        geog (Geography): The point of the coordinates (SRID 4326), used by the spatial queries.
     """
     __tablename__ = 'location'
-    __table_args__ = {'schema': 'public'}
+    __table_args__ = (
+        UniqueConstraint('latitude', 'longitude', name='location_natural_key'),
+        Index('location_geog_idx', 'geog', postgresql_using='gist'),
+        Index('location_geom_idx', text('(geog::geometry)'), postgresql_using='gist'),
+        {'schema': 'public'}
+    )
+    __mapper_args__ = {'eager_defaults': False} # The computed point is not returned by the inserts
     
     id = Column(Integer, Sequence('location_id_seq'), primary_key=True, autoincrement=True)
     latitude = Column(Double)
@@ -81,6 +98,10 @@ class Location(Base):
     city = Column(String(255))
     state = Column(String(255))
     country = Column(String(255))
+    geog = Column(
+        Geography(geometry_type='POINT', srid=4326, spatial_index=False),
+        Computed("ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography", persisted=True)
+    )
 
     def __repr__(self):
         return f"<Location(id={self.id}, city={self.city})>"
@@ -91,17 +112,23 @@ class Meteorite(Base):
     location, and date.
 
     Attributes:
+        id (int): Primary key, unique identifier for the meteorite.
+        nasa_id (int): The id of the record in the NASA dataset, used to update the meteorite on later runs.
         id_location (int): Foreign key linking to the Location table.
         id_classification (int): Foreign key linking to the Classification table.
         id_date (int): Foreign key linking to the Date table.
+        year (int): The year of the date, the key of the partitions when the table is partitioned (etl/schema.py).
         mass (float): The mass of the meteorite in grams.
     """
     __tablename__ = 'meteorite'
     __table_args__ = {'schema': 'public'}
     
-    id_location = Column(Integer, ForeignKey('public.location.id'), primary_key=True)
-    id_classification = Column(Integer, ForeignKey('public.classification.id'), primary_key=True)
-    id_date = Column(Integer, ForeignKey('public.date.id'), primary_key=True)
+    id = Column(Integer, Sequence('meteorite_id_seq'), primary_key=True, autoincrement=True)
+    nasa_id = Column(Integer, unique=True)
+    id_location = Column(Integer, ForeignKey('public.location.id'), nullable=False)
+    id_classification = Column(Integer, ForeignKey('public.classification.id'), nullable=False)
+    id_date = Column(Integer, ForeignKey('public.date.id'), nullable=False)
+    year = Column(Integer, nullable=False)
     mass = Column(Float, nullable=False)
     
     # Relationships
@@ -110,4 +137,49 @@ class Meteorite(Base):
     date = relationship("Date", backref="meteorites")
 
     def __repr__(self):
-        return f"<Meteorite(id_location={self.id_location}, id_classification={self.id_classification}, id_date={self.id_date}, mass={self.mass})>"
\ No newline at end of file
+        return f"<Meteorite(id={self.id}, nasa_id={self.nasa_id}, id_location={self.id_location}, id_classification={self.id_classification}, id_date={self.id_date}, mass={self.mass})>"
+
+class EtlRecordState(Base):
+    """
+    Represents the state of a NASA record already loaded, used by the incremental runs
+    to skip the records not changed since the last run.
+
+    Attributes:
+        nasa_id (int): Primary key, the id of the record in the NASA dataset.
+        content_hash (str): The SHA-256 of the raw record.
+        loaded_at (datetime): When the record has been loaded.
+    """
+    __tablename__ = 'etl_record_state'
+    __table_args__ = {'schema': 'public'}
+
+    nasa_id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), nullable=False)
+    loaded_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<EtlRecordState(nasa_id={self.nasa_id}, content_hash={self.content_hash})>"
+
+class EtlRun(Base):
+    """
+    Represents a run of the ETL process with its high-water mark.
+
+    Attributes:
+        id (int): Primary key, unique identifier for the run.
+        mode (str): The mode of the run ('full' or 'incremental').
+        started_at (datetime): When the run started.
+        finished_at (datetime): When the run finished.
+        high_water_mark (str): The greatest NASA update timestamp (:updated_at) loaded by the run.
+        records (int): The number of records loaded by the run.
+    """
+    __tablename__ = 'etl_run'
+    __table_args__ = {'schema': 'public'}
+
+    id = Column(Integer, Sequence('etl_run_id_seq'), primary_key=True, autoincrement=True)
+    mode = Column(String(32), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    high_water_mark = Column(String(64))
+    records = Column(Integer)
+
+    def __repr__(self):
+        return f"<EtlRun(id={self.id}, mode={self.mode}, high_water_mark={self.high_water_mark})>"
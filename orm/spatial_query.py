@@ -0,0 +1,146 @@
+"""
+SpatialQuery Class for the spatial searches over the meteorite facts
+
+Author: Giuseppe Valente <valentepeppe@gmail.com>
+
+This module defines the SpatialQuery class, the searches of the meteorites by position run in
+PostGIS on the point (geog) of the location dimension and use its GiST indexes, instead of
+reading all the facts and computing the distances in Python:
+- within_bbox: the meteorites inside a box of coordinates.
+- within_radius: the meteorites within a distance from a point.
+- nearest: the k meteorites nearest to a point.
+The distances are in meters on the sphere.
+
+Dependencies:
+- sqlalchemy: For the database connection.
+- PostGIS: The geog column and its indexes are created by init-scripts/init.sql.
+
+Usage:
+    - Create an instance of SpatialQuery.
+    - Call within_bbox, within_radius or nearest, every method returns a list of dict.
+"""
+
+from sqlalchemy import create_engine, text
+from typing import List
+import os
+
+class SpatialQuery:
+
+    """
+    Searches the meteorites by the position of their location.
+
+    The conditions are on the location dimension, so the GiST indexes select the few locations
+    matching and only their facts are joined. Every result is a dict with nasa_id, mass,
+    latitude, longitude, city, state, country, classification and date, plus the distance
+    in meters from the point for within_radius and nearest.
+    """
+
+    _COLUMNS = """m.nasa_id, m.mass, l.latitude, l.longitude, l.city, l.state, l.country,
+                  c.classification, d.date"""
+
+    _JOIN_DIMENSIONS = """JOIN public.classification c ON c.id = m.id_classification
+                          JOIN public.date d ON d.id = m.id_date"""
+
+    _POINT = "ST_SetSRID(ST_MakePoint(:longitude, :latitude), 4326)::geography"
+
+    # The bounding box operator on the geometry cast uses the location_geom_idx index
+    _WITHIN_BBOX = f"""
+        SELECT {_COLUMNS}
+        FROM public.location l
+        JOIN public.meteorite m ON m.id_location = l.id
+        {_JOIN_DIMENSIONS}
+        WHERE {{boxes}}
+        ORDER BY m.nasa_id
+        LIMIT :limit"""
+
+    # ST_DWithin on the geography uses the location_geog_idx index
+    _WITHIN_RADIUS = f"""
+        SELECT {_COLUMNS}, ST_Distance(l.geog, {_POINT}, false) AS distance
+        FROM public.location l
+        JOIN public.meteorite m ON m.id_location = l.id
+        {_JOIN_DIMENSIONS}
+        WHERE ST_DWithin(l.geog, {_POINT}, :radius, false)
+        ORDER BY distance, m.nasa_id
+        LIMIT :limit"""
+
+    # The k nearest locations having facts are read in distance order from the location_geog_idx index,
+    # they hold at least the k nearest meteorites
+    _NEAREST = f"""
+        SELECT {_COLUMNS}, l.distance
+        FROM (
+            SELECT l.id, l.latitude, l.longitude, l.city, l.state, l.country, l.geog <-> {_POINT} AS distance
+            FROM public.location l
+            WHERE EXISTS (SELECT 1 FROM public.meteorite f WHERE f.id_location = l.id)
+            ORDER BY l.geog <-> {_POINT}
+            LIMIT :k
+        ) l
+        JOIN public.meteorite m ON m.id_location = l.id
+        {_JOIN_DIMENSIONS}
+        ORDER BY l.distance, m.nasa_id
+        LIMIT :k"""
+
+    def __init__(self, database_url=None):
+
+        """
+        Initialize the SpatialQuery instance.
+
+        :param database_url: The database URL, the DATABASE_URL environment variable if None.
+        """
+        self.__engine = create_engine(database_url or os.getenv("DATABASE_URL"))
+
+    def within_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude, limit=None) -> List[dict]:
+        """
+        Return the meteorites inside the box, the borders included, ordered by NASA id.
+        A box with min_longitude greater than max_longitude crosses the antimeridian.
+
+        :param min_latitude: The southern border in degrees.
+        :param min_longitude: The western border in degrees.
+        :param max_latitude: The northern border in degrees.
+        :param max_longitude: The eastern border in degrees.
+        :param limit: The maximum number of meteorites, None for all.
+        :return: A list of dict, one for each meteorite.
+        """
+        if min_latitude > max_latitude:
+            raise ValueError("min_latitude is greater than max_latitude")
+        box = "l.geog::geometry && ST_MakeEnvelope({}, :min_latitude, {}, :max_latitude, 4326)"
+        if min_longitude <= max_longitude:
+            boxes = box.format(":min_longitude", ":max_longitude")
+        else:
+            boxes = f"({box.format(':min_longitude', '180')} OR {box.format('-180', ':max_longitude')})"
+        return self.__execute(self._WITHIN_BBOX.format(boxes=boxes), {
+            "min_latitude": min_latitude, "min_longitude": min_longitude,
+            "max_latitude": max_latitude, "max_longitude": max_longitude,
+            "limit": limit
+        })
+
+    def within_radius(self, latitude, longitude, radius, limit=None) -> List[dict]:
+        """
+        Return the meteorites within radius meters from the point, ordered by distance.
+
+        :param latitude: The latitude of the point in degrees.
+        :param longitude: The longitude of the point in degrees.
+        :param radius: The distance in meters.
+        :param limit: The maximum number of meteorites, None for all.
+        :return: A list of dict, one for each meteorite, with the distance.
+        """
+        return self.__execute(self._WITHIN_RADIUS, {
+            "latitude": latitude, "longitude": longitude, "radius": radius, "limit": limit
+        })
+
+    def nearest(self, latitude, longitude, k=10) -> List[dict]:
+        """
+        Return the k meteorites nearest to the point, ordered by distance.
+
+        :param latitude: The latitude of the point in degrees.
+        :param longitude: The longitude of the point in degrees.
+        :param k: The number of meteorites.
+        :return: A list of dict, one for each meteorite, with the distance.
+        """
+        return self.__execute(self._NEAREST, {"latitude": latitude, "longitude": longitude, "k": k})
+
+    def __execute(self, statement, parameters) -> List[dict]:
+        """
+        Run the statement and return its rows as dict.
+        """
+        with self.__engine.connect() as connection:
+            return [dict(row) for row in connection.execute(text(statement), parameters).mappings()]